@@ -0,0 +1,177 @@
+"""
+Registry of novel categories proposed by the classifier.
+
+Categories are indexed in memory under a normalized key (case-folded, with
+whitespace and surrounding punctuation collapsed), and a name close enough to
+an existing one (difflib ratio at or above `similarity`) is merged into it, so
+"Multi-part Question", "multi-part questions" and "Multipart Question" end up
+as one entry. Each observation is appended as one line to
+`{prefix}_novel_categories.delta.jsonl`. Every `compact_every` observations
+(and on close) the registry is compacted into `{prefix}_novel_categories.json`,
+which keeps its original layout plus an `aliases` list per category, and the
+delta log is truncated. Names only resolved (never observed) are left out of it.
+"""
+import difflib
+import json
+import os
+import re
+import threading
+
+_SEPARATORS = re.compile(r"[\s_\-/]+")
+_EDGE_PUNCTUATION = re.compile(r"^\W+|\W+$")
+
+
+def normalize_category(name):
+    """Registry key for a category name"""
+    key = _SEPARATORS.sub(" ", name.casefold()).strip()
+    return _EDGE_PUNCTUATION.sub("", key)
+
+
+class CategoryRegistry:
+    """
+    Thread-safe in-memory index of novel categories with append-only persistence.
+
+    Parameters:
+    - prefix (str): Output prefix; files are `{prefix}_novel_categories.json` and `.delta.jsonl`.
+    - similarity (float): difflib ratio at which two normalized names are merged.
+    - max_examples (int): Example prompts kept per category.
+    - compact_every (int): Observations between compactions.
+    """
+
+    def __init__(self, prefix, similarity=0.9, max_examples=5, compact_every=1000):
+        self.snapshot_file = f"{prefix}_novel_categories.json"
+        self.delta_file = f"{prefix}_novel_categories.delta.jsonl"
+        self.similarity = similarity
+        self.max_examples = max_examples
+        self.compact_every = compact_every
+
+        self.categories = {}  # canonical name -> {"description", "examples", "count", "aliases"}
+        self._keys = {}  # normalized key of the canonical name or any alias -> canonical name
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._load()
+        self._deltas = open(self.delta_file, "a", encoding="utf-8")
+
+    def _load(self):
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                try:
+                    snapshot = json.load(f)
+                except json.JSONDecodeError:
+                    snapshot = {}
+            for name, entry in snapshot.items():
+                self.categories[name] = {
+                    "description": entry.get("description", ""),
+                    "examples": entry.get("examples", []),
+                    "count": entry.get("count", 0),
+                    "aliases": entry.get("aliases", []),
+                }
+                self._keys[normalize_category(name)] = name
+                for alias in self.categories[name]["aliases"]:
+                    self._keys[normalize_category(alias)] = name
+
+        # Replay observations made after the last compaction
+        if os.path.exists(self.delta_file):
+            with open(self.delta_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        delta = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-write
+                        continue
+                    self._apply(delta["name"], delta.get("description", ""), delta.get("example"))
+                    self._pending += 1
+
+    def _canonical(self, name):
+        key = normalize_category(name)
+        if key in self._keys:
+            return self._keys[key]
+        match = difflib.get_close_matches(key, self._keys.keys(), n=1, cutoff=self.similarity)
+        if match:
+            canonical = self._keys[match[0]]
+            # Remember the spelling so the next occurrence is an exact lookup
+            self._keys[key] = canonical
+            if name != canonical and name not in self.categories[canonical]["aliases"]:
+                self.categories[canonical]["aliases"].append(name)
+            return canonical
+        return None
+
+    def _register(self, name, description):
+        canonical = self._canonical(name)
+        if canonical is None:
+            canonical = name
+            self.categories[name] = {"description": description, "examples": [], "count": 0, "aliases": []}
+            self._keys[normalize_category(name)] = name
+            return canonical, True
+        return canonical, False
+
+    def _apply(self, name, description, example):
+        canonical, is_new = self._register(name, description)
+        entry = self.categories[canonical]
+        entry["count"] += 1
+        if example is not None and len(entry["examples"]) < self.max_examples:
+            entry["examples"].append(example)
+        return canonical, is_new
+
+    def canonical(self, name):
+        """Registered name `name` resolves to, or None if it is unknown"""
+        with self._lock:
+            return self._canonical(name)
+
+    def resolve(self, name, description):
+        """
+        Canonical name for `name`, registering it in memory (not counted or persisted) if it is new,
+        so later spellings merge into it before its first occurrence is observed.
+
+        Returns:
+        - tuple: (canonical category name, True if it was not seen before)
+        """
+        with self._lock:
+            return self._register(name, description)
+
+    def observe(self, name, description, example=None):
+        """
+        Record one occurrence of a novel category.
+
+        Returns:
+        - tuple: (canonical category name, True if it was not seen before)
+        """
+        with self._lock:
+            canonical, is_new = self._apply(name, description, example)
+            delta = {"name": name, "description": description, "example": example}
+            self._deltas.write(json.dumps(delta, ensure_ascii=False) + "\n")
+            self._deltas.flush()
+            self._pending += 1
+            if self._pending >= self.compact_every:
+                self._compact()
+            return canonical, is_new
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        # Resolved names whose rows were never written (e.g. an interrupted run) are not persisted
+        observed = {name: entry for name, entry in self.categories.items() if entry["count"]}
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(observed, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+        # Everything in the delta log is now covered by the snapshot
+        self._deltas.truncate(0)
+        self._deltas.seek(0)
+        self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._compact()
+            self._deltas.close()
+
+    def __len__(self):
+        return len(self.categories)
+
+    def __contains__(self, name):
+        return self.canonical(name) is not None
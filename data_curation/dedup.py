@@ -0,0 +1,147 @@
+"""
+Near-duplicate prompt clustering with MinHash and locality-sensitive hashing.
+
+Chat corpora contain many templated prompts that differ only in a few words.
+`NearDuplicateIndex` maps each prompt to an earlier "representative" whose
+estimated Jaccard similarity over character shingles is above a threshold,
+and `LabelFanout` lets the pipeline classify only the representatives and
+copy their label to every other member of the cluster.
+
+Only representatives are indexed, so memory grows with the number of unique
+prompts rather than the number of rows.
+"""
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# Mersenne prime for the universal hash family; coefficients stay below 2**31
+# so a * x + b fits in uint64 for 32-bit shingle hashes
+_PRIME = np.uint64((1 << 31) - 1)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalized(text):
+    """Text with whitespace runs collapsed; members equal to their representative under it are exact duplicates"""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class NearDuplicateIndex:
+    """
+    Streaming MinHash LSH index over prompts.
+
+    Parameters:
+    - threshold (float): Estimated Jaccard similarity needed to join a cluster.
+    - num_perm (int): Number of MinHash permutations (signature length).
+    - bands (int): LSH bands; `num_perm` must be divisible by it.
+    - ngram (int): Character shingle length.
+    - seed (int): Seed for the hash coefficients.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=64, bands=16, ngram=5, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(_PRIME), size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, int(_PRIME), size=num_perm).astype(np.uint64)
+
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+
+    def shingles(self, text):
+        text = normalized(text.casefold())
+        if len(text) <= self.ngram:
+            return {text}
+        return {text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)}
+
+    def signature(self, text):
+        """MinHash signature of a text as a uint32 array of length num_perm"""
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in self.shingles(text)), dtype=np.uint64
+        )
+        # (shingles x permutations) matrix of permuted hashes, minimized per permutation
+        permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) % _PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [band.tobytes() for band in signature.reshape(self.bands, self.rows)]
+
+    def add(self, key, signature):
+        """Index `key` as a cluster representative"""
+        self._signatures[key] = signature
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def query(self, signature):
+        """Most similar indexed representative at or above the threshold, or None"""
+        candidates = set()
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+
+        best, best_similarity = None, self.threshold
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = key, similarity
+        return best
+
+    def assign(self, key, text):
+        """Return the representative `text` duplicates, or index it as a new representative and return None"""
+        signature = self.signature(text)
+        representative = self.query(signature)
+        if representative is None:
+            self.add(key, signature)
+        return representative
+
+    def __len__(self):
+        return len(self._signatures)
+
+
+class LabelFanout:
+    """
+    Routes prompts to their cluster representative and fans labels back out.
+
+    A prompt is either a new representative (to be classified), a member whose
+    representative is already labeled (resolved immediately), or a member
+    parked until its representative's label arrives via `resolve`.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.labels = {}
+        self.waiting = {}
+        self.members = 0
+        self._lock = threading.Lock()
+
+    def route(self, key, text):
+        """
+        Returns:
+        - tuple: (representative key or None, label or None). A None representative
+          means `key` is itself a representative and must be classified.
+        """
+        with self._lock:
+            representative = self.index.assign(key, text)
+            if representative is None:
+                return None, None
+            self.members += 1
+            if representative in self.labels:
+                return representative, self.labels[representative]
+            self.waiting.setdefault(representative, []).append((key, text))
+            return representative, None
+
+    def resolve(self, representative, label):
+        """Record a representative's label and return the members that were waiting for it"""
+        with self._lock:
+            self.labels[representative] = label
+            return self.waiting.pop(representative, [])
+
+    @property
+    def pending(self):
+        return sum(len(members) for members in self.waiting.values())
@@ -4,437 +4,386 @@ import time
 import re
 from tqdm import tqdm
 import json
-import boto3
-from datasets import load_dataset
-import csv
 import uuid
+import sys
+import copy
+import asyncio
+import contextvars
 from concurrent.futures import ThreadPoolExecutor
 import backoff
 import argparse
+from collections import deque
+from itertools import islice
+from sources import open_records, source_prefix
+from journal import ProgressJournal
+from dedup import LabelFanout, NearDuplicateIndex, normalized
+from validator import PASSING_TIERS, HeuristicValidator, reject, schema_errors
+from sinks import FIELD_NAMES, OUTPUT_FORMATS, BatchedSink, JsonlWriter, open_writer, output_path
+from validation_stats import ValidationStats
+from categories import CategoryRegistry
+from stub_endpoint import stub_response
 
-AWS_KEY = os.getenv("AWS_KEY")
-AWS_SECRET_KEY = os.getenv("AWS_SECRET_KEY")
-AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parallelprompt import tracing
+from parallelprompt.aimd import AIMDController, run_windowed
+from parallelprompt.backends import DEFAULT_MODELS, add_backend_arguments, backend_from_args
+from parallelprompt.batch import add_batch_arguments, custom_id, run_batch
+from parallelprompt.cache import ResponseCache, make_key
 
-if not AWS_KEY or not AWS_SECRET_KEY:
-    raise ValueError("Missing AWS credentials. Please set AWS_KEY and AWS_SECRET_KEY as env vars.")
+TEMPERATURE = 0.2  # Moderate temperature with validation step in place
+MAX_TOKENS = 1024
 
-# Configure AWS Bedrock
-bedrock = boto3.client(
-    service_name="bedrock-runtime",
-    region_name=AWS_REGION,
-    aws_access_key_id=AWS_KEY, 
-    aws_secret_access_key=AWS_SECRET_KEY
-)
+# Model backend (Bedrock by default); created in main(), so importing this
+# module or running with a mock backend needs no AWS credentials
+backend = None
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset", type=str, required=True, default="lmsys/lmsys-chat-1m",
-                        help="HuggingFace dataset name, e.g., lmsys/lmsys-chat-1m or allenai/WildChat-1M")
+                        help="HuggingFace dataset name, e.g., lmsys/lmsys-chat-1m or allenai/WildChat-1M, "
+                             "or a local Parquet/JSONL file, directory or glob")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Stream hub datasets shard by shard instead of downloading them in full "
+                             "(local files are always streamed)")
+    parser.add_argument("--split", type=str, default="train", help="Dataset split to process")
+    parser.add_argument("--cache", type=str, default="response_cache.sqlite",
+                        help="SQLite response cache shared across runs and datasets")
+    parser.add_argument("--cache-size-mb", type=int, default=2048,
+                        help="Evict least-recently-used cache entries beyond this size")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Classify one representative per cluster of near-duplicate prompts (MinHash LSH) "
+                             "and copy its label to the other members")
+    parser.add_argument("--dedup-threshold", type=float, default=0.85,
+                        help="Estimated Jaccard similarity over character shingles for two prompts to share a cluster")
+    parser.add_argument("--output-format", type=str, choices=OUTPUT_FORMATS, default="csv",
+                        help="Results format; parquet writes a directory with one part file per run")
+    parser.add_argument("--flush-rows", type=int, default=256,
+                        help="Results buffered before the writer thread appends them to the output files")
+    parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help="Seconds a partially filled buffer may wait before it is written")
+    parser.add_argument("--category-similarity", type=float, default=0.9,
+                        help="Similarity (0-1) at which a proposed novel category name is merged into a known one")
+    parser.add_argument("--stats-interval", type=float, default=5.0,
+                        help="Seconds between background writes of the validation stats file")
+    parser.add_argument("--mode", type=str, choices=["batch", "async", "batch-job"], default="batch",
+                        help="batch: fixed-size thread batches; async: rolling request window with adaptive concurrency; "
+                             "batch-job: offline provider batch jobs (cheaper, results within hours)")
+    parser.add_argument("--initial-concurrency", type=int, default=4,
+                        help="Async mode: requests in flight at start")
+    parser.add_argument("--max-concurrency", type=int, default=64,
+                        help="Async mode: upper bound on requests in flight")
+    parser.add_argument("--latency-target", type=float, default=None,
+                        help="Async mode: shrink the window when a request takes longer than this many seconds")
+    parser.add_argument("--batch-job-size", type=int, default=1000,
+                        help="Batch-job mode: prompts per submitted job")
+    add_batch_arguments(parser, default_dir="batch_jobs")
+    add_backend_arguments(parser, default="bedrock")
     return parser.parse_args()
 
-dataset_name = parse_args().dataset
-prefix = dataset_name.split("-")[0].split("/")[1].lower()
+args = parse_args()
+dataset_name = args.dataset
+prefix = source_prefix(dataset_name)
 
-# Load the dataset
-print(f"Loading {dataset_name} ...")
-dataset = load_dataset(dataset_name)
+# Responses keyed by (normalized prompt, system prompt, model, temperature)
+response_cache = None if args.no_cache else ResponseCache(args.cache, max_bytes=args.cache_size_mb * 1024 ** 2)
+
+# Near-duplicate clusters: only representatives are sent to the model
+near_duplicates = LabelFanout(NearDuplicateIndex(threshold=args.dedup_threshold)) if args.dedup else None
+dedup_clusters_file = f"{prefix}_dedup_clusters.jsonl"
+# Members whose representative is parallelizable but whose prompt differs from it: the
+# representative's schema does not apply to them, so they are classified in a second pass
+members_to_classify = deque()
 
 # Output file setup
-field_names = ["index", "query_id", "prompt", "parallelizable", "category", "is_novel_category", "category_description", 
-               "serial", "template", "context", "data", "n", "validation_passed", "validation_tier", "timestamp"]
-output_file = f"{prefix}_parallelizable_queries.csv"
+field_names = FIELD_NAMES
+output_file = output_path(prefix, args.output_format)
 validation_stats_file = f"{prefix}_validation_stats.json"
 
-# Setup for tracking novel categories in a separate file
-novel_categories_file = f"{prefix}_novel_categories.json"
-novel_categories_lock = {}
-
-# Initialize CSV if it doesn't exist
-if not os.path.exists(output_file):
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(
-            csvfile, 
-            fieldnames=field_names,
-            quoting=csv.QUOTE_ALL,
-            quotechar='"',
-            escapechar='\\'
-        )
-        writer.writeheader()
+# Raw model verdicts, so tiers can be recomputed offline with revalidate.py
+verdicts_file = f"{prefix}_model_verdicts.jsonl"
 
-# Initialize novel categories tracking file
-if os.path.exists(novel_categories_file):
-    with open(novel_categories_file, 'r') as f:
-        try:
-            novel_categories_lock = json.load(f)
-        except json.JSONDecodeError:
-            novel_categories_lock = {}
-else:
-    with open(novel_categories_file, 'w') as f:
-        json.dump({}, f)
-
-# Initialize validation stats tracking
-validation_stats = {
-    "total_classified_as_parallelizable": 0,
-    "failed_validation": 0,
-    "passed_validation": 0,
-    "categories_failed": {},
-    "categories_passed": {}
-}
-
-if os.path.exists(validation_stats_file):
-    with open(validation_stats_file, 'r') as f:
-        try:
-            validation_stats = json.load(f)
-        except json.JSONDecodeError:
-            pass
+# Novel categories, merged under normalized names and persisted as append-only deltas
+novel_categories = CategoryRegistry(prefix, similarity=args.category_similarity)
+
+# Initialize validation stats tracking (per-thread shards, merged on read)
+validation_stats = ValidationStats.load(validation_stats_file)
+
+# Structural checks compiled once and shared by all workers
+validator = HeuristicValidator()
 
 def load_system_message(filepath="system_prompt.txt"):
     with open(filepath, "r", encoding="utf-8") as f:
         return f.read()
 
+def fallback_result(prompt):
+    """Classification used when the model response cannot be parsed"""
+    return {
+        "parallelizable": False,
+        "category": None,
+        "is_novel_category": False,
+        "category_description": None,
+        "serial": prompt,
+        "template": None,
+        "context": None,
+        "data": None,
+        "n": None
+    }
+
+def extract_verdict(response_text):
+    """The classification JSON in Claude's response text, or None if there is none"""
+    # Since we removed response_format, we need to extract the JSON from the response
+    # Claude will sometimes add explanation before or after the JSON
+    candidates = [response_text]
+    json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
+    if json_match:
+        candidates.append(json_match.group(1))
+    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if json_match:
+        candidates.append(json_match.group(0))
+    for candidate in candidates:
+        try:
+            verdict = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(verdict, dict) and "parallelizable" in verdict:
+            return verdict
+    return None
+
+def parse_model_response(response_text, prompt, index):
+    """Extract the classification JSON from Claude's response text"""
+    verdict = extract_verdict(response_text)
+    if verdict is None:
+        print(f"Failed to extract JSON at index {index}, using fallback")
+        return fallback_result(prompt)
+    return verdict
+
+def cache_response(cache_key, response_text):
+    """Cache a model response, unless it has no usable verdict (so it is asked again next time)"""
+    if cache_key is not None and extract_verdict(response_text) is not None:
+        response_cache.put(cache_key, response_text)
+
+def cached_response(cache_key):
+    """A cached model response with a usable verdict, or None"""
+    if cache_key is None:
+        return None
+    response_text = response_cache.get(cache_key)
+    if response_text is None or extract_verdict(response_text) is None:
+        return None
+    return response_text
+
+def user_message(prompt):
+    return f"Analyze this prompt: {prompt}"
+
+def response_cache_key(prompt, system_message):
+    if response_cache is None:
+        return None
+    return make_key(prompt, system_message, backend.model, TEMPERATURE, {"max_tokens": MAX_TOKENS})
+
+def invoke_model(prompt, index):
+    """Single model request without retries; errors propagate to the caller"""
+    system_message = load_system_message()
+
+    cache_key = response_cache_key(prompt, system_message)
+    response_text = cached_response(cache_key)
+    if response_text is not None:
+        return parse_model_response(response_text, prompt, index)
+    
+    # Fixed API request without response_format which isn't supported in Bedrock
+    response = backend.complete_sync(system_message, user_message(prompt),
+                                     max_tokens=MAX_TOKENS, temperature=TEMPERATURE)
+    response_text = response["text"]
+    cache_response(cache_key, response_text)
+    return parse_model_response(response_text, prompt, index)
+
 # Exponential backoff for API rate limits
 @backoff.on_exception(backoff.expo, 
-                      (boto3.exceptions.Boto3Error, 
-                       Exception),
+                      Exception,
                       max_tries=8,
                       base=2,
-                      factor=3)
-def call_bedrock_api(prompt, index):
-    """Call Bedrock API with exponential backoff for rate limits"""
-    system_message = load_system_message()
-    
-    # Fixed API request without response_format which isn't supported in Bedrock
-    body = json.dumps({
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 1024,
-        "temperature": 0.2,  # Moderate temperature with validation step in place
-        "system": system_message,
-        "messages": [
-            {"role": "user", "content": f"Analyze this prompt: {prompt}"}
-        ]
-    })
-    
+                      factor=3,
+                      on_backoff=lambda details: tracing.note_backoff(details["wait"]))
+def call_model_api(prompt, index):
+    """Call the model backend with exponential backoff for rate limits"""
     try:
-        response = bedrock.invoke_model(
-            modelId="us.anthropic.claude-3-5-haiku-20241022-v1:0",  # Using Claude 3.5 Haiku
-            body=body
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        response_text = response_body['content'][0]['text']
-        
-        # Since we removed response_format, we need to extract the JSON from the response
-        # Claude will sometimes add explanation before or after the JSON
-        try:
-            # Try to parse the entire response as JSON first
-            parsed_json = json.loads(response_text)
-            return parsed_json
-        except json.JSONDecodeError:
-            # If that fails, try to extract JSON from the text
-            import re
-            json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group(1))
-                except json.JSONDecodeError:
-                    pass
-                    
-            # If that fails too, try to find json block with curly braces
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group(0))
-                except json.JSONDecodeError:
-                    # Last resort fallback
-                    print(f"Failed to parse JSON at index {index}, using fallback")
-                    return {
-                        "parallelizable": False,
-                        "category": None,
-                        "is_novel_category": False,
-                        "category_description": None,
-                        "serial": prompt,
-                        "template": None,
-                        "context": None,
-                        "data": None,
-                        "n": None
-                    }
-            
-            # If all parsing attempts fail
-            print(f"Failed to extract JSON at index {index}, using fallback")
-            return {
-                "parallelizable": False,
-                "category": None,
-                "is_novel_category": False,
-                "category_description": None,
-                "serial": prompt,
-                "template": None,
-                "context": None,
-                "data": None,
-                "n": None
-            }
-            
+        return invoke_model(prompt, index)
     except Exception as e:
         print(f"API call failed for index {index}: {str(e)}")
         raise
 
 def validate_parallelizable(result, prompt):
     """Second check to validate if a query is truly parallelizable"""
-    global validation_stats
-    
     # 1. If Claude already said it's not parallelizable, accept that
     if not result.get("parallelizable", False):
         result["validation_tier"] = "not_parallelizable"
+        validation_stats.record_model_rejected()
         return result
     
-    validation_stats["total_classified_as_parallelizable"] += 1
     category = result.get("category", "Unknown")
     
     # 2. Check schema integrity first
-    schema_valid = True
-    
-    # Check mutual exclusivity of data and n
-    if result.get("data") is not None and result.get("n") is not None:
-        schema_valid = False
-        print(f"Schema error: Both 'data' and 'n' fields populated for index {result.get('index')}")
-    
-    # Check data field format
-    data = result.get("data")
-    if data is not None:
-        if not isinstance(data, list):
-            schema_valid = False
-            print(f"Schema error: 'data' is not a list for index {result.get('index')}")
-        elif len(data) < 2:
-            schema_valid = False
-            print(f"Schema error: 'data' list contains fewer than 2 items for index {result.get('index')}")
-        elif any(not isinstance(item, str) for item in data):
-            schema_valid = False
-            print(f"Schema error: 'data' contains non-string items for index {result.get('index')}")
-    
-    # Check n field format
-    n = result.get("n")
-    if n is not None:
-        if not isinstance(n, (int, float)) or n < 2:
-            schema_valid = False
-            print(f"Schema error: 'n' is not a valid number > 1 for index {result.get('index')}")
-    
-    # Check template format
-    template = result.get("template")
-    if template is not None:
-        if category == "Repeated Generation" and "{n}" in template:
-            schema_valid = False
-            print(f"Schema error: Repeated Generation template contains '{{n}}' for index {result.get('index')}")
-        elif category != "Repeated Generation" and (not "{data}" in template and not "{context}" in template):
-            schema_valid = False
-            print(f"Schema error: Non-Repeated Generation template missing placeholders for index {result.get('index')}")
+    errors = schema_errors(result)
+    for error in errors:
+        print(f"Schema error: {error} for index {result.get('index')}")
+    schema_valid = not errors
     
     # 3. If schema is invalid, fail validation immediately
     if not schema_valid:
-        result["parallelizable"] = False
-        result["category"] = None
-        result["is_novel_category"] = False
-        result["category_description"] = None
-        result["template"] = None
-        result["context"] = None
-        result["data"] = None
-        result["n"] = None
+        reject(result)
         result["validation_tier"] = "not_parallelizable"
-        validation_stats["failed_validation"] += 1
-        
-        if category in validation_stats["categories_failed"]:
-            validation_stats["categories_failed"][category] += 1
-        else:
-            validation_stats["categories_failed"][category] = 1
-            
+        validation_stats.record(category, "not_parallelizable")
         return result
     
     # 4. Proceed with content-based validation
-    prompt_lower = prompt.lower()
-    
-    # More comprehensive verb and object lists
-    verbs = r'(generate|create|write|make|give|provide|list|show|tell|name|identify|find|spot|translate|correct|develop|produce|craft|prepare|construct|compile|analyze|evaluate|compare|contrast|offer|suggest|need|want|require|discuss)'
-    
-    objects = r'(examples?|stories?|variations?|ideas?|options?|questions?|sentences?|paragraphs?|items?|tasks?|entities?|keywords?|words?|phrases?|translations?|summaries?|reports?|reviews?|analyses?|cases?|scenarios?|characters?|profiles?|descriptions?|suggestions?|recommendations?)'
-    
-    # Check for explicit numeric requests with expanded patterns
-    has_numeric_request = bool(re.search(fr'\b{verbs}?\s*\d+\s*{objects}\b', prompt_lower))
-    
-    # Check for explicit list markers (enhanced for multi-language support)
-    has_list_markers = bool(re.search(r'\b(following|these|each of|all of|todos?|las?s?|die|der|das|les?|la|il|и|и|и)\s+(questions?|items?|prompts?|sentences?|paragraphs?|tasks?|texts?|statements?|passages?|preguntas?|frases?|fragen|sätze|questions|phrases|вопросы|предложения)\b', prompt_lower))
-    
-    # Check for multiple numbered items in the prompt (enhanced pattern)
-    has_numbered_items = len(re.findall(r'(?:\d+[\.\)\:]|(?:\n[-•*]\s+))', prompt)) > 1
-    
-    # Check for multiple questions in sequence (enhanced pattern)
-    has_multiple_questions = len(re.findall(r'\?[\s\n]+', prompt)) > 1
-    
-    # Check for list format with bullets or dashes
-    has_bullet_list = len(re.findall(r'(\n\s*[-•*]\s+|\n\s*\d+[\.\)]\s+)', prompt)) > 1
-    
-    # Check for keywords like "multiple" or "each" (enhanced for multi-language)
-    has_multiplicity_markers = bool(re.search(r'\b(multiple|several|each|all|every|various|respectively|varios?s?|plusieurs|mehrere|多个|многие)\b', prompt_lower))
-    
-    # NEW: Check for comma-separated lists (at least 3 items)
-    has_comma_list = bool(re.search(r'\b\w+\b\s*,\s*\b\w+\b\s*(?:,\s*(?:and\s+)?\b\w+\b)+', prompt_lower))
-    
-    # NEW: Check for "for each" pattern
-    has_for_each_pattern = bool(re.search(r'\bfor\s+(every|each)\b', prompt_lower))
-    
-    # NEW: Check for plural nouns followed by list
-    has_plural_list = bool(re.search(r'\b\w+s\b\s*[:;]\s*\b', prompt_lower))
+    validation_tier = validator.tier(prompt, result)
     
-    # Check if data/n looks good
-    data_array = result.get("data", [])
-    has_parallel_data = isinstance(data_array, list) and len(data_array) > 1
-    
-    n_value = result.get("n")
-    has_multiple_n = isinstance(n_value, (int, float)) and n_value > 1
-    
-    # High confidence validation logic - strict criteria
-    high_confidence = (
-        has_numeric_request or 
-        has_list_markers or 
-        has_numbered_items or 
-        has_bullet_list or
-        has_multiple_questions or
-        (has_multiplicity_markers and (has_parallel_data or has_multiple_n))
-    )
-    
-    # NEW: Medium confidence validation - more permissive criteria
-    medium_confidence = (
-        has_comma_list or 
-        has_for_each_pattern or
-        has_plural_list or
-        category in ["Reading Comprehension", "Named Entity Recognition", "Translation"] or
-        (has_parallel_data and len(data_array) >= 3)
-    )
-    
-    # Determine validation tier
-    if high_confidence:
-        validation_tier = "high_confidence"
-        validation_stats["passed_validation"] += 1
-        if category in validation_stats["categories_passed"]:
-            validation_stats["categories_passed"][category] += 1
-        else:
-            validation_stats["categories_passed"][category] = 1
-    elif medium_confidence:
-        validation_tier = "medium_confidence"
-        validation_stats["passed_validation"] += 1
-        if category in validation_stats["categories_passed"]:
-            validation_stats["categories_passed"][category] += 1
-        else:
-            validation_stats["categories_passed"][category] = 1
-    else:
-        validation_tier = "low_confidence"
-        result["parallelizable"] = False
-        result["category"] = None
-        result["is_novel_category"] = False
-        result["category_description"] = None
-        result["template"] = None
-        result["context"] = None
-        result["data"] = None
-        result["n"] = None
-        validation_stats["failed_validation"] += 1
-        
-        if category in validation_stats["categories_failed"]:
-            validation_stats["categories_failed"][category] += 1
-        else:
-            validation_stats["categories_failed"][category] = 1
+    # Update stats for the assigned tier
+    validation_stats.record(category, validation_tier)
+    if validation_tier not in PASSING_TIERS:
+        reject(result)
     
     result["validation_tier"] = validation_tier
     
     # For backward compatibility
-    result["validation_passed"] = (validation_tier in ["high_confidence", "medium_confidence"])
+    result["validation_passed"] = (validation_tier in PASSING_TIERS)
     
     return result
 
+def finalize_result(result, prompt, index):
+    """Attach bookkeeping fields to a model classification and validate it"""
+    # Validation overwrites rejected fields, so keep the model's verdict as returned
+    verdict = copy.deepcopy(result)
+    result["model_verdict"] = verdict
+    result["index"] = index
+    result["query_id"] = str(uuid.uuid4())[:8]
+    result["prompt"] = prompt
+    result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    # Apply validation and update shared stats
+    return validate_parallelizable(result, prompt)
+
+def error_result(prompt, index):
+    """Result recorded for a prompt whose classification failed"""
+    return {
+        "index": index,
+        "query_id": str(uuid.uuid4())[:8],
+        "prompt": prompt,
+        "parallelizable": False,
+        "category": None,
+        "is_novel_category": False,
+        "category_description": None,
+        "serial": prompt,
+        "template": None,
+        "context": None,
+        "data": None,
+        "n": None,
+        "validation_tier": "not_parallelizable",
+        "validation_passed": False,
+        "error": True,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
 def is_parallelizable(prompt, index):
     """
     Use Claude to determine if a prompt is parallelizable.
     Returns a dict with the determination and explanation.
     """
     try:
-        result = call_bedrock_api(prompt, index)
-
-        result["index"] = index
-        result["query_id"] = str(uuid.uuid4())[:8]
-        result["prompt"] = prompt
-        result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
-
-        # Apply validation and update shared stats
-        result = validate_parallelizable(result, prompt)
-
-        return result
+        with tracing.span("classify", index=index), tracing.queued():
+            result = call_model_api(prompt, index)
+        return finalize_result(result, prompt, index)
     except Exception as e:
         print(f"Error analyzing prompt at index {index}: {e}")
-        return {
-            "index": index,
-            "query_id": str(uuid.uuid4())[:8],
-            "prompt": prompt,
-            "parallelizable": False,
-            "category": None,
-            "is_novel_category": False,
-            "category_description": None,
-            "serial": prompt,
-            "template": None,
-            "context": None,
-            "data": None,
-            "n": None,
-            "validation_tier": "not_parallelizable",
-            "validation_passed": False,
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-        }
+        return error_result(prompt, index)
     
-def save_to_csv(result):
-    """Save a single result to CSV file"""
-    # Only save parallelizable queries that passed validation
+def saved_row(result):
+    """Results output row: only parallelizable queries that passed validation are saved"""
     if not result.get("parallelizable", False):
-        return
-        
-    with open(output_file, 'a', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=field_names)
-        # Filter to only include fields we want in our CSV
-        row = {field: result.get(field, "") for field in field_names}
-        
-        # Convert lists to string representation for CSV
-        if isinstance(row.get("data"), list):
-            row["data"] = json.dumps(row["data"])
-            
-        writer.writerow(row)
+        return None
+    return result
+
+def verdict_entry(result):
+    """Verdicts log entry with the model's unvalidated verdict for a result"""
+    verdict = result.get("model_verdict")
+    if verdict is None:
+        return None
+    entry = {
+        "index": result["index"],
+        "query_id": result.get("query_id"),
+        "prompt": result["prompt"],
+        "timestamp": result.get("timestamp"),
+        "verdict": verdict,
+    }
+    if "representative_index" in result:
+        entry["representative_index"] = result["representative_index"]
+    return entry
+
+def cluster_entry(result):
+    """Dedup clusters log entry for a result labeled from its representative"""
+    if "representative_index" not in result:
+        return None
+    return {"index": result["index"], "representative_index": result["representative_index"]}
+
+def is_novel_row(result):
+    return saved_row(result) is not None and result.get("is_novel_category", False) and result.get("category")
+
+def observe_novel_categories(results):
+    """Record the novel categories of written rows in the registry"""
+    for result in results:
+        if not is_novel_row(result):
+            continue
+        novel_categories.observe(
+            result["category"],
+            result.get("category_description", ""),
+            {"prompt": result["prompt"][:500], "index": result["index"]}
+        )
+
+def journal_batch(results):
+    """
+    Mark a written batch done so a resumed run skips it, then count its novel categories
+    (called from the writer thread). Categories are only counted for journaled rows,
+    so rows a resumed run processes again are not counted twice.
+    """
+    journal.record_many([
+        (result["index"], "error" if result.get("error") else result.get("validation_tier", "not_parallelizable"))
+        for result in results
+    ])
+    observe_novel_categories(results)
+
+def open_results_sink():
+    """Start the writer thread that owns the results, verdicts and clusters files"""
+    outputs = [
+        (open_writer(output_file, args.output_format), saved_row),
+        (JsonlWriter(verdicts_file), verdict_entry),
+    ]
+    if near_duplicates is not None:
+        outputs.append((JsonlWriter(dedup_clusters_file), cluster_entry))
+    return BatchedSink(outputs, batch_size=args.flush_rows, flush_interval=args.flush_interval,
+                       on_flush=journal_batch)
 
 def save_validation_stats():
-    """Save validation statistics to file"""
-    with open(validation_stats_file, 'w') as f:
-        json.dump(validation_stats, f, indent=2)
-
-def update_novel_categories(category, description, example):
-    """Update the novel categories tracking file"""
-    novel_categories = {}
-    if os.path.exists(novel_categories_file):
-        with open(novel_categories_file, 'r') as f:
-            try:
-                novel_categories = json.load(f)
-            except json.JSONDecodeError:
-                novel_categories = {}
-    
-    if category not in novel_categories:
-        novel_categories[category] = {
-            "description": description,
-            "examples": [example],
-            "count": 1
-        }
-    else:
-        novel_categories[category]["count"] += 1
-        if len(novel_categories[category]["examples"]) < 5:  # Store up to 5 examples
-            novel_categories[category]["examples"].append(example)
-    
-    with open(novel_categories_file, 'w') as f:
-        json.dump(novel_categories, f, indent=2)
+    """Save validation statistics to file (skipped if nothing changed since the last save)"""
+    validation_stats.flush(validation_stats_file)
+
+def record_result(result):
+    """Persist a finished result; its novel category is counted once the row is on disk"""
+    # Near-identical names of registered categories are saved under the registered spelling
+    if is_novel_row(result):
+        cat, is_new = novel_categories.resolve(result["category"], result.get("category_description", ""))
+        result["category"] = cat
+        if is_new:
+            prompt = result["prompt"]
+            print(f"\n!!! NEW CATEGORY DISCOVERED: {cat} !!!")
+            print(f"Description: {result.get('category_description')}")
+            print(f"Example prompt: {prompt[:100]}...")
+
+    # Hand the result to the writer thread; it is journaled once it is on disk
+    results_sink.put(result)
 
 def process_prompt(args):
     """Process a single prompt (for use with ThreadPoolExecutor)"""
-    prompt, index, novel_categories = args
+    prompt, index = args
     
     # Skip processing if prompt is empty
     if not prompt or len(prompt) < 10:
@@ -442,145 +391,382 @@ def process_prompt(args):
     
     # Analyze the prompt
     result = is_parallelizable(prompt, index)
+    record_result(result)
+    return result
+
+def extract_prompt(item):
+    """Return the first user message of a conversation, or None if it is missing or too short"""
+    # Extract the user prompt (first message in the conversation)
+    messages = item.get("conversation", [])
+    if not messages:
+        return None
     
-    # Save result immediately
-    save_to_csv(result)
-    
-    # Track novel categories
-    if result.get("parallelizable", False) and result.get("is_novel_category", False):
-        cat = result.get("category")
-        if cat and cat not in novel_categories:
-            # Update novel categories file
-            update_novel_categories(
-                cat, 
-                result.get("category_description", ""), 
-                {"prompt": prompt[:500], "index": index}
-            )
-            print(f"\n!!! NEW CATEGORY DISCOVERED: {cat} !!!")
-            print(f"Description: {result.get('category_description')}")
-            print(f"Example prompt: {prompt[:100]}...")
+    # Get the first user message
+    prompt = None
+    for msg in messages:
+        if msg.get("role") == "user":
+            prompt = msg.get("content", "").strip()
+            break
     
+    if prompt and len(prompt) >= 10:  # Skip empty or very short prompts
+        return prompt
+    return None
+
+def filter_prompts(records):
+    """Generator stage turning (index, record) pairs into (index, prompt or None) pairs"""
+    for index, item in records:
+        yield index, extract_prompt(item)
+
+def cluster_label(result):
+    """Compact label stored for a cluster representative"""
+    if result.get("error"):
+        return "error"
+    verdict = result.get("model_verdict")
+    if verdict and verdict.get("parallelizable", False):
+        # The schema is only reused by members equal to the representative's prompt
+        return verdict, normalized(result["prompt"])
+    # Rejections are the common case; they fan out without keeping the verdict around
+    return False
+
+def fan_out(label, prompt, index, representative):
+    """
+    Build a member's result from its cluster representative's label, or None if the member
+    needs its own classification (the representative's schema was extracted from another prompt)
+    """
+    if label == "error":
+        result = error_result(prompt, index)
+    elif label is False:
+        result = finalize_result(fallback_result(prompt), prompt, index)
+    else:
+        verdict, representative_prompt = label
+        if normalized(prompt) == representative_prompt:
+            verdict = copy.deepcopy(verdict)
+            verdict["serial"] = prompt
+            result = finalize_result(verdict, prompt, index)
+        else:
+            return None
+    result["representative_index"] = representative
     return result
 
-def filter_prompts(batch):
-    """Extract valid prompts from a batch of data"""
-    valid_prompts = []
-    for item in batch:
-        # Extract the user prompt (first message in the conversation)
-        messages = item.get("conversation", [])
-        if not messages:
+def record_member(label, prompt, index, representative, stats):
+    result = fan_out(label, prompt, index, representative)
+    if result is None:
+        # Left out of the journal until classified, so an interrupted run retries it
+        members_to_classify.append((index, prompt))
+        stats["needs_classification"] += 1
+        return
+    record_result(result)
+    update_run_stats(stats, result)
+
+def resolve_cluster(result, stats):
+    """Fan a representative's label out to the members that were waiting for it"""
+    if near_duplicates is None:
+        return
+    label = cluster_label(result)
+    for index, prompt in near_duplicates.resolve(result["index"], label):
+        record_member(label, prompt, index, result["index"], stats)
+
+def deduplicated(prompts, stats):
+    """Generator stage that yields cluster representatives only"""
+    for index, prompt in prompts:
+        representative, label = near_duplicates.route(index, prompt)
+        if representative is None:
+            yield index, prompt
+        elif label is not None:
+            record_member(label, prompt, index, representative, stats)
+        # Otherwise the member is parked until its representative is classified
+
+def pending_prompts(prompts):
+    """Drop prompts the journal already covers and journal the ones too short to classify"""
+    for index, prompt in prompts:
+        if journal.is_done(index):
             continue
+        if not prompt:
+            journal.record(index, "skipped")
+            continue
+        yield index, prompt
+
+def update_run_stats(stats, result):
+    """Fold a finished result into the per-run counters"""
+    stats["processed"] += 1
+    if result.get("parallelizable", False):
+        stats["parallelizable"] += 1
+        cat = result.get("category")
+        is_novel = result.get("is_novel_category", False)
         
-        # Get the first user message
-        prompt = None
-        for msg in messages:
-            if msg.get("role") == "user":
-                prompt = msg.get("content", "").strip()
-                break
-        
-        if prompt and len(prompt) >= 10:  # Skip empty or very short prompts
-            valid_prompts.append(prompt)
+        if is_novel:
+            if cat in stats["novel_categories"]:
+                stats["novel_categories"][cat] += 1
+            else:
+                stats["novel_categories"][cat] = 1
         else:
-            valid_prompts.append(None)
+            if cat in stats["categories"]:
+                stats["categories"][cat] += 1
+            else:
+                stats["categories"][cat] = 1
+
+def checkpoint_outputs():
+    """Fsync the output files and save the validation stats; blocks until both are on disk"""
+    results_sink.checkpoint()
+    save_validation_stats()
+
+def print_progress(stats, position, checkpoint=True):
+    """Print run and validation stats, then (unless `checkpoint` is False) checkpoint the outputs"""
+    print(f"\nStats after {position} prompts:")
+    if stats["processed"] > 0:  # Avoid division by zero
+        print(f"Parallelizable: {stats['parallelizable']} ({stats['parallelizable']/stats['processed']*100:.2f}% of processed)")
+    print("Known Categories:")
+    for cat, count in stats["categories"].items():
+        print(f"- {cat}: {count}")
+    if stats["novel_categories"]:
+        print("Novel Categories:")
+        for cat, count in stats["novel_categories"].items():
+            print(f"- {cat}: {count}")
     
-    return valid_prompts
+    # Print validation stats
+    snapshot = validation_stats.snapshot()
+    print("\nValidation Stats:")
+    print(f"Total classified as parallelizable: {snapshot['total_classified_as_parallelizable']}")
+    print(f"Passed validation: {snapshot['passed_validation']} ({snapshot['passed_validation']/max(1, snapshot['total_classified_as_parallelizable'])*100:.2f}%)")
+    print(f"Failed validation: {snapshot['failed_validation']} ({snapshot['failed_validation']/max(1, snapshot['total_classified_as_parallelizable'])*100:.2f}%)")
+    print(f"Tiers: {snapshot['tiers']}")
+    if near_duplicates is not None:
+        print(f"Near-duplicate clusters: {len(near_duplicates.index)} representatives, {near_duplicates.members} members fanned out or waiting")
+        print(f"Members of parallelizable clusters queued for their own classification: {stats['needs_classification']}")
+    if response_cache is not None:
+        cache_stats = response_cache.stats()
+        print(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']*100:.2f}% hit rate), {cache_stats['entries']} entries")
+    
+    # Checkpoint the output files and save validation stats periodically
+    if checkpoint:
+        checkpoint_outputs()
+
+def run_batches(prompts, total_batches, batch_size, stats):
+    """Classify the prompt stream in fixed-size batches on a thread pool"""
+    max_workers = 3  # Reduced workers for Haiku which may have rate limits
+
+    # Process the dataset in batches
+    batches = iter(lambda: list(islice(prompts, batch_size)), [])
+    for batch in tqdm(batches, total=total_batches):
+        batch_start, batch_end = batch[0][0], batch[-1][0] + 1
+        print(f"\nProcessing batch {batch_start} to {batch_end-1}")
+        
+        # Process prompts in parallel
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Create tasks with indices
+            tasks = [(prompt, index) for index, prompt in batch if prompt]
+            
+            # Submit all tasks
+            futures = [executor.submit(process_prompt, task) for task in tasks]
+            
+            # Process results as they complete
+            for future in tqdm(futures, desc="Processing prompts"):
+                try:
+                    result = future.result(timeout=90)  # Longer timeout
+                    if result:
+                        update_run_stats(stats, result)
+                        resolve_cluster(result, stats)
+                except Exception as e:
+                    print(f"Task failed: {e}")
+        
+        # Print stats after each batch
+        print_progress(stats, batch_end)
+                
+        # Add a delay between batches to avoid rate limiting
+        time.sleep(7)  # Short delay for Haiku
+
+def run_async(prompts, batch_size, stats):
+    """
+    Classify the dataset with a rolling window of in-flight model requests.
+
+    There is no per-batch barrier or fixed sleep: a new request starts as soon as
+    one finishes, and the window size adapts to throttling and latency (AIMD).
+    Results are validated and saved on the event loop thread, so the CSV and
+    stats are only ever written from one thread. Periodic checkpoints wait for
+    fsyncs, so they run on a separate thread instead of stalling the loop; one
+    still in progress absorbs the next.
+    """
+    controller = AIMDController(initial_window=args.initial_concurrency,
+                                max_window=args.max_concurrency,
+                                latency_target=args.latency_target)
+    progress = tqdm(desc="Processing prompts", unit="prompt")
+    checkpointer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+    checkpointing = []  # The latest checkpoint future, if any
+
+    async def classify(prompt, index):
+        # Backends raise Throttled on rate limiting, which shrinks the window
+        loop = asyncio.get_running_loop()
+        with tracing.span("classify", index=index), tracing.queued():
+            # Executor threads do not inherit the event loop's context; hand the trace over explicitly
+            return await loop.run_in_executor(None, contextvars.copy_context().run, invoke_model, prompt, index)
+
+    def on_result(item, raw_result):
+        prompt, index = item
+        result = finalize_result(raw_result, prompt, index)
+        record_result(result)
+        update_run_stats(stats, result)
+        resolve_cluster(result, stats)
+        progress.update(1)
+        if stats["processed"] % batch_size == 0:
+            progress.set_postfix(window=controller.limit, throttled=controller.throttles)
+            print_progress(stats, index + 1, checkpoint=False)
+            if not checkpointing or checkpointing[0].done():
+                checkpointing[:] = [asyncio.get_running_loop().run_in_executor(checkpointer, checkpoint_outputs)]
+
+    def on_error(item, error):
+        prompt, index = item
+        print(f"Error analyzing prompt at index {index}: {error}")
+        result = error_result(prompt, index)
+        record_result(result)
+        update_run_stats(stats, result)
+        resolve_cluster(result, stats)
+        progress.update(1)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=args.max_concurrency))
+        counters = await run_windowed(
+            ((prompt, index) for index, prompt in prompts),
+            classify, on_result, controller=controller, on_error=on_error,
+            retry_delay=2.0
+        )
+        if checkpointing:
+            await checkpointing[0]
+        return counters
+
+    try:
+        counters = asyncio.run(run())
+        print(f"\nAsync run finished: {counters}")
+    finally:
+        checkpointer.shutdown()
+        progress.close()
+        print(f"Final request window: {controller.limit} (throttled {controller.throttles} times)")
+
+def run_batch_jobs(prompts, stats):
+    """
+    Classify the prompt stream as offline batch jobs of --batch-job-size prompts.
+
+    Cached prompts are answered locally; the rest of a chunk is submitted as one
+    job (request ids derived from the dataset, index and prompt), polled until it
+    finishes, and its results are joined back by id and recorded in index order
+    exactly as in the other modes. The job files live in --batch-dir; an
+    interrupted run resumes polling the job it already submitted.
+    """
+    system_message = load_system_message()
+    chunks = iter(lambda: list(islice(prompts, args.batch_job_size)), [])
+    for chunk in chunks:
+        responses, requests = {}, []
+        for index, prompt in chunk:
+            response_text = cached_response(response_cache_key(prompt, system_message))
+            if response_text is not None:
+                responses[index] = response_text
+                continue
+            requests.append({"custom_id": custom_id(prefix, index, prompt), "system_prompt": system_message,
+                             "prompt": user_message(prompt), "max_tokens": MAX_TOKENS, "temperature": TEMPERATURE})
+        print(f"\nBatch job for prompts {chunk[0][0]} to {chunk[-1][0]}: "
+              f"{len(requests)} requests, {len(chunk) - len(requests)} cached")
+
+        completions = {}
+        if requests:
+            completions = run_batch(backend, requests, os.path.join(args.batch_dir, f"{prefix}_job_{chunk[0][0]}"),
+                                    poll_interval=args.poll_interval, timeout=args.batch_timeout)
+
+        for index, prompt in chunk:
+            if index in responses:
+                result = finalize_result(parse_model_response(responses[index], prompt, index), prompt, index)
+            else:
+                completion = completions.get(custom_id(prefix, index, prompt)) or {"error": "missing from job output"}
+                if "error" in completion:
+                    print(f"Error analyzing prompt at index {index}: {completion['error']}")
+                    result = error_result(prompt, index)
+                else:
+                    cache_response(response_cache_key(prompt, system_message), completion["text"])
+                    result = finalize_result(parse_model_response(completion["text"], prompt, index), prompt, index)
+            record_result(result)
+            update_run_stats(stats, result)
+            resolve_cluster(result, stats)
+
+        print_progress(stats, chunk[-1][0] + 1)
+
+def create_model_backend(**options):
+    """Backend selected with --backend; the mock backends answer with deterministic stub verdicts"""
+    if args.backend in ("mock", "mock-http"):
+        options["responder"] = stub_response
+    return backend_from_args(args, **options)
+
+def async_backend_options():
+    """Let throttling surface immediately instead of being retried inside the client,
+    and size the connection pool to the largest window we may open"""
+    if args.backend == "bedrock":
+        return {"max_pool_connections": args.max_concurrency, "max_attempts": 1}
+    if args.backend in ("openai", "mock-http"):
+        return {"max_connections": args.max_concurrency, "max_retries": 1}
+    return {}
 
 def main():
-    # Get total dataset size
-    total_size = len(dataset["train"])
-    print(f"Total dataset size: {total_size} entries")
-    
-    # Start position (useful for resuming)
-    start_position = 0
-    
-    # Check if we need to resume from a previous run
-    if os.path.exists(output_file):
+    global journal, results_sink, backend
+    backend = create_model_backend(**(async_backend_options() if args.mode == "async" else {}))
+    backend.check()
+    journal = ProgressJournal(prefix)
+
+    # Migrate runs that predate the journal: resume after the last saved row
+    if journal.is_empty and args.output_format == "csv" and os.path.exists(output_file):
         df = pd.read_csv(output_file)
         if not df.empty:
-            # Get the highest index we've processed so far
-            start_position = df['index'].max() + 1
-            print(f"Resuming from position {start_position}")
-    
-    # Process in batches to enable easier resuming
-    batch_size = 100  # Reduced batch size
-    max_workers = 3  # Reduced workers for Haiku which may have rate limits
+            journal.seed(int(df['index'].max()) + 1)
+
+    # Start position (useful for resuming); indices past it that finished out of
+    # order are filtered individually by the journal
+    start_position = journal.watermark
+    if start_position > 0:
+        print(f"Resuming from position {start_position}")
     
     # Stats tracking
     stats = {
         "processed": 0,
         "parallelizable": 0,
+        "needs_classification": 0,
         "categories": {},
         "novel_categories": {}
     }
     
+    # Open the dataset lazily; rows are only read as the pipeline consumes them
+    print(f"Loading {dataset_name} ...")
+    records, total_size = open_records(dataset_name, start=start_position, split=args.split,
+                                       streaming=args.streaming)
+    if total_size is not None:
+        print(f"Total dataset size: {total_size} entries")
+    prompts = pending_prompts(filter_prompts(records))
+    if near_duplicates is not None:
+        prompts = deduplicated(prompts, stats)
+
+    # Results are written by a single thread in batches
+    results_sink = open_results_sink()
+
+    # Keep the stats file fresh for dashboards between batch boundaries
+    stop_stats_flush = validation_stats.autoflush(validation_stats_file, interval=args.stats_interval)
+
+    # Process in batches to enable easier resuming
+    batch_size = 100  # Reduced batch size
+    total_batches = None
+    if total_size is not None:
+        total_batches = -(-max(0, total_size - start_position) // batch_size)
+    
+    def run(prompts, total_batches):
+        if args.mode == "async":
+            run_async(prompts, batch_size, stats)
+        elif args.mode == "batch-job":
+            run_batch_jobs(prompts, stats)
+        else:
+            run_batches(prompts, total_batches, batch_size, stats)
+
     try:
-        # Process the dataset in batches
-        for batch_start in tqdm(range(start_position, total_size, batch_size)):
-            batch_end = min(batch_start + batch_size, total_size)
-            print(f"\nProcessing batch {batch_start} to {batch_end-1}")
-            
-            # Select the current batch
-            batch_indices = range(batch_start, batch_end)
-            batch = dataset["train"].select(batch_indices)
-            
-            # Filter and get valid prompts
-            prompts = filter_prompts(batch)
-            
-            # Process prompts in parallel
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Create tasks with indices
-                tasks = [(prompt, batch_start + i, novel_categories_lock) for i, prompt in enumerate(prompts) if prompt]
-                
-                # Submit all tasks
-                futures = [executor.submit(process_prompt, task) for task in tasks]
-                
-                # Process results as they complete
-                for future in tqdm(futures, desc="Processing prompts"):
-                    try:
-                        result = future.result(timeout=90)  # Longer timeout
-                        if result:
-                            stats["processed"] += 1
-                            if result.get("parallelizable", False):
-                                stats["parallelizable"] += 1
-                                cat = result.get("category")
-                                is_novel = result.get("is_novel_category", False)
-                                
-                                if is_novel:
-                                    if cat in stats["novel_categories"]:
-                                        stats["novel_categories"][cat] += 1
-                                    else:
-                                        stats["novel_categories"][cat] = 1
-                                else:
-                                    if cat in stats["categories"]:
-                                        stats["categories"][cat] += 1
-                                    else:
-                                        stats["categories"][cat] = 1
-                    except Exception as e:
-                        print(f"Task failed: {e}")
-            
-            # Print stats after each batch
-            print(f"\nStats after {batch_end} prompts:")
-            if stats["processed"] > 0:  # Avoid division by zero
-                print(f"Parallelizable: {stats['parallelizable']} ({stats['parallelizable']/stats['processed']*100:.2f}% of processed)")
-            print("Known Categories:")
-            for cat, count in stats["categories"].items():
-                print(f"- {cat}: {count}")
-            if stats["novel_categories"]:
-                print("Novel Categories:")
-                for cat, count in stats["novel_categories"].items():
-                    print(f"- {cat}: {count}")
-            
-            # Print validation stats
-            print("\nValidation Stats:")
-            print(f"Total classified as parallelizable: {validation_stats['total_classified_as_parallelizable']}")
-            print(f"Passed validation: {validation_stats['passed_validation']} ({validation_stats['passed_validation']/max(1, validation_stats['total_classified_as_parallelizable'])*100:.2f}%)")
-            print(f"Failed validation: {validation_stats['failed_validation']} ({validation_stats['failed_validation']/max(1, validation_stats['total_classified_as_parallelizable'])*100:.2f}%)")
-            
-            # Save validation stats periodically
-            save_validation_stats()
-                    
-            # Add a delay between batches to avoid rate limiting
-            time.sleep(7)  # Short delay for Haiku
+        run(prompts, total_batches)
+
+        # Members of parallelizable clusters that differ from their representative
+        if members_to_classify:
+            print(f"\nClassifying {len(members_to_classify)} near-duplicate members on their own ...")
+            run(iter(sorted(members_to_classify)), None)
     
     except KeyboardInterrupt:
         print("\nInterrupted by user. Saving current progress...")
@@ -599,8 +785,13 @@ def main():
                 print(f"- {cat}: {count}")
         
         # Save final validation stats
+        stop_stats_flush()
         save_validation_stats()
+        results_sink.close()
+        journal.close()
+        novel_categories.close()
+        backend.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
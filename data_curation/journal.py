@@ -0,0 +1,182 @@
+"""
+Append-only progress journal for resuming the curation pipeline.
+
+Every dataset index that leaves the pipeline is journaled with its outcome,
+including prompts that were skipped or classified as not parallelizable, so a
+restarted run never re-sends a prompt that was already paid for. Prompts whose
+classification failed are journaled too, but not marked done, so a restarted
+run retries them.
+
+On disk the journal is a pair of files:
+- `{prefix}_progress.snapshot.json`: the state at the last snapshot, i.e. a
+  watermark below which every index is done, the run-length-encoded set of
+  done indices above it (out-of-order completions) and per-outcome counts.
+- `{prefix}_progress.{generation}.journal`: fixed-size binary records
+  appended since that snapshot.
+
+Taking a snapshot starts a new journal generation, so loading reads one small
+JSON file plus at most `snapshot_every` records regardless of dataset size.
+"""
+import json
+import os
+import struct
+import threading
+
+OUTCOMES = ["skipped", "error", "not_parallelizable", "low_confidence", "medium_confidence", "high_confidence"]
+OUTCOME_CODES = {name: code for code, name in enumerate(OUTCOMES)}
+# Counted, but left pending so a resumed run sends the prompt again
+RETRIED_OUTCOMES = ("error",)
+
+# Little-endian uint64 index + uint8 outcome code
+RECORD = struct.Struct("<QB")
+
+
+def encode_runs(indices):
+    """Run-length encode sorted indices as [start, length] pairs"""
+    runs = []
+    for index in sorted(indices):
+        if runs and runs[-1][0] + runs[-1][1] == index:
+            runs[-1][1] += 1
+        else:
+            runs.append([index, 1])
+    return runs
+
+
+def decode_runs(runs):
+    return {start + i for start, length in runs for i in range(length)}
+
+
+class ProgressJournal:
+    """
+    Tracks which dataset indices have been processed.
+
+    Parameters:
+    - prefix (str): Output file prefix, e.g. "lmsys".
+    - snapshot_every (int): Records appended between automatic snapshots.
+    """
+
+    def __init__(self, prefix, snapshot_every=10000):
+        self.prefix = prefix
+        self.snapshot_every = snapshot_every
+        self.snapshot_file = f"{prefix}_progress.snapshot.json"
+
+        self.watermark = 0
+        self.done_above = set()
+        self.counts = {name: 0 for name in OUTCOMES}
+        self.generation = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self._load()
+        self._journal = open(self._journal_path(self.generation), "ab")
+
+    def _journal_path(self, generation):
+        return f"{self.prefix}_progress.{generation}.journal"
+
+    def _load(self):
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                snapshot = json.load(f)
+            self.generation = snapshot["generation"]
+            self.watermark = snapshot["watermark"]
+            self.done_above = decode_runs(snapshot["done_above"])
+            self.counts.update(snapshot["counts"])
+
+            # Left behind if we crashed between writing the snapshot and rotating
+            stale = self._journal_path(self.generation - 1)
+            if os.path.exists(stale):
+                os.remove(stale)
+
+        path = self._journal_path(self.generation)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        # A crash mid-append can leave a torn trailing record; drop it so new records stay aligned
+        usable = len(data) - len(data) % RECORD.size
+        if usable < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(usable)
+        for index, code in RECORD.iter_unpack(data[:usable]):
+            self._apply(index, OUTCOMES[code])
+        self._pending = usable // RECORD.size
+
+    @property
+    def is_empty(self):
+        return self.watermark == 0 and not self.done_above
+
+    def _apply(self, index, outcome):
+        if index < self.watermark or index in self.done_above:
+            return
+        self.counts[outcome] += 1
+        if outcome in RETRIED_OUTCOMES:
+            return
+        self.done_above.add(index)
+        while self.watermark in self.done_above:
+            self.done_above.remove(self.watermark)
+            self.watermark += 1
+
+    def is_done(self, index):
+        return index < self.watermark or index in self.done_above
+
+    def record(self, index, outcome):
+        """Append one processed index and its outcome"""
+        with self._lock:
+            self._journal.write(RECORD.pack(index, OUTCOME_CODES[outcome]))
+            self._journal.flush()
+            self._apply(index, outcome)
+            self._pending += 1
+            if self._pending >= self.snapshot_every:
+                self._snapshot()
+
+    def record_many(self, entries):
+        """Append a batch of (index, outcome) pairs with a single flush"""
+        with self._lock:
+            self._journal.write(b"".join(RECORD.pack(index, OUTCOME_CODES[outcome]) for index, outcome in entries))
+            self._journal.flush()
+            for index, outcome in entries:
+                self._apply(index, outcome)
+                self._pending += 1
+            if self._pending >= self.snapshot_every:
+                self._snapshot()
+
+    def seed(self, watermark):
+        """Mark every index below `watermark` as done (used when migrating from CSV-based resume)"""
+        with self._lock:
+            self.watermark = max(self.watermark, watermark)
+            self.done_above = {i for i in self.done_above if i >= self.watermark}
+            while self.watermark in self.done_above:
+                self.done_above.remove(self.watermark)
+                self.watermark += 1
+            self._snapshot()
+
+    def snapshot(self):
+        with self._lock:
+            self._snapshot()
+
+    def _snapshot(self):
+        os.fsync(self._journal.fileno())
+        snapshot = {
+            "generation": self.generation + 1,
+            "watermark": self.watermark,
+            "done_above": encode_runs(self.done_above),
+            "counts": self.counts,
+        }
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+        # The snapshot now covers the old generation, so its journal can go
+        self._journal.close()
+        os.remove(self._journal_path(self.generation))
+        self.generation += 1
+        self._journal = open(self._journal_path(self.generation), "ab")
+        self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._snapshot()
+            self._journal.close()
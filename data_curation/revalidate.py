@@ -0,0 +1,241 @@
+"""
+Re-apply the validation heuristics to persisted model verdicts, with no model calls.
+
+`find_parallelprompts.py` logs the raw (pre-validation) verdict for every
+classified prompt to `{prefix}_model_verdicts.jsonl`. This command reads that
+log in chunks, re-validates the chunks in parallel across cores with
+`validator.HeuristicValidator` (optionally with different thresholds), and
+writes a new results CSV and validation stats file.
+
+Usage:
+    python revalidate.py --verdicts lmsys_model_verdicts.jsonl --output lmsys_retiered.csv \\
+        --stats lmsys_retiered_stats.json --min-questions 3
+    python revalidate.py --benchmark 1000000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from sinks import FIELD_NAMES, csv_row
+from validation_stats import ValidationStats
+from validator import PASSING_TIERS, HeuristicValidator, reject, schema_errors
+
+
+_validator = None
+
+
+def _init_worker(thresholds):
+    global _validator
+    _validator = HeuristicValidator(**thresholds)
+
+
+def revalidate_chunk(lines):
+    """Validate a chunk of verdict log lines; returns (CSV rows, stats counters for the chunk)"""
+    stats = ValidationStats()
+    results = []
+    candidates = []
+
+    for line in lines:
+        entry = json.loads(line)
+        result = dict(entry["verdict"])
+        for key in ("index", "query_id", "prompt", "timestamp"):
+            result[key] = entry.get(key)
+        results.append(result)
+
+        # 1. If Claude already said it's not parallelizable, accept that
+        if not result.get("parallelizable", False):
+            result["validation_tier"] = "not_parallelizable"
+            stats.record_model_rejected()
+            continue
+
+        result["_category"] = result.get("category", "Unknown")
+
+        # 2. Invalid schemas fail immediately
+        if schema_errors(result):
+            reject(result)
+            result["validation_tier"] = "not_parallelizable"
+            stats.record(result["_category"], "not_parallelizable")
+            continue
+
+        candidates.append(result)
+
+    # 3. Content-based tiers for the whole chunk at once
+    if candidates:
+        features = _validator.feature_matrix([r["prompt"] for r in candidates])
+        tiers = _validator.tiers(
+            features,
+            [len(r["data"]) if isinstance(r.get("data"), list) else 0 for r in candidates],
+            [r["n"] if isinstance(r.get("n"), (int, float)) else 0 for r in candidates],
+            [r["_category"] for r in candidates],
+        )
+        for result, tier in zip(candidates, tiers.tolist()):
+            result["validation_tier"] = tier
+            stats.record(result["_category"], tier)
+            if tier not in PASSING_TIERS:
+                reject(result)
+
+    rows = []
+    for result in results:
+        result["validation_passed"] = result["validation_tier"] in PASSING_TIERS
+        if result.get("parallelizable", False):
+            rows.append(csv_row(result))
+    return rows, stats.counts()
+
+
+def iter_chunks(path, chunk_size):
+    with open(path, "r", encoding="utf-8") as f:
+        lines = (line for line in f if line.strip())
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def ordered_map(executor, fn, iterable, prefetch):
+    """Like executor.map, but keeps at most `prefetch` tasks in flight so input is read lazily"""
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def revalidate(verdicts_file, output_file, stats_file, thresholds=None, workers=None, chunk_size=5000):
+    """
+    Re-tier every verdict in `verdicts_file` and write the results CSV and stats.
+
+    Returns:
+    - tuple: (merged validation stats snapshot, number of verdicts processed)
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = ValidationStats()
+    processed = 0
+
+    with open(output_file, "w", newline="", encoding="utf-8") as csvfile, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(thresholds or {},)) as executor:
+        writer = csv.DictWriter(csvfile, fieldnames=FIELD_NAMES, quoting=csv.QUOTE_ALL,
+                                quotechar='"', escapechar='\\')
+        writer.writeheader()
+        for rows, part in ordered_map(executor, revalidate_chunk, iter_chunks(verdicts_file, chunk_size),
+                                      prefetch=workers * 2):
+            writer.writerows(rows)
+            stats.merge(part)
+
+    stats.flush(stats_file, force=True)
+    snapshot = stats.snapshot()
+    processed = snapshot["model_rejected"] + snapshot["total_classified_as_parallelizable"]
+    return snapshot, processed
+
+
+SYNTHETIC_PROMPTS = [
+    "Generate {k} examples of short stories about {topic}.",
+    "Answer the following questions about {topic}:\n1. What is it?\n2. Where is it found?\n3. Why does it matter?",
+    "Extract Name, Date, Location, Organization from the following text: A report on {topic} was published.",
+    "Translate these sentences into French: I like {topic}. {topic} is interesting; we study {topic}.",
+    "Write a poem about {topic}.",
+    "What is {topic}? How does {topic} work? Why is {topic} important?",
+]
+SYNTHETIC_TOPICS = ["axolotls", "warehouses", "volcanoes", "jazz", "compilers", "tides", "bees", "glaciers"]
+
+
+def synthetic_verdicts(n, seed=0):
+    """Yield `n` verdict log lines shaped like real classifier output"""
+    rng = random.Random(seed)
+    for index in range(n):
+        topic = rng.choice(SYNTHETIC_TOPICS)
+        prompt = rng.choice(SYNTHETIC_PROMPTS).format(k=rng.randint(2, 10), topic=topic)
+        parallelizable = rng.random() < 0.3
+        verdict = {"parallelizable": parallelizable, "category": None, "is_novel_category": False,
+                   "category_description": None, "serial": prompt, "template": None, "context": None,
+                   "data": None, "n": None}
+        if parallelizable:
+            if rng.random() < 0.5:
+                verdict.update(category="Repeated Generation", template=f"Generate one example about {topic}.",
+                               n=rng.randint(2, 10))
+            else:
+                verdict.update(category=rng.choice(["Reading Comprehension", "Keyword Extraction", "Translation"]),
+                               template="{data}\n\n{context}", context=topic,
+                               data=[f"item {i}" for i in range(rng.randint(1, 6))])
+        yield json.dumps({"index": index, "query_id": f"{index:08x}", "prompt": prompt,
+                          "timestamp": "2025-01-01 00:00:00", "verdict": verdict})
+
+
+def benchmark(rows, workers=None, chunk_size=5000, thresholds=None):
+    """Time revalidation of `rows` synthetic verdicts"""
+    with tempfile.TemporaryDirectory() as tmp:
+        verdicts_file = os.path.join(tmp, "synthetic_model_verdicts.jsonl")
+        with open(verdicts_file, "w", encoding="utf-8") as f:
+            for line in synthetic_verdicts(rows):
+                f.write(line + "\n")
+
+        start = time.perf_counter()
+        stats, processed = revalidate(verdicts_file, os.path.join(tmp, "out.csv"), os.path.join(tmp, "stats.json"),
+                                      thresholds=thresholds, workers=workers, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+
+    print(f"Re-validated {processed} verdicts in {elapsed:.2f}s ({processed / elapsed:,.0f} verdicts/s) "
+          f"with {workers or os.cpu_count()} workers")
+    print(f"Tiers: {stats['tiers']}")
+
+    # Re-tiering with changed thresholds only repeats the vectorized step
+    validator = HeuristicValidator(**(thresholds or {}))
+    counts = validator.feature_counts([json.loads(line)["prompt"] for line in synthetic_verdicts(min(rows, 50000))])
+    start = time.perf_counter()
+    features = validator.feature_matrix(counts=counts)
+    validator.tiers(features, np.full(len(counts), 3), np.zeros(len(counts)), np.full(len(counts), "x", dtype=object))
+    elapsed = time.perf_counter() - start
+    print(f"Threshold-only re-tiering of {len(counts)} precomputed feature rows: {elapsed * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-validate persisted model verdicts offline.")
+    parser.add_argument("--verdicts", type=str, help="Path to a {prefix}_model_verdicts.jsonl log")
+    parser.add_argument("--output", type=str, help="Path of the re-tiered results CSV")
+    parser.add_argument("--stats", type=str, help="Path of the recomputed validation stats JSON")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="Verdicts per worker task")
+    parser.add_argument("--min-numbered-items", type=int, default=2)
+    parser.add_argument("--min-questions", type=int, default=2)
+    parser.add_argument("--min-bullets", type=int, default=2)
+    parser.add_argument("--min-medium-data", type=int, default=3)
+    parser.add_argument("--benchmark", type=int, default=None,
+                        help="Instead of re-validating a log, time re-validation of this many synthetic verdicts")
+    args = parser.parse_args()
+
+    thresholds = {
+        "min_numbered_items": args.min_numbered_items,
+        "min_questions": args.min_questions,
+        "min_bullets": args.min_bullets,
+        "min_medium_data": args.min_medium_data,
+    }
+
+    if args.benchmark:
+        benchmark(args.benchmark, workers=args.workers, chunk_size=args.chunk_size, thresholds=thresholds)
+        return
+
+    if not (args.verdicts and args.output and args.stats):
+        parser.error("--verdicts, --output and --stats are required unless --benchmark is given")
+
+    stats, processed = revalidate(args.verdicts, args.output, args.stats, thresholds=thresholds,
+                                  workers=args.workers, chunk_size=args.chunk_size)
+    print(f"Re-validated {processed} verdicts")
+    print(f"Passed validation: {stats['passed_validation']} / {stats['total_classified_as_parallelizable']}")
+    print(f"Tiers: {stats['tiers']}")
+    print(f"Results saved to '{args.output}', stats saved to '{args.stats}'.")
+
+
+if __name__ == "__main__":
+    main()
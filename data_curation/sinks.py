@@ -0,0 +1,287 @@
+"""
+Output schema and writers for curation results.
+
+Worker threads hand finished results to a `BatchedSink`, whose single writer
+thread appends them to the output files in batches. A batch is written when
+it reaches `batch_size` results or `flush_interval` seconds after its first
+result, whichever comes first. Files are fsynced at checkpoints, i.e. every
+`checkpoint_every` results, on `checkpoint()` and on `close()`. Results can be
+written as CSV (the original format), JSONL or Parquet; Parquet output goes to
+one part file per run with a row group per flushed batch.
+"""
+import csv
+import json
+import os
+import queue
+import threading
+import time
+
+# Columns of {prefix}_parallelizable_queries.csv
+FIELD_NAMES = ["index", "query_id", "prompt", "parallelizable", "category", "is_novel_category", "category_description",
+               "serial", "template", "context", "data", "n", "validation_passed", "validation_tier", "timestamp"]
+
+OUTPUT_FORMATS = ("csv", "jsonl", "parquet")
+
+
+def csv_row(result):
+    """Project a result onto the CSV columns"""
+    # Filter to only include fields we want in our CSV
+    row = {field: result.get(field, "") for field in FIELD_NAMES}
+
+    # Convert lists to string representation for CSV
+    if isinstance(row.get("data"), list):
+        row["data"] = json.dumps(row["data"])
+    return row
+
+
+def record_row(result):
+    """Project a result onto the output columns, keeping native types (for JSONL and Parquet)"""
+    row = {field: result.get(field) for field in FIELD_NAMES}
+    if isinstance(row["n"], float):
+        row["n"] = int(row["n"])
+    return row
+
+
+def output_path(prefix, output_format):
+    """Results path for a dataset prefix; Parquet output is a directory of part files"""
+    if output_format == "parquet":
+        return f"{prefix}_parallelizable_queries"
+    return f"{prefix}_parallelizable_queries.{output_format}"
+
+
+class CsvWriter:
+    """Appends rows to a CSV file, writing the header if the file is new"""
+
+    def __init__(self, path, field_names=FIELD_NAMES):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=field_names, quoting=csv.QUOTE_ALL,
+                                      quotechar='"', escapechar='\\')
+        if new_file:
+            self._writer.writeheader()
+            self._file.flush()
+
+    def write_rows(self, rows):
+        self._writer.writerows(csv_row(row) for row in rows)
+
+    def flush(self):
+        self._file.flush()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+class JsonlWriter:
+    """Appends rows to a JSON Lines file"""
+
+    def __init__(self, path, project=None):
+        self._project = project
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write_rows(self, rows):
+        if self._project is not None:
+            rows = map(self._project, rows)
+        self._file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    def flush(self):
+        self._file.flush()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("index", pa.int64()),
+        ("query_id", pa.string()),
+        ("prompt", pa.string()),
+        ("parallelizable", pa.bool_()),
+        ("category", pa.string()),
+        ("is_novel_category", pa.bool_()),
+        ("category_description", pa.string()),
+        ("serial", pa.string()),
+        ("template", pa.string()),
+        ("context", pa.string()),
+        ("data", pa.list_(pa.string())),
+        ("n", pa.int64()),
+        ("validation_passed", pa.bool_()),
+        ("validation_tier", pa.string()),
+        ("timestamp", pa.string()),
+    ])
+
+
+class ParquetWriter:
+    """
+    Writes rows to a new part file in a Parquet dataset directory, one row group per batch.
+
+    Parquet files cannot be appended to, so each run adds `part-NNNNN.parquet`;
+    the directory loads as one table with `pandas.read_parquet(path)`.
+    """
+
+    def __init__(self, path):
+        import pyarrow.parquet as pq
+        os.makedirs(path, exist_ok=True)
+        part = sum(1 for name in os.listdir(path) if name.endswith(".parquet"))
+        self.path = os.path.join(path, f"part-{part:05d}.parquet")
+        self._schema = parquet_schema()
+        self._writer = pq.ParquetWriter(self.path, self._schema)
+
+    def write_rows(self, rows):
+        import pyarrow as pa
+        rows = [record_row(row) for row in rows]
+        if rows:
+            self._writer.write_table(pa.Table.from_pylist(rows, schema=self._schema))
+
+    def flush(self):
+        # Row groups are written out as soon as `write_table` returns
+        pass
+
+    def sync(self):
+        pass
+
+    def close(self):
+        # The footer is only written on close; the file is unreadable before that
+        self._writer.close()
+        with open(self.path, "rb") as f:
+            os.fsync(f.fileno())
+
+
+def open_writer(path, output_format):
+    """Open a results writer for `output_format` (one of OUTPUT_FORMATS)"""
+    if output_format == "csv":
+        return CsvWriter(path)
+    if output_format == "jsonl":
+        return JsonlWriter(path, project=record_row)
+    if output_format == "parquet":
+        return ParquetWriter(path)
+    raise ValueError(f"Unknown output format '{output_format}'")
+
+
+_CHECKPOINT = object()
+_CLOSE = object()
+
+
+class BatchedSink:
+    """
+    Single-writer sink that batches results from many producer threads.
+
+    Parameters:
+    - outputs (list): (writer, select) pairs. `select(result)` returns the row to
+      write for a result, or None to leave the result out of that writer.
+    - batch_size (int): Results per batch.
+    - flush_interval (float): Seconds a partial batch may wait before it is written.
+    - checkpoint_every (int): Results between fsyncs of every writer.
+    - on_flush (callable, optional): Called from the writer thread with each batch
+      of results after it has been written and flushed, e.g. to journal them.
+    """
+
+    def __init__(self, outputs, batch_size=256, flush_interval=1.0, checkpoint_every=10000, on_flush=None):
+        self.outputs = outputs
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint_every = checkpoint_every
+        self.on_flush = on_flush
+        self.written = 0
+        self.batches = 0
+
+        self._queue = queue.Queue()
+        self._since_checkpoint = 0
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="results-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, result):
+        """Queue a result for writing; never blocks on I/O"""
+        if self._error is not None:
+            raise RuntimeError("Results writer failed") from self._error
+        self._queue.put(result)
+
+    def checkpoint(self):
+        """Write everything queued so far and fsync the outputs; blocks until done"""
+        done = threading.Event()
+        self._queue.put((_CHECKPOINT, done))
+        done.wait()
+
+    def close(self):
+        """Drain the queue, fsync and close every writer"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("Results writer failed") from self._error
+
+    def _write(self, batch):
+        if not batch:
+            return
+        for writer, select in self.outputs:
+            rows = [row for row in map(select, batch) if row is not None]
+            if rows:
+                writer.write_rows(rows)
+            writer.flush()
+        self.written += len(batch)
+        self.batches += 1
+        self._since_checkpoint += len(batch)
+        if self._since_checkpoint >= self.checkpoint_every:
+            self._sync()
+        if self.on_flush is not None:
+            self.on_flush(batch)
+
+    def _sync(self):
+        for writer, _ in self.outputs:
+            writer.sync()
+        self._since_checkpoint = 0
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            try:
+                if item is _CLOSE:
+                    self._write(batch)
+                    for writer, _ in self.outputs:
+                        writer.close()
+                    return
+                if isinstance(item, tuple) and item and item[0] is _CHECKPOINT:
+                    self._write(batch)
+                    batch, deadline = [], None
+                    self._sync()
+                    item[1].set()
+                    continue
+                if item is not None:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                if len(batch) >= self.batch_size or (deadline is not None and time.monotonic() >= deadline):
+                    self._write(batch)
+                    batch, deadline = [], None
+            except Exception as e:
+                # Keep draining so producers and checkpoints never hang; the error
+                # is raised to the next caller of put() or close()
+                if self._error is None:
+                    print(f"Results writer failed: {e}")
+                    self._error = e
+                batch, deadline = [], None
+                if isinstance(item, tuple) and item and item[0] is _CHECKPOINT:
+                    item[1].set()
+                if item is _CLOSE:
+                    return
@@ -0,0 +1,156 @@
+"""
+Lazy record sources for the curation pipeline.
+
+Conversations are read one shard at a time instead of materializing the full
+dataset, from either a HuggingFace hub dataset (streamed) or local
+Parquet/JSONL files. Every source yields `(index, record)` pairs whose index
+is the row's position in the dataset, so resume offsets and CSV indices are
+the same whichever source is used.
+"""
+import glob
+import gzip
+import json
+import os
+from itertools import islice
+
+LOCAL_SUFFIXES = (".parquet", ".jsonl", ".jsonl.gz", ".json", ".json.gz")
+
+
+def is_local_source(name):
+    """Check whether a --dataset value refers to local files rather than a hub dataset"""
+    return os.path.exists(name) or glob.has_magic(name) or name.endswith(LOCAL_SUFFIXES)
+
+
+def resolve_files(name):
+    """Expand a file, directory or glob into a sorted list of shard files"""
+    if os.path.isdir(name):
+        paths = [os.path.join(name, f) for f in os.listdir(name)]
+    else:
+        paths = glob.glob(name)
+    files = sorted(p for p in paths if p.endswith(LOCAL_SUFFIXES))
+    if not files:
+        raise FileNotFoundError(f"No Parquet or JSONL files found for '{name}'")
+    return files
+
+
+def source_prefix(name):
+    """Short name used for output files, e.g. lmsys/lmsys-chat-1m -> lmsys"""
+    if is_local_source(name):
+        base = os.path.basename(os.path.normpath(name.split("*")[0])) or "local"
+        for suffix in LOCAL_SUFFIXES:
+            if base.endswith(suffix):
+                base = base[:-len(suffix)]
+        return base.split("-")[0].lower()
+    return name.split("-")[0].split("/")[1].lower()
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _iter_json_file(path):
+    with _open_text(path) as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            # A plain JSON array cannot be streamed line by line
+            yield from json.load(f)
+            return
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _parquet_rows(path):
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def _iter_parquet_file(path, skip=0, columns=None, batch_size=1024):
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(path)
+    if columns is not None:
+        columns = [c for c in columns if c in parquet_file.schema_arrow.names] or None
+
+    # Skip whole row groups using the footer metadata instead of decoding them; the
+    # remaining `skip` rows all fall in the first group kept, which starts the range read
+    first = 0
+    while first < parquet_file.num_row_groups:
+        rows = parquet_file.metadata.row_group(first).num_rows
+        if skip < rows:
+            break
+        skip -= rows
+        first += 1
+    row_groups = list(range(first, parquet_file.num_row_groups))
+    if not row_groups:
+        return
+
+    batches = parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=columns)
+    yield from islice((row for batch in batches for row in batch.to_pylist()), skip, None)
+
+
+def iter_local_records(name, start=0, columns=None):
+    """Yield (index, record) from local Parquet/JSONL shards, starting at row `start`"""
+    index = 0
+    for path in resolve_files(name):
+        if path.endswith(".parquet"):
+            rows = _parquet_rows(path)
+            if index + rows <= start:
+                index += rows
+                continue
+            skip = max(0, start - index)
+            index += skip
+            for record in _iter_parquet_file(path, skip=skip, columns=columns):
+                yield index, record
+                index += 1
+        else:
+            for record in _iter_json_file(path):
+                if index >= start:
+                    yield index, record
+                index += 1
+
+
+def local_size(name):
+    """Row count of local shards when it is known without a full scan (Parquet only)"""
+    files = resolve_files(name)
+    if all(path.endswith(".parquet") for path in files):
+        return sum(_parquet_rows(path) for path in files)
+    return None
+
+
+def open_records(name, start=0, split="train", streaming=True, columns=("conversation",)):
+    """
+    Open a dataset as a lazy stream of records.
+
+    Parameters:
+    - name (str): HuggingFace dataset name, or a local Parquet/JSONL file, directory or glob.
+    - start (int): Index of the first row to yield (used for resuming).
+    - split (str): Dataset split for hub datasets.
+    - streaming (bool): Stream hub datasets shard by shard instead of downloading them in full.
+    - columns (tuple, optional): Columns to read when the format supports projection.
+
+    Returns:
+    - tuple: (iterator of (index, record), total row count or None if unknown)
+    """
+    columns = list(columns) if columns else None
+
+    if is_local_source(name):
+        return iter_local_records(name, start=start, columns=columns), local_size(name)
+
+    from datasets import load_dataset
+
+    if streaming:
+        dataset = load_dataset(name, split=split, streaming=True)
+        total = None
+        if dataset.info.splits and split in dataset.info.splits:
+            total = dataset.info.splits[split].num_examples
+        if columns:
+            dataset = dataset.select_columns([c for c in columns if c in (dataset.column_names or columns)])
+        return ((start + i, record) for i, record in enumerate(dataset.skip(start))), total
+
+    dataset = load_dataset(name, split=split)
+    total = len(dataset)
+    return enumerate(dataset.select(range(start, total)), start), total
@@ -0,0 +1,114 @@
+"""
+Local stand-in for the Bedrock classifier, used to exercise the async
+pipeline without AWS credentials.
+
+The stub sleeps for a configurable latency and rejects requests with
+`Throttled`, either at random or whenever more requests are in flight than
+its simulated capacity, so the AIMD window can be observed converging.
+
+Usage:
+    python stub_endpoint.py --prompts 2000 --latency 0.2 --capacity 24 --throttle-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parallelprompt.aimd import AIMDController, Throttled, run_windowed
+
+
+class StubEndpoint:
+    """
+    Simulated classification endpoint with injectable latency and throttling.
+
+    Parameters:
+    - latency (float): Mean response time in seconds.
+    - jitter (float): Uniform +/- jitter applied to the latency, in seconds.
+    - throttle_rate (float): Probability that any request is throttled.
+    - capacity (int, optional): Requests in flight beyond this are throttled.
+    - seed (int, optional): Seed for reproducible runs.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, throttle_rate=0.0, capacity=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+        self.inflight = 0
+        self.calls = 0
+        self.throttled = 0
+
+    async def __call__(self, prompt, index):
+        self.calls += 1
+        self.inflight += 1
+        try:
+            over_capacity = self.capacity is not None and self.inflight > self.capacity
+            if over_capacity or self.rng.random() < self.throttle_rate:
+                self.throttled += 1
+                # Rejections come back quickly, like a real 429
+                await asyncio.sleep(self.latency * 0.1)
+                raise Throttled()
+
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+            return self.classify(prompt, index)
+        finally:
+            self.inflight -= 1
+
+    def classify(self, prompt, index):
+        return dict(stub_verdict(prompt), index=index, prompt=prompt)
+
+
+def stub_verdict(prompt):
+    """Deterministic verdict in the same shape as the Bedrock classifier's output"""
+    parallelizable = any(ch.isdigit() for ch in prompt)
+    return {
+        "parallelizable": parallelizable,
+        "category": "Repeated Generation" if parallelizable else None,
+        "is_novel_category": False,
+        "category_description": None,
+        "serial": prompt,
+        "template": prompt if parallelizable else None,
+        "context": None,
+        "data": None,
+        "n": 2 if parallelizable else None,
+    }
+
+
+def stub_response(system_prompt, prompt):
+    """Classifier response text for the mock model backends (see parallelprompt.backends)"""
+    return json.dumps(stub_verdict(prompt.replace("Analyze this prompt: ", "", 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the async classification window against a local stub endpoint.")
+    parser.add_argument("--prompts", type=int, default=1000, help="Number of synthetic prompts")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean stub latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Latency jitter in seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Random throttle probability")
+    parser.add_argument("--capacity", type=int, default=None, help="Concurrent requests before throttling")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Upper bound on the request window")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    endpoint = StubEndpoint(args.latency, args.jitter, args.throttle_rate, args.capacity, args.seed)
+    controller = AIMDController(initial_window=4, max_window=args.max_concurrency)
+    items = ((f"Synthetic prompt number {i}", i) for i in range(args.prompts))
+    results = []
+
+    start = time.monotonic()
+    counters = asyncio.run(run_windowed(items, endpoint, lambda item, result: results.append(result),
+                                        controller=controller, retry_delay=args.latency))
+    elapsed = time.monotonic() - start
+
+    print(f"Completed {counters['completed']} prompts in {elapsed:.2f}s ({counters['completed'] / elapsed:.1f} prompts/s)")
+    print(f"Throttled: {counters['throttled']}, retried: {counters['retried']}, failed: {counters['failed']}")
+    print(f"Final window: {controller.limit}")
+
+
+if __name__ == "__main__":
+    main()
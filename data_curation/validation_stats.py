@@ -0,0 +1,186 @@
+"""
+Validation statistics shared by the curation workers.
+
+Each thread increments counters in its own shard, so the hot path takes no
+lock. Readers merge the shards on demand. A shard carries a sequence number
+that is odd while its owner is mid-update, which lets a reader copy it
+consistently without blocking the writer (a seqlock). `snapshot()` turns the
+merged counters into the JSON layout of `{prefix}_validation_stats.json`,
+extended with tier histograms, so a dashboard can poll that file while the
+pipeline runs.
+"""
+import json
+import os
+import threading
+import time
+
+from validator import PASSING_TIERS
+
+LEGACY_COUNTERS = ("total_classified_as_parallelizable", "failed_validation", "passed_validation")
+
+
+class _Shard:
+    __slots__ = ("sequence", "counts")
+
+    def __init__(self):
+        self.sequence = 0
+        self.counts = {}
+
+
+class ValidationStats:
+    """
+    Sharded counters for validation outcomes.
+
+    Parameters:
+    - base (dict, optional): Counters to start from, as returned by `counts()`.
+    """
+
+    def __init__(self, base=None):
+        self._base = dict(base or {})
+        self._shards = []
+        self._local = threading.local()
+        self._register_lock = threading.Lock()
+        # Serializes flushes from the autoflush thread and the pipeline's own saves
+        self._flush_lock = threading.Lock()
+        self._flushed_events = None
+
+    @classmethod
+    def load(cls, path):
+        """Resume from a stats file written by `flush` (or by older versions of the pipeline)"""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return cls()
+        base = {}
+        for key in LEGACY_COUNTERS + ("model_rejected",):
+            if data.get(key):
+                base[(key,)] = data[key]
+        for key in ("categories_failed", "categories_passed", "tiers"):
+            for name, count in data.get(key, {}).items():
+                base[(key, name)] = count
+        for category, tiers in data.get("category_tiers", {}).items():
+            for tier, count in tiers.items():
+                base[("category_tiers", category, tier)] = count
+        return cls(base)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard()
+            self._local.shard = shard
+            # Registration happens once per thread; increments never lock
+            with self._register_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _add(self, keys):
+        shard = self._shard()
+        counts = shard.counts
+        shard.sequence += 1
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        shard.sequence += 1
+
+    def record_model_rejected(self):
+        """The model said the prompt is not parallelizable"""
+        self._add([("model_rejected",)])
+
+    def record(self, category, tier):
+        """A parallelizable classification of `category` that validation placed in `tier`"""
+        outcome = "passed" if tier in PASSING_TIERS else "failed"
+        self._add([
+            ("total_classified_as_parallelizable",),
+            (f"{outcome}_validation",),
+            (f"categories_{outcome}", category),
+            ("tiers", tier),
+            ("category_tiers", category, tier),
+        ])
+
+    def merge(self, counts):
+        """Fold externally computed counters (e.g. from worker processes) into the base"""
+        with self._register_lock:
+            base = dict(self._base)
+            for key, count in counts.items():
+                base[key] = base.get(key, 0) + count
+            self._base = base
+
+    @staticmethod
+    def _read_shard(shard):
+        while True:
+            before = shard.sequence
+            if before % 2 == 0:
+                counts = shard.counts.copy()
+                if shard.sequence == before:
+                    return counts
+            time.sleep(0)
+
+    def counts(self):
+        """Merged counters keyed by tuples, e.g. ("categories_passed", "Translation")"""
+        with self._register_lock:
+            shards = list(self._shards)
+            merged = dict(self._base)
+        for shard in shards:
+            for key, count in self._read_shard(shard).items():
+                merged[key] = merged.get(key, 0) + count
+        return merged
+
+    def snapshot(self):
+        """Merged counters in the validation stats JSON layout"""
+        counts = self.counts()
+        snapshot = {key: counts.get((key,), 0) for key in LEGACY_COUNTERS}
+        snapshot.update({
+            "categories_failed": {},
+            "categories_passed": {},
+            "model_rejected": counts.get(("model_rejected",), 0),
+            "tiers": {},
+            "category_tiers": {},
+        })
+        for key, count in counts.items():
+            if key[0] in ("categories_failed", "categories_passed", "tiers"):
+                snapshot[key[0]][key[1]] = count
+            elif key[0] == "category_tiers":
+                snapshot["category_tiers"].setdefault(key[1], {})[key[2]] = count
+        snapshot["events"] = sum(counts.values())
+        snapshot["updated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        return snapshot
+
+    def __getitem__(self, key):
+        return self.snapshot()[key]
+
+    def flush(self, path, force=False):
+        """Atomically write the snapshot to `path` if anything changed since the last flush (thread-safe)"""
+        with self._flush_lock:
+            snapshot = self.snapshot()
+            if not force and snapshot["events"] == self._flushed_events:
+                return False
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(tmp_path, path)
+            self._flushed_events = snapshot["events"]
+            return True
+
+    def autoflush(self, path, interval=5.0):
+        """
+        Flush to `path` every `interval` seconds from a daemon thread.
+
+        Returns:
+        - callable: Stops the thread and waits for an in-progress flush to finish.
+        """
+        stop_event = threading.Event()
+
+        def run():
+            while not stop_event.wait(interval):
+                self.flush(path)
+
+        thread = threading.Thread(target=run, name="validation-stats-flush", daemon=True)
+        thread.start()
+
+        def stop():
+            stop_event.set()
+            thread.join()
+
+        return stop
@@ -0,0 +1,198 @@
+"""
+Heuristic structure checks used to assign confidence tiers to prompts the
+classifier marked as parallelizable.
+
+`HeuristicValidator` compiles every pattern once and can score a whole column
+of prompts at a time: `feature_counts` returns a (prompts x features) match
+count matrix, `feature_matrix` applies the thresholds to it, and `tiers`
+combines that matrix with the schema columns to produce confidence tiers with
+NumPy array operations. Because the counts do not depend on the thresholds,
+re-tiering a large CSV with different thresholds only repeats the cheap
+vectorized step.
+"""
+import re
+
+import numpy as np
+
+# More comprehensive verb and object lists
+VERBS = r'(generate|create|write|make|give|provide|list|show|tell|name|identify|find|spot|translate|correct|develop|produce|craft|prepare|construct|compile|analyze|evaluate|compare|contrast|offer|suggest|need|want|require|discuss)'
+
+OBJECTS = r'(examples?|stories?|variations?|ideas?|options?|questions?|sentences?|paragraphs?|items?|tasks?|entities?|keywords?|words?|phrases?|translations?|summaries?|reports?|reviews?|analyses?|cases?|scenarios?|characters?|profiles?|descriptions?|suggestions?|recommendations?)'
+
+# (feature name, pattern, matched against the lowercased prompt?)
+PATTERNS = [
+    # Explicit numeric requests with expanded patterns
+    ("numeric_request", fr'\b{VERBS}?\s*\d+\s*{OBJECTS}\b', True),
+    # Explicit list markers (enhanced for multi-language support)
+    ("list_markers", r'\b(following|these|each of|all of|todos?|las?s?|die|der|das|les?|la|il|и|и|и)\s+(questions?|items?|prompts?|sentences?|paragraphs?|tasks?|texts?|statements?|passages?|preguntas?|frases?|fragen|sätze|questions|phrases|вопросы|предложения)\b', True),
+    # Multiple numbered items in the prompt (enhanced pattern)
+    ("numbered_items", r'(?:\d+[\.\)\:]|(?:\n[-•*]\s+))', False),
+    # Multiple questions in sequence (enhanced pattern)
+    ("multiple_questions", r'\?[\s\n]+', False),
+    # List format with bullets or dashes
+    ("bullet_list", r'(\n\s*[-•*]\s+|\n\s*\d+[\.\)]\s+)', False),
+    # Keywords like "multiple" or "each" (enhanced for multi-language)
+    ("multiplicity_markers", r'\b(multiple|several|each|all|every|various|respectively|varios?s?|plusieurs|mehrere|多个|многие)\b', True),
+    # Comma-separated lists (at least 3 items)
+    ("comma_list", r'\b\w+\b\s*,\s*\b\w+\b\s*(?:,\s*(?:and\s+)?\b\w+\b)+', True),
+    # "for each" pattern
+    ("for_each", r'\bfor\s+(every|each)\b', True),
+    # Plural nouns followed by list
+    ("plural_list", r'\b\w+s\b\s*[:;]\s*\b', True),
+]
+
+FEATURES = [name for name, _, _ in PATTERNS]
+
+# Features that are thresholded on how often they match rather than whether they match
+COUNTED_FEATURES = ("numbered_items", "multiple_questions", "bullet_list")
+
+HIGH_CONFIDENCE_FEATURES = ("numeric_request", "list_markers", "numbered_items", "bullet_list", "multiple_questions")
+MEDIUM_CONFIDENCE_FEATURES = ("comma_list", "for_each", "plural_list")
+
+MEDIUM_CONFIDENCE_CATEGORIES = ("Reading Comprehension", "Named Entity Recognition", "Translation")
+
+TIERS = np.array(["low_confidence", "medium_confidence", "high_confidence"])
+PASSING_TIERS = ("high_confidence", "medium_confidence")
+
+
+def schema_errors(result):
+    """Problems with the schema extracted for a parallelizable classification, as messages"""
+    errors = []
+    category = result.get("category", "Unknown")
+
+    # Check mutual exclusivity of data and n
+    if result.get("data") is not None and result.get("n") is not None:
+        errors.append("Both 'data' and 'n' fields populated")
+
+    # Check data field format
+    data = result.get("data")
+    if data is not None:
+        if not isinstance(data, list):
+            errors.append("'data' is not a list")
+        elif len(data) < 2:
+            errors.append("'data' list contains fewer than 2 items")
+        elif any(not isinstance(item, str) for item in data):
+            errors.append("'data' contains non-string items")
+
+    # Check n field format
+    n = result.get("n")
+    if n is not None:
+        if not isinstance(n, (int, float)) or n < 2:
+            errors.append("'n' is not a valid number > 1")
+
+    # Check template format
+    template = result.get("template")
+    if template is not None:
+        if category == "Repeated Generation" and "{n}" in template:
+            errors.append("Repeated Generation template contains '{n}'")
+        elif category != "Repeated Generation" and (not "{data}" in template and not "{context}" in template):
+            errors.append("Non-Repeated Generation template missing placeholders")
+
+    return errors
+
+
+def reject(result):
+    """Clear the parallel schema of a classification that failed validation"""
+    result["parallelizable"] = False
+    result["category"] = None
+    result["is_novel_category"] = False
+    result["category_description"] = None
+    result["template"] = None
+    result["context"] = None
+    result["data"] = None
+    result["n"] = None
+    return result
+
+
+class HeuristicValidator:
+    """
+    Precompiled structural validator.
+
+    Parameters:
+    - min_numbered_items (int): Numbered items needed for `numbered_items`.
+    - min_questions (int): Question marks needed for `multiple_questions`.
+    - min_bullets (int): Bullet lines needed for `bullet_list`.
+    - min_medium_data (int): `data` items that alone justify medium confidence.
+    - medium_categories (tuple): Categories that alone justify medium confidence.
+    """
+
+    def __init__(self, min_numbered_items=2, min_questions=2, min_bullets=2, min_medium_data=3,
+                 medium_categories=MEDIUM_CONFIDENCE_CATEGORIES):
+        self.thresholds = {
+            "numbered_items": min_numbered_items,
+            "multiple_questions": min_questions,
+            "bullet_list": min_bullets,
+        }
+        self.min_medium_data = min_medium_data
+        self.medium_categories = tuple(medium_categories)
+
+        self._patterns = [(name, re.compile(pattern), lower) for name, pattern, lower in PATTERNS]
+        self._column = {name: i for i, name in enumerate(FEATURES)}
+
+    def _counts(self, prompt):
+        prompt_lower = prompt.lower()
+        counts = []
+        for name, pattern, lower in self._patterns:
+            text = prompt_lower if lower else prompt
+            if name in COUNTED_FEATURES:
+                counts.append(sum(1 for _ in pattern.finditer(text)))
+            else:
+                counts.append(1 if pattern.search(text) else 0)
+        return counts
+
+    def feature_counts(self, prompts):
+        """Match counts as an int32 array of shape (len(prompts), len(FEATURES))"""
+        counts = np.zeros((len(prompts), len(FEATURES)), dtype=np.int32)
+        for i, prompt in enumerate(prompts):
+            counts[i] = self._counts(prompt)
+        return counts
+
+    def feature_matrix(self, prompts=None, counts=None):
+        """Per-feature booleans as an array of shape (n, len(FEATURES)); pass `counts` to skip the regex pass"""
+        if counts is None:
+            counts = self.feature_counts(prompts)
+        minimums = np.array([self.thresholds.get(name, 1) for name in FEATURES], dtype=np.int32)
+        return counts >= minimums
+
+    def tiers(self, features, data_lengths, n_values, categories):
+        """
+        Assign confidence tiers to a column of parallelizable classifications.
+
+        Parameters:
+        - features (np.ndarray): Boolean matrix from `feature_matrix`.
+        - data_lengths (array-like): Length of each `data` list, 0 when absent.
+        - n_values (array-like): Value of `n`, 0 when absent.
+        - categories (array-like): Category of each classification.
+
+        Returns:
+        - np.ndarray: Tier name per row.
+        """
+        column = self._column
+        data_lengths = np.asarray(data_lengths, dtype=np.int64)
+        n_values = np.asarray(n_values, dtype=np.float64)
+        categories = np.asarray(categories, dtype=object)
+
+        has_parallel_data = data_lengths > 1
+        has_multiple_n = n_values > 1
+
+        # High confidence validation logic - strict criteria
+        high = features[:, [column[name] for name in HIGH_CONFIDENCE_FEATURES]].any(axis=1)
+        high |= features[:, column["multiplicity_markers"]] & (has_parallel_data | has_multiple_n)
+
+        # Medium confidence validation - more permissive criteria
+        medium = features[:, [column[name] for name in MEDIUM_CONFIDENCE_FEATURES]].any(axis=1)
+        medium |= np.isin(categories, self.medium_categories)
+        medium |= has_parallel_data & (data_lengths >= self.min_medium_data)
+
+        return TIERS[np.where(high, 2, np.where(medium, 1, 0))]
+
+    def tier(self, prompt, result):
+        """Confidence tier for a single classification"""
+        data = result.get("data")
+        n = result.get("n")
+        return str(self.tiers(
+            self.feature_matrix([prompt]),
+            [len(data) if isinstance(data, list) else 0],
+            [n if isinstance(n, (int, float)) else 0],
+            [result.get("category", "Unknown")],
+        )[0])
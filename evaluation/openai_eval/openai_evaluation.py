@@ -1,23 +1,236 @@
 import json
 import random
 import argparse
+import asyncio
+import hashlib
 import os
-from pydantic import BaseModel
-from openai import OpenAI
+import sys
+from typing import Literal
+from pydantic import BaseModel, ValidationError
 import tqdm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from parallelprompt import tracing
+from parallelprompt.aimd import AIMDController, run_windowed
+from parallelprompt.backends import add_backend_arguments, backend_from_args
+from parallelprompt.batch import add_batch_arguments, run_batch
+from parallelprompt.latency_model import category_from_path
+from parallelprompt.scheduler import scheduled_backend_options
+
+DEFAULT_MODEL = "gpt-4"
+CRITERIA = ["accuracy", "grammar", "detail", "preference"]
+
+SYSTEM_PROMPT = """
+You are an impartial judge tasked with comparing two LLM responses. You will answer four specific questions based on the two responses provided, using the following criteria:
+
+1. **Accuracy**: Which response more accurately follows the instructions given in the prompt?
+   - Score 1 if response 1 is more accurate, 2 if response 2 is more accurate, or 0 if they are equally accurate or equally inaccurate.
+
+2. **Grammar**: Which response is more grammatically correct?
+   - Score 1 if response 1 is grammatically superior, 2 if response 2 is better, or 0 if they are equally grammatically correct (or incorrect).
+
+3. **Detail**: Which response provides more detail and specificity?
+   - Score 1 if response 1 is more detailed, 2 if response 2 is more detailed, or 0 if they are equally detailed (or equally lacking in detail).
+
+4. **Preference**: Which response do you personally prefer overall, considering all factors?
+   - Score 1 if you prefer response 1 overall, 2 if you prefer response 2, or 0 if you are equally satisfied with both responses.
+
+5. **Reasoning**: Explain your reasoning for your above answers.
+    - Provide a short paragraph explaining your reasoning for the above questions.
+
+The format of your response must consist of a JSON object with the following structure:
+{
+    "accuracy": 1 | 2 | 0,
+    "grammar": 1 | 2 | 0,
+    "detail": 1 | 2 | 0,
+    "preference": 1 | 2 | 0,
+    "reasoning": str,
+}
+"""
+INSTRUCTION = "Here is the prompt and two responses. Compare them based on accuracy, grammar, detail, and preference, and explain your reasoning."
+
 
 class LLMJudgeResponse(BaseModel):
     """
     Pydantic model for parsing the LLM judge's response.
     """
-    accuracy: int  # 1 for response 1, 2 for response 2, 0 if tied
-    grammar: int   # 1 for response 1, 2 for response 2, 0 if tied
-    detail: int    # 1 for response 1, 2 for response 2, 0 if tied
-    preference: int  # 1 for response 1, 2 for response 2, 0 if tied
+    accuracy: Literal[0, 1, 2]  # 1 for response 1, 2 for response 2, 0 if tied
+    grammar: Literal[0, 1, 2]   # 1 for response 1, 2 for response 2, 0 if tied
+    detail: Literal[0, 1, 2]    # 1 for response 1, 2 for response 2, 0 if tied
+    preference: Literal[0, 1, 2]  # 1 for response 1, 2 for response 2, 0 if tied
     reasoning: str    # Explanation for the scores
 
 
+# The verdict is returned as a forced tool call, which every backend supports
+JUDGE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "submit_evaluation",
+        "description": "Submit the comparison of the two responses.",
+        "parameters": LLMJudgeResponse.model_json_schema(),
+    },
+}
+JUDGE_TOOL_CHOICE = {"type": "function", "function": {"name": "submit_evaluation"}}
+
+
+def pair_hash(prompt, response_1, response_2):
+    """Stable id of a judged pair: a changed prompt or response is judged again"""
+    return hashlib.sha256(json.dumps([prompt, response_1, response_2]).encode("utf-8")).hexdigest()
+
+
+def load_pairs(path):
+    """
+    Serial/parallel pairs to judge from an engine or C++ driver results file.
+    Pairs are tagged with the record's category, or one derived from the file name.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    fallback = category_from_path(path)
+    pairs = []
+    for request in data:
+        if not isinstance(request, dict) or "prompt" not in request:
+            continue
+        response_1 = request["serial_output"]  # The "serial" response
+        response_2 = "\n\n".join(request["parallel_output"])  # The "parallel" response
+        pairs.append({
+            "prompt": request["prompt"],
+            "response_1": response_1,
+            "response_2": response_2,
+            "pair_hash": pair_hash(request["prompt"], response_1, response_2),
+            "category": request.get("category") or fallback,
+        })
+    return pairs
+
+
+def load_completed(path):
+    """
+    Hashes of the pairs already in a JSONL results file.
+
+    A line cut short by a crash is truncated away, so appending resumes on a clean line.
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "rb+") as f:
+        good_end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                completed.add(json.loads(line)["pair_hash"])
+            except (ValueError, KeyError):
+                pass
+            good_end += len(line)
+        f.truncate(good_end)
+    return completed
+
+
+def judge_prompt(prompt, responses):
+    return "\n\n".join([
+        INSTRUCTION,
+        f"Prompt: {prompt}",
+        f"Response 1: {responses[0]}",
+        f"Response 2: {responses[1]}",
+    ])
+
+
+def map_evaluation(evaluation, shuffled_labels):
+    """Re-map the scores of the shuffled responses to the original order (serial vs parallel)"""
+    mapped_evaluation = {}
+    for key in CRITERIA:
+        score = evaluation[key]
+        if score == 0:
+            mapped_score = 0  # Tie
+        else:
+            # Map back to original labels
+            winner_label = shuffled_labels[score - 1]
+            mapped_score = 1 if winner_label == "serial" else 2
+        mapped_evaluation[key] = mapped_score
+
+    # Include reasoning in the mapped evaluation
+    mapped_evaluation['reasoning'] = evaluation['reasoning']
+    return mapped_evaluation
+
+
+def shuffled(pair):
+    """
+    The pair's responses in a random order, to avoid position bias, with their labels.
+    Seeded by the pair, so a re-run (or a batch job) asks the same question.
+    """
+    shuffled_order = list(zip([pair["response_1"], pair["response_2"]], ["serial", "parallel"]))
+    random.Random(pair["pair_hash"]).shuffle(shuffled_order)
+    return [resp for resp, _ in shuffled_order], [label for _, label in shuffled_order]
+
+
+def judge_request(pair):
+    """Batch job request judging one pair, identified by its hash"""
+    shuffled_responses, _ = shuffled(pair)
+    return {"custom_id": pair["pair_hash"], "system_prompt": SYSTEM_PROMPT,
+            "prompt": judge_prompt(pair["prompt"], shuffled_responses), "max_tokens": 1024,
+            "tools": [JUDGE_TOOL], "tool_choice": JUDGE_TOOL_CHOICE}
+
+
+async def judge(backend, pair):
+    """
+    Judge one pair; returns its result line, or None if the verdict could not be parsed.
+    Rate limiting is raised as `Throttled` by the backend, for the request window to back off.
+    """
+    shuffled_responses, shuffled_labels = shuffled(pair)
+    with tracing.queued():
+        completion = await backend.complete(SYSTEM_PROMPT, judge_prompt(pair["prompt"], shuffled_responses),
+                                            max_tokens=1024, tools=[JUDGE_TOOL], tool_choice=JUDGE_TOOL_CHOICE)
+    return judge_result(pair, completion, shuffled_labels)
+
+
+def judge_result(pair, completion, shuffled_labels):
+    """Result line of a judged pair, or None if the verdict could not be parsed"""
+    tool_calls = completion.get("tool_calls") or []
+    try:
+        evaluation = LLMJudgeResponse.model_validate_json(tool_calls[0]["arguments"]).model_dump()
+    except (IndexError, ValidationError) as e:
+        print(f"Parsing error or refusal: {completion.get('text') or e}")
+        return None
+
+    return {
+        "pair_hash": pair["pair_hash"],
+        "prompt": pair["prompt"],
+        "response_1": pair["response_1"],  # Always "serial"
+        "response_2": pair["response_2"],  # Always "parallel"
+        "evaluation": map_evaluation(evaluation, shuffled_labels),
+        "category": pair["category"],
+    }
+
+
+def judge_batch(args, pending):
+    """Judge the pending pairs as one batch job and append the verdicts to the results file"""
+    pending = list({pair["pair_hash"]: pair for pair in pending}.values())  # One request per distinct pair
+    backend = backend_from_args(args)
+    backend.check()
+    job_dir = os.path.join(args.batch_dir, f"{os.path.splitext(os.path.basename(args.output))[0]}_job")
+    try:
+        completions = run_batch(backend, [judge_request(pair) for pair in pending], job_dir,
+                                poll_interval=args.poll_interval, timeout=args.batch_timeout) if pending else {}
+    finally:
+        backend.close()
+
+    judged = refused = failed = 0
+    with open(args.output, "a") as outfile:
+        for pair in pending:
+            completion = completions.get(pair["pair_hash"])
+            if completion is None or "error" in completion:
+                failed += 1
+                continue
+            result = judge_result(pair, completion, shuffled(pair)[1])
+            if result is None:
+                refused += 1
+                continue
+            outfile.write(json.dumps(result) + "\n")
+            judged += 1
+
+    print(f"Judged {judged} pairs ({refused} unparsable, {failed} failed); re-run to retry the rest.")
+    print(f"Evaluation results saved to '{args.output}'.")
+
+
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(
@@ -32,148 +245,88 @@ def main():
     parser.add_argument(
         "--output",
         type=str,
-        default="evaluation_results.json",
-        help="Path to the output JSON file to save evaluation results.",
+        default="evaluation_results.jsonl",
+        help="Path to the output JSONL file; pairs already in it are skipped.",
     )
     parser.add_argument(
-        "--model",
-        type=str,
-        default="gpt-4",
-        help="OpenAI model to use for evaluation (default: gpt-4).",
+        "--initial-concurrency",
+        type=int,
+        default=4,
+        help="Judge requests in flight at the start; the window grows until throttled.",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=32,
+        help="Largest number of judge requests in flight.",
+    )
+    parser.add_argument(
+        "--batch-job",
+        action="store_true",
+        help="Judge the pending pairs in one offline batch job instead of interactive requests.",
     )
+    add_batch_arguments(parser, default_dir="batch_jobs")
+    add_backend_arguments(parser, default="openai")
     args = parser.parse_args()
-
-    # Initialize OpenAI client
-    client = OpenAI()
-
-    # Define the system prompt and initial user message
-    messages = [
-        {
-            "role": "system",
-            "content": """
-            You are an impartial judge tasked with comparing two LLM responses. You will answer four specific questions based on the two responses provided, using the following criteria:
-
-            1. **Accuracy**: Which response more accurately follows the instructions given in the prompt?
-               - Score 1 if response 1 is more accurate, 2 if response 2 is more accurate, or 0 if they are equally accurate or equally inaccurate.
-
-            2. **Grammar**: Which response is more grammatically correct?
-               - Score 1 if response 1 is grammatically superior, 2 if response 2 is better, or 0 if they are equally grammatically correct (or incorrect).
-
-            3. **Detail**: Which response provides more detail and specificity?
-               - Score 1 if response 1 is more detailed, 2 if response 2 is more detailed, or 0 if they are equally detailed (or equally lacking in detail).
-
-            4. **Preference**: Which response do you personally prefer overall, considering all factors?
-               - Score 1 if you prefer response 1 overall, 2 if you prefer response 2, or 0 if you are equally satisfied with both responses.
-
-            5. **Reasoning**: Explain your reasoning for your above answers.
-                - Provide a short paragraph explaining your reasoning for the above questions.
-
-            The format of your response must consist of a JSON object with the following structure:
-            {
-                "accuracy": 1 | 2 | 0,
-                "grammar": 1 | 2 | 0,
-                "detail": 1 | 2 | 0,
-                "preference": 1 | 2 | 0,
-                "reasoning": str,
-            }
-            """,
-        },
-        {
-            "role": "user",
-            "content": "Here is the prompt and two responses. Compare them based on accuracy, grammar, detail, and preference, and explain your reasoning.",
-        },
-    ]
+    if args.model is None and args.backend == "openai":
+        args.model = DEFAULT_MODEL  # OpenAI model to use for evaluation
 
     # Load the data from the input file
     if not os.path.exists(args.input):
         print(f"Input file '{args.input}' not found.")
         return
 
-    with open(args.input, "r") as f:
-        data = json.load(f)
+    pairs = load_pairs(args.input)
+    completed = load_completed(args.output)
+    pending = [pair for pair in pairs if pair["pair_hash"] not in completed]
+    print(f"{len(pairs)} pairs, {len(pairs) - len(pending)} already judged in '{args.output}'")
 
-    # Initialize the results list
-    results = []
+    if args.batch_job:
+        judge_batch(args, pending)
+        return
 
-    # Iterate over each request in the data
-    for request in tqdm.tqdm(data):
-        if "prompt" not in request:
-            continue
+    # Throttling surfaces immediately and is retried by the request window instead of the client
+    options = scheduled_backend_options(args.backend)
+    if args.backend in ("openai", "mock-http"):
+        options["max_connections"] = args.max_concurrency
+    elif args.backend == "bedrock":
+        options["max_pool_connections"] = args.max_concurrency
+    backend = backend_from_args(args, **options)
+    backend.check()
 
-        prompt = request["prompt"]
-        response_1 = request["serial_output"]  # The "serial" response
-        response_2 = "\n\n".join(request["parallel_output"])  # The "parallel" response
+    controller = AIMDController(initial_window=args.initial_concurrency, max_window=args.max_concurrency)
+    progress = tqdm.tqdm(total=len(pending))
+    refused = 0
 
-        # Shuffle the responses to avoid bias
-        responses = [response_1, response_2]
-        original_order = ["serial", "parallel"]
-        shuffled_order = list(zip(responses, original_order))
-        random.shuffle(shuffled_order)
+    with open(args.output, "a") as outfile:
+        def on_result(item, result):
+            # Each result is appended as soon as it completes, so a crash loses only in-flight pairs
+            nonlocal refused
+            progress.update(1)
+            if result is None:
+                refused += 1
+                return
+            outfile.write(json.dumps(result) + "\n")
+            outfile.flush()
 
-        # Unpack shuffled responses and labels
-        shuffled_responses = [resp for resp, _ in shuffled_order]
-        shuffled_labels = [label for _, label in shuffled_order]
+        def on_error(item, exc):
+            progress.update(1)
+            print(f"Error during API call: {exc}")
 
-        # Construct the messages to send to the API
-        conversation = messages + [
-            {"role": "user", "content": f"Prompt: {prompt}"},
-            {"role": "user", "content": f"Response 1: {shuffled_responses[0]}"},
-            {"role": "user", "content": f"Response 2: {shuffled_responses[1]}"},
-        ]
+        async def run():
+            try:
+                return await run_windowed(((backend, pair) for pair in pending), judge, on_result,
+                                          controller=controller, on_error=on_error, retry_delay=2.0)
+            finally:
+                await backend.aclose()
 
-        # Send the prompt and shuffled responses to the API for evaluation
         try:
-            completion = client.beta.chat.completions.parse(
-                model=args.model,
-                response_format=LLMJudgeResponse,
-                messages=conversation,
-            )
-        except Exception as e:
-            print(f"Error during API call: {e}")
-            continue
-
-        # Capture the evaluation from the response
-        message = completion.choices[0].message
-        if message.parsed:
-            # Extract evaluation scores
-            evaluation = {
-                "accuracy": message.parsed.accuracy,
-                "grammar": message.parsed.grammar,
-                "detail": message.parsed.detail,
-                "preference": message.parsed.preference,
-                "reasoning": message.parsed.reasoning,
-            }
-
-            # Re-map the scores to the original order (serial vs parallel)
-            mapped_evaluation = {}
-            for key in ['accuracy', 'grammar', 'detail', 'preference']:
-                score = evaluation[key]
-                if score == 0:
-                    mapped_score = 0  # Tie
-                else:
-                    # Map back to original labels
-                    winner_label = shuffled_labels[score - 1]
-                    mapped_score = 1 if winner_label == "serial" else 2
-                mapped_evaluation[key] = mapped_score
-
-            # Include reasoning in the mapped evaluation
-            mapped_evaluation['reasoning'] = evaluation['reasoning']
-
-            # Store the result with the prompt and evaluation
-            results.append(
-                {
-                    "prompt": prompt,
-                    "response_1": response_1,  # Always "serial"
-                    "response_2": response_2,  # Always "parallel"
-                    "evaluation": mapped_evaluation,
-                }
-            )
-        else:
-            print(f"Parsing error or refusal: {message.refusal}")
+            counters = asyncio.run(run())
+        finally:
+            progress.close()
 
-    # Save the results to the output JSON file
-    with open(args.output, "w") as outfile:
-        json.dump(results, outfile, indent=4)
+    print(f"Judged {counters['completed'] - refused} pairs ({refused} unparsable, {counters['failed']} failed, "
+          f"throttled {counters['throttled']} times); re-run to retry the rest.")
     print(f"Evaluation results saved to '{args.output}'.")
 
 
@@ -1,6 +1,197 @@
+"""
+Summarize LLM-judge results: serial vs. parallel win rates with bootstrap confidence intervals.
+
+Result files are read line by line and every judgment is reduced to its four
+scores (0 tie, 1 serial, 2 parallel) in fixed-size NumPy chunks, which are
+folded into outcome counts per category and criterion. Memory therefore does
+not grow with the number of judgments, and several runs can be pooled.
+
+Judgments are independent and each has one of three outcomes per criterion,
+so resampling judgments with replacement is the same as drawing the outcome
+counts from a multinomial with the observed shares. The bootstrap draws all
+resamples of all categories and criteria in one vectorized call from the
+counts alone.
+
+Usage:
+    python parse_openai_evaluation.py --input evaluation_results.jsonl
+    python parse_openai_evaluation.py --input "runs/*/evaluation_results.jsonl" --confidence 0.95 --output stats.json
+"""
 import json
 import argparse
+import glob
 import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from parallelprompt.latency_model import category_from_path
+
+CRITERIA = ["accuracy", "grammar", "detail", "preference"]
+OUTCOMES = ["tie", "serial", "parallel"]  # Indexed by score
+CHUNK_SIZE = 65536
+
+_decoder = json.JSONDecoder()
+
+
+def parse_line(line):
+    """
+    (evaluation, category) of one JSONL result line.
+
+    Only the tail from the `evaluation` key is decoded: a key cannot occur inside a
+    JSON string (its quotes would be escaped), and the prompt and responses before
+    it are by far the largest part of the line.
+    """
+    start = line.rfind(b'"evaluation": ')
+    if start < 0:
+        result = json.loads(line)
+        return result["evaluation"], result.get("category")
+    evaluation, _ = _decoder.raw_decode(line[start + len(b'"evaluation": '):].decode("utf-8"))
+    category = None
+    key = line.rfind(b'"category": ')
+    if key > start:
+        category, _ = _decoder.raw_decode(line[key + len(b'"category": '):].decode("utf-8"))
+    return evaluation, category
+
+
+def iter_results(path):
+    """(evaluation, category) per judgment in a results file, streamed for JSONL"""
+    if path.endswith(".jsonl"):
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield parse_line(line.rstrip(b"\n"))
+    else:
+        # A JSON list written by older versions has to be read whole
+        with open(path, "r") as f:
+            for result in json.load(f):
+                yield result["evaluation"], result.get("category")
+
+
+class OutcomeCounts:
+    """
+    Outcome counts per category and criterion, shape (categories, criteria, outcomes),
+    accumulated from judgments in chunks.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.categories = []
+        self._codes = {}
+        self.counts = np.zeros((0, len(CRITERIA), len(OUTCOMES)), dtype=np.int64)
+        self._scores = np.zeros((chunk_size, len(CRITERIA)), dtype=np.int8)
+        self._category = np.zeros(chunk_size, dtype=np.int32)
+        self._filled = 0
+
+    def code(self, category):
+        code = self._codes.get(category)
+        if code is None:
+            code = self._codes[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    def add(self, evaluation, category):
+        row = self._filled
+        self._scores[row] = [score if score in (1, 2) else 0 for score in map(evaluation.get, CRITERIA)]
+        self._category[row] = self.code(category)
+        self._filled += 1
+        if self._filled == len(self._category):
+            self.flush()
+
+    def flush(self):
+        """Fold the buffered chunk into the counts"""
+        filled, self._filled = self._filled, 0
+        if not filled:
+            return
+        shape = (len(self.categories), len(CRITERIA), len(OUTCOMES))
+        if self.counts.shape[0] < shape[0]:
+            self.counts = np.concatenate([self.counts, np.zeros((shape[0] - self.counts.shape[0],) + shape[1:],
+                                                                dtype=np.int64)])
+        # Flat index of (category, criterion, outcome) for every score in the chunk
+        criteria = np.arange(len(CRITERIA)) * len(OUTCOMES)
+        flat = (self._category[:filled, None] * (len(CRITERIA) * len(OUTCOMES)) + criteria
+                + self._scores[:filled]).ravel()
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(shape)
+
+
+def count_outcomes(paths, chunk_size=CHUNK_SIZE):
+    """
+    Stream result files into outcome counts.
+
+    Judgments without a category (from older runs) are attributed to one derived from the file name.
+
+    Returns:
+    - OutcomeCounts
+    """
+    counts = OutcomeCounts(chunk_size)
+    for path in paths:
+        fallback = category_from_path(path)
+        for evaluation, category in iter_results(path):
+            counts.add(evaluation, category or fallback)
+    counts.flush()
+    return counts
+
+
+def bootstrap_rates(counts, resamples=2000, confidence=0.95, seed=0):
+    """
+    Outcome shares and the parallel win rate (ties counted as half a win) with bootstrap intervals.
+
+    Parameters:
+    - counts (np.ndarray): Outcome counts, shape (..., outcomes).
+    - resamples (int): Bootstrap resamples.
+    - confidence (float): Interval coverage.
+    - seed (int): Seed of the resampling.
+
+    Returns:
+    - dict: "rates", "low" and "high", each of shape (..., outcomes + 1); the last column is the win rate.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    totals = counts.sum(axis=-1)
+    shares = counts / np.maximum(totals, 1)[..., None]
+    rng = np.random.default_rng(seed)
+    draws = rng.multinomial(totals, np.where(totals[..., None] > 0, shares, 1.0 / counts.shape[-1]),
+                            size=(resamples,) + totals.shape)
+    draws = draws / np.maximum(totals, 1)[..., None]
+
+    def with_win_rate(x):
+        return np.concatenate([x, x[..., 2:3] + 0.5 * x[..., 0:1]], axis=-1)
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(with_win_rate(draws), [alpha, 1 - alpha], axis=0)
+    empty = totals[..., None] == 0
+    return {"rates": with_win_rate(shares), "low": np.where(empty, np.nan, low),
+            "high": np.where(empty, np.nan, high)}
+
+
+def summarize(counts, resamples=2000, confidence=0.95, seed=0):
+    """Per-group (all categories pooled, then each category) counts, rates and intervals by criterion"""
+    groups = ["all"] + counts.categories
+    grouped = np.concatenate([counts.counts.sum(axis=0, keepdims=True), counts.counts])
+    rates = bootstrap_rates(grouped, resamples=resamples, confidence=confidence, seed=seed)
+    columns = OUTCOMES + ["parallel_win_rate"]
+    summary = {}
+    for g, group in enumerate(groups):
+        summary[group] = {"judgments": int(grouped[g, 0].sum()), "criteria": {}}
+        for c, criterion in enumerate(CRITERIA):
+            entry = {f"{outcome}_count": int(grouped[g, c, o]) for o, outcome in enumerate(OUTCOMES)}
+            for k, column in enumerate(columns):
+                entry[column] = [float(rates["rates"][g, c, k]), float(rates["low"][g, c, k]),
+                                 float(rates["high"][g, c, k])]
+            summary[group]["criteria"][criterion] = entry
+    return summary
+
+
+def print_summary(summary, confidence):
+    def cell(value):
+        rate, low, high = value
+        return f"{rate * 100:5.1f}% [{low * 100:4.1f}, {high * 100:4.1f}]"
+
+    print(f"Evaluation Statistics ({confidence * 100:.0f}% bootstrap intervals; win rate counts ties as half):")
+    for group, stats in summary.items():
+        print(f"\n{group} ({stats['judgments']} judgments)")
+        print(f"{'criterion':<12}{'serial wins':>24}{'parallel wins':>24}{'ties':>24}{'parallel win rate':>24}")
+        for criterion, entry in stats["criteria"].items():
+            print(f"{criterion:<12}{cell(entry['serial']):>24}{cell(entry['parallel']):>24}{cell(entry['tie']):>24}"
+                  f"{cell(entry['parallel_win_rate']):>24}")
 
 
 def main():
@@ -11,49 +202,31 @@ def main():
     parser.add_argument(
         "--input",
         type=str,
+        nargs="+",
         required=True,
-        help="Path to the evaluation results JSON file.",
+        help="Evaluation results files or globs (JSONL from openai_evaluation.py, or legacy JSON lists); pooled.",
     )
+    parser.add_argument("--confidence", type=float, default=0.95, help="Coverage of the bootstrap intervals.")
+    parser.add_argument("--resamples", type=int, default=2000, help="Bootstrap resamples.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap.")
+    parser.add_argument("--output", type=str, default=None, help="Also write the statistics as JSON.")
     args = parser.parse_args()
 
-    # Check if input file exists
-    if not os.path.exists(args.input):
-        print(f"Input file '{args.input}' not found.")
+    paths = sorted({path for pattern in args.input for path in (glob.glob(pattern) or [pattern])})
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        print(f"Input file '{missing[0]}' not found.")
         return
 
-    # Initialize counters for the "serial" and "parallel" wins and ties
-    stats = {
-        "accuracy": {"serial": 0, "parallel": 0, "tie": 0},
-        "grammar": {"serial": 0, "parallel": 0, "tie": 0},
-        "detail": {"serial": 0, "parallel": 0, "tie": 0},
-        "preference": {"serial": 0, "parallel": 0, "tie": 0},
-    }
-
-    # Read the evaluation results from the JSON file
-    with open(args.input, "r") as infile:
-        data = json.load(infile)
-
-    # Analyze each prompt and update statistics
-    for result in data:
-        evaluation = result["evaluation"]
-
-        # Update statistics for each category
-        for category in ["accuracy", "grammar", "detail", "preference"]:
-            score = evaluation.get(category)
-            if score == 1:
-                stats[category]["serial"] += 1
-            elif score == 2:
-                stats[category]["parallel"] += 1
-            else:
-                stats[category]["tie"] += 1
-
-    # Print the statistics
-    print("Evaluation Statistics:")
-    for category, results in stats.items():
-        print(f"\n{category.capitalize()} Results:")
-        print(f"Serial wins: {results['serial']}")
-        print(f"Parallel wins: {results['parallel']}")
-        print(f"Ties: {results['tie']}")
+    counts = count_outcomes(paths)
+    summary = summarize(counts, resamples=args.resamples, confidence=args.confidence, seed=args.seed)
+    print_summary(summary, args.confidence)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"inputs": paths, "confidence": args.confidence, "resamples": args.resamples,
+                       "groups": summary}, f, indent=2)
+        print(f"\nStatistics saved to '{args.output}'.")
 
 
 if __name__ == "__main__":
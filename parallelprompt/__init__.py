@@ -0,0 +1,7 @@
+"""
+Shared Python runtime for the ParallelPrompt curation, conversion, evaluation
+and benchmarking scripts.
+
+The scripts under `data_curation/`, `utils/` and `evaluation/` add the
+repository root to `sys.path` and import from this package directly.
+"""
@@ -0,0 +1,171 @@
+"""
+Adaptive-concurrency request window for rate-limited model APIs.
+
+`run_windowed` keeps a rolling window of in-flight requests instead of
+processing fixed-size batches behind a barrier. The window size is driven by
+an `AIMDController`: it grows additively while requests succeed and shrinks
+multiplicatively when the provider throttles us (or, optionally, when latency
+exceeds a target), the same scheme TCP uses for congestion control.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class Throttled(Exception):
+    """Raised by a request callable when the provider rejected it for rate limiting"""
+
+    def __init__(self, retry_after=None):
+        super().__init__("request throttled")
+        self.retry_after = retry_after
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit.
+
+    Parameters:
+    - initial_window (int): Number of requests allowed in flight at start.
+    - min_window (int): Lower bound on the window.
+    - max_window (int): Upper bound on the window.
+    - increase (float): Slots added per full window of successful requests.
+    - decrease (float): Factor applied to the window on throttling.
+    - latency_target (float, optional): Seconds; slower successes count as congestion.
+    """
+
+    def __init__(self, initial_window=4, min_window=1, max_window=64,
+                 increase=1.0, decrease=0.5, latency_target=None):
+        self.window = float(initial_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+
+        self.srtt = None  # Smoothed request latency, seconds
+        self.successes = 0
+        self.throttles = 0
+        self._last_decrease = float("-inf")
+
+    @property
+    def limit(self):
+        """Current number of requests allowed in flight"""
+        return max(self.min_window, min(self.max_window, int(self.window)))
+
+    def on_success(self, latency):
+        self.successes += 1
+        self.srtt = latency if self.srtt is None else 0.875 * self.srtt + 0.125 * latency
+
+        if self.latency_target is not None and latency > self.latency_target:
+            self._decrease()
+        else:
+            # One extra slot per window's worth of successes
+            self.window = min(self.max_window, self.window + self.increase / max(1.0, self.window))
+
+    def on_throttle(self):
+        self.throttles += 1
+        self._decrease()
+
+    def _decrease(self):
+        # Shrink at most once per round trip so a burst of rejections from the
+        # same window does not collapse it straight to the minimum
+        now = time.monotonic()
+        if now - self._last_decrease < (self.srtt or 0.0):
+            return
+        self._last_decrease = now
+        self.window = max(float(self.min_window), self.window * self.decrease)
+
+
+async def run_windowed(items, call, on_result, controller=None, on_error=None,
+                       max_retries=8, retry_delay=1.0, max_retry_delay=60.0):
+    """
+    Run `call(*item)` for every item with an adaptive number of requests in flight.
+
+    Parameters:
+    - items (iterable): Tuples of positional arguments for `call`; consumed lazily.
+    - call (callable): Coroutine function performing one request. It should raise
+      `Throttled` when the provider rate-limits the request.
+    - on_result (callable): Invoked as `on_result(item, result)` on the event loop
+      thread as each request completes, in completion order.
+    - controller (AIMDController, optional): Window controller; a default one is created.
+    - on_error (callable, optional): Invoked as `on_error(item, exc)` once an item
+      has exhausted its retries. Errors are re-raised when not provided.
+    - max_retries (int): Attempts per item before giving up.
+    - retry_delay (float): Base delay in seconds for exponential retry backoff.
+    - max_retry_delay (float): Cap on a single retry delay.
+
+    Returns:
+    - dict: Counters for completed, failed, throttled and retried requests.
+    """
+    controller = controller or AIMDController()
+    source = iter(items)
+    exhausted = False
+
+    inflight = {}  # task -> (item, attempt, start time)
+    retries = []  # heap of (ready time, seq, item, attempt)
+    seq = itertools.count()
+    counters = {"completed": 0, "failed": 0, "throttled": 0, "retried": 0}
+
+    def schedule_retry(item, attempt, delay):
+        counters["retried"] += 1
+        heapq.heappush(retries, (time.monotonic() + delay, next(seq), item, attempt))
+
+    try:
+        while True:
+            # Top up the window, preferring due retries over fresh items
+            now = time.monotonic()
+            while len(inflight) < controller.limit:
+                if retries and retries[0][0] <= now:
+                    _, _, item, attempt = heapq.heappop(retries)
+                elif not exhausted:
+                    try:
+                        item, attempt = next(source), 0
+                    except StopIteration:
+                        exhausted = True
+                        continue
+                else:
+                    break
+                task = asyncio.ensure_future(call(*item))
+                inflight[task] = (item, attempt, time.monotonic())
+
+            if not inflight:
+                if not retries and exhausted:
+                    break
+                if retries:
+                    await asyncio.sleep(max(0.0, retries[0][0] - time.monotonic()))
+                continue
+
+            timeout = max(0.0, retries[0][0] - now) if retries else None
+            done, _ = await asyncio.wait(inflight, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                item, attempt, start = inflight.pop(task)
+                exc = task.exception()
+
+                if exc is None:
+                    controller.on_success(time.monotonic() - start)
+                    counters["completed"] += 1
+                    on_result(item, task.result())
+                    continue
+
+                if isinstance(exc, Throttled):
+                    counters["throttled"] += 1
+                    controller.on_throttle()
+
+                if attempt + 1 < max_retries:
+                    delay = getattr(exc, "retry_after", None)
+                    if delay is None:
+                        delay = min(max_retry_delay, retry_delay * (2 ** attempt))
+                    schedule_retry(item, attempt + 1, delay)
+                else:
+                    counters["failed"] += 1
+                    if on_error is None:
+                        raise exc
+                    on_error(item, exc)
+    finally:
+        for task in inflight:
+            task.cancel()
+
+    return counters
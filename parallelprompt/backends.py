@@ -0,0 +1,1257 @@
+"""
+Chat-completion backends shared by the curation, conversion and benchmarking scripts.
+
+Every backend exposes the same two calls, `complete_sync(...)` for thread-based
+callers and `async complete(...)` for asyncio callers. Both return a dict with
+`text`, `prompt_tokens`, `completion_tokens` and, when the model called a tool,
+`tool_calls` (a list of {"name", "arguments"} with arguments as a JSON string)
+and, when the provider served part of the prompt from its prompt cache,
+`cached_tokens`. `async stream(...)` yields the same completion incrementally
+as `{"text": delta}` events followed by one final event with `done` and the
+token counts (see `Backend.stream`).
+Rate-limit rejections are raised as `aimd.Throttled` whatever the provider, so
+callers can back off in one place.
+
+- `BedrockBackend`: Anthropic models on AWS Bedrock. The boto3 client (and the
+  credential check) is created on first use, not at import.
+- `OpenAIBackend`: Any OpenAI-compatible chat completions endpoint over pooled httpx clients.
+- `MockBackend`: In-process, deterministic simulation of time-to-first-token,
+  per-token decode latency, requests-per-minute limits, injected errors and,
+  optionally, prefix caching.
+- `MockServer`: Serves a `MockBackend` as an OpenAI-compatible HTTP endpoint on
+  localhost, so the full HTTP path (including the C++ drivers) can be exercised offline.
+
+Bedrock, OpenAI and the mocks also run offline batch jobs (`submit_batch`,
+`batch_status`, `batch_results`), driven by `parallelprompt.batch.run_batch`.
+
+Usage:
+    python -m parallelprompt.backends serve --port 8000 --mock-ttft 0.3 --mock-per-token 0.02
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from parallelprompt import tracing
+from parallelprompt.aimd import Throttled
+from parallelprompt.batch import BATCH_ENDPOINT, LocalBatchStore
+
+BACKENDS = ("bedrock", "openai", "mock", "mock-http")
+
+DEFAULT_MODELS = {
+    "bedrock": "us.anthropic.claude-3-5-haiku-20241022-v1:0",
+    "openai": "gpt-4o",
+    "mock": "mock",
+    "mock-http": "mock",
+}
+
+# Error codes Bedrock uses when rejecting a request for rate limiting
+BEDROCK_THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException"}
+
+
+class BackendError(Exception):
+    """A request the backend rejected for a reason other than rate limiting"""
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token) for providers that do not report usage"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class Backend:
+    """Base class; subclasses implement `complete_sync` and may override `complete` with native async I/O"""
+
+    name = None
+
+    def __init__(self, model=None):
+        self.model = model or DEFAULT_MODELS[self.name]
+
+    def complete_sync(self, system_prompt, prompt, max_tokens=1024, temperature=None, tools=None, tool_choice=None,
+                      **options):
+        raise NotImplementedError
+
+    async def complete(self, system_prompt, prompt, max_tokens=1024, temperature=None, tools=None, tool_choice=None,
+                       **options):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(
+            self.complete_sync, system_prompt, prompt, max_tokens=max_tokens, temperature=temperature,
+            tools=tools, tool_choice=tool_choice, **options))
+
+    async def stream(self, system_prompt, prompt, max_tokens=1024, temperature=None, **options):
+        """
+        Stream a completion as events: `{"text": delta}` per piece of text, then one final
+        `{"text": "", "done": True, "prompt_tokens": ..., "completion_tokens": ...}`.
+
+        Backends without native streaming deliver the whole completion as a single delta.
+        """
+        completion = await self.complete(system_prompt, prompt, max_tokens=max_tokens, temperature=temperature,
+                                         **options)
+        if completion["text"]:
+            yield {"text": completion["text"]}
+        yield _final_event(completion)
+
+    async def _stream_from_thread(self, events):
+        """Relay a blocking event iterator to the event loop from a worker thread"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def produce():
+            try:
+                for event in events:
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        producer = loop.run_in_executor(None, produce)
+        while True:
+            event = await queue.get()
+            if isinstance(event, Exception):
+                raise event
+            yield event
+            if event.get("done"):
+                break
+        await producer
+
+    def submit_batch(self, requests):
+        """
+        Submit requests as one offline batch job (see `parallelprompt.batch.run_batch`).
+
+        Returns:
+        - dict: Job handle with `id` and `status` (one of `batch.PENDING_STATES` or `batch.FINAL_STATES`),
+          JSON-serializable so it can be saved and polled from another process.
+        """
+        raise NotImplementedError(f"The {self.name} backend does not support batch jobs")
+
+    def batch_status(self, job):
+        """Refreshed job handle"""
+        raise NotImplementedError(f"The {self.name} backend does not support batch jobs")
+
+    def batch_results(self, job):
+        """Completions of a completed job by custom_id; {"error": message} for failed requests"""
+        raise NotImplementedError(f"The {self.name} backend does not support batch jobs")
+
+    def check(self):
+        """Raise early if the backend cannot be used, e.g. because credentials are missing"""
+
+    def close(self):
+        pass
+
+    async def aclose(self):
+        self.close()
+
+
+def _final_event(completion):
+    event = {"text": "", "done": True, "prompt_tokens": completion["prompt_tokens"],
+             "completion_tokens": completion["completion_tokens"]}
+    if completion.get("cached_tokens"):
+        event["cached_tokens"] = completion["cached_tokens"]
+    return event
+
+
+def _tool_name(tools, tool_choice):
+    if isinstance(tool_choice, dict):
+        return tool_choice.get("function", {}).get("name")
+    return tools[0]["function"]["name"] if tools else None
+
+
+def _request_args(request):
+    """Positional `request_body` arguments of a batch request (see `batch.run_batch`)"""
+    return (request["system_prompt"], request["prompt"], request.get("max_tokens", 1024), request.get("temperature"),
+            request.get("tools"), request.get("tool_choice"), {})
+
+
+def _chat_request_body(model, system_prompt, prompt, max_tokens, temperature, tools, tool_choice, options):
+    body = {
+        "model": model,
+        "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
+    }
+    if max_tokens is not None:
+        body["max_tokens"] = max_tokens
+    if temperature is not None:
+        body["temperature"] = temperature
+    if tools:
+        body["tools"] = tools
+    if tool_choice is not None:
+        body["tool_choice"] = tool_choice
+    body.update(options)
+    return body
+
+
+def _openai_batch_file(model, requests):
+    """OpenAI Batch API input file: one chat completions request per line"""
+    lines = [{"custom_id": request["custom_id"], "method": "POST", "url": BATCH_ENDPOINT,
+              "body": _chat_request_body(model, *_request_args(request))} for request in requests]
+    return "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+
+
+# OpenAI batch states, by the states `batch.run_batch` understands
+_OPENAI_BATCH_STATES = {"validating": "in_progress", "in_progress": "in_progress", "finalizing": "in_progress",
+                        "completed": "completed", "failed": "failed", "expired": "expired",
+                        "cancelling": "cancelled", "cancelled": "cancelled"}
+
+
+def _openai_batch_job(batch):
+    """Job handle of an OpenAI batch object"""
+    return {"id": batch["id"], "status": _OPENAI_BATCH_STATES.get(batch["status"], "in_progress"),
+            "output_file_id": batch.get("output_file_id"), "error_file_id": batch.get("error_file_id"),
+            "request_counts": batch.get("request_counts"), "error": batch.get("errors")}
+
+
+def _openai_batch_results(content):
+    """Completions by custom_id from an OpenAI batch output or error file"""
+    results = {}
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        response = row.get("response") or {}
+        if response.get("status_code") == 200:
+            results[row["custom_id"]] = OpenAIBackend.parse_completion(response["body"])
+        else:
+            error = row.get("error") or (response.get("body") or {}).get("error") or {}
+            results[row["custom_id"]] = {"error": error.get("message") or f"HTTP {response.get('status_code')}"}
+    return results
+
+
+class BedrockBackend(Backend):
+    """
+    Anthropic models on AWS Bedrock.
+
+    Parameters:
+    - model (str): Bedrock model id.
+    - region (str, optional): Defaults to AWS_REGION or us-east-1.
+    - access_key, secret_key (str, optional): Default to the AWS_KEY and AWS_SECRET_KEY env vars.
+    - max_pool_connections (int, optional): botocore connection pool size.
+    - max_attempts (int, optional): botocore attempts per request; 1 surfaces throttling immediately.
+    """
+
+    name = "bedrock"
+
+    def __init__(self, model=None, region=None, access_key=None, secret_key=None, max_pool_connections=None,
+                 max_attempts=None):
+        super().__init__(model)
+        self.region = region or os.getenv("AWS_REGION", "us-east-1")
+        self.access_key = access_key or os.getenv("AWS_KEY")
+        self.secret_key = secret_key or os.getenv("AWS_SECRET_KEY")
+        self.max_pool_connections = max_pool_connections
+        self.max_attempts = max_attempts
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import boto3
+                from botocore.config import Config
+                if not self.access_key or not self.secret_key:
+                    raise ValueError("Missing AWS credentials. Please set AWS_KEY and AWS_SECRET_KEY as env vars.")
+                config = {}
+                if self.max_pool_connections:
+                    config["max_pool_connections"] = self.max_pool_connections
+                if self.max_attempts:
+                    config["retries"] = {"mode": "standard", "max_attempts": self.max_attempts}
+                self._client = boto3.client(
+                    service_name="bedrock-runtime",
+                    region_name=self.region,
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    config=Config(**config) if config else None,
+                )
+            return self._client
+
+    def check(self):
+        self.client
+
+    @staticmethod
+    def request_body(system_prompt, prompt, max_tokens, temperature, tools, tool_choice, options):
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "system": system_prompt,
+            "messages": [{"role": "user", "content": prompt}],
+        }
+        if temperature is not None:
+            body["temperature"] = temperature
+        if tools:
+            # OpenAI-style function tools map onto Anthropic tool definitions
+            body["tools"] = [{"name": t["function"]["name"], "description": t["function"].get("description", ""),
+                              "input_schema": t["function"]["parameters"]} for t in tools]
+            if tool_choice is not None:
+                body["tool_choice"] = {"type": "tool", "name": _tool_name(tools, tool_choice)}
+        body.update(options)
+        return body
+
+    def complete_sync(self, system_prompt, prompt, max_tokens=1024, temperature=None, tools=None, tool_choice=None,
+                      **options):
+        from botocore.exceptions import ClientError
+
+        body = self.request_body(system_prompt, prompt, max_tokens, temperature, tools, tool_choice, options)
+        try:
+            response = self.client.invoke_model(modelId=self.model, body=json.dumps(body))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in BEDROCK_THROTTLING_CODES:
+                raise Throttled() from e
+            raise
+
+        return self.parse_response(json.loads(response.get("body").read()))
+
+    @staticmethod
+    def parse_response(response_body):
+        """Completion dict of an Anthropic messages response"""
+        text = "".join(block.get("text", "") for block in response_body["content"] if block.get("type", "text") == "text")
+        result = {
+            "text": text,
+            "prompt_tokens": response_body.get("usage", {}).get("input_tokens", 0),
+            "completion_tokens": response_body.get("usage", {}).get("output_tokens", estimate_tokens(text)),
+        }
+        tool_calls = [{"name": block["name"], "arguments": json.dumps(block["input"])}
+                      for block in response_body["content"] if block.get("type") == "tool_use"]
+        cached_tokens = response_body.get("usage", {}).get("cache_read_input_tokens")
+        if cached_tokens:
+            result["cached_tokens"] = cached_tokens
+        if tool_calls:
+            result["tool_calls"] = tool_calls
+        return result
+
+    def _service_client(self, service_name):
+        import boto3
+        if not self.access_key or not self.secret_key:
+            raise ValueError("Missing AWS credentials. Please set AWS_KEY and AWS_SECRET_KEY as env vars.")
+        return boto3.client(service_name=service_name, region_name=self.region, aws_access_key_id=self.access_key,
+                            aws_secret_access_key=self.secret_key)
+
+    def submit_batch(self, requests):
+        """
+        Bedrock batch inference (`create_model_invocation_job`): the records are uploaded to
+        s3://$BEDROCK_BATCH_BUCKET/parallelprompt/<job name>/ and the job runs as the IAM role
+        $BEDROCK_BATCH_ROLE_ARN. Bedrock requires a minimum number of records per job (100 at the time of writing).
+        """
+        bucket = os.getenv("BEDROCK_BATCH_BUCKET")
+        role_arn = os.getenv("BEDROCK_BATCH_ROLE_ARN")
+        if not bucket or not role_arn:
+            raise ValueError("Bedrock batch jobs need the BEDROCK_BATCH_BUCKET and BEDROCK_BATCH_ROLE_ARN env vars.")
+        job_name = f"parallelprompt-{uuid.uuid4().hex[:16]}"
+        prefix = f"parallelprompt/{job_name}"
+        records = [{"recordId": request["custom_id"], "modelInput": self.request_body(*_request_args(request))}
+                   for request in requests]
+        self._service_client("s3").put_object(
+            Bucket=bucket, Key=f"{prefix}/input.jsonl",
+            Body="".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+        response = self._service_client("bedrock").create_model_invocation_job(
+            jobName=job_name, modelId=self.model, roleArn=role_arn,
+            inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{bucket}/{prefix}/input.jsonl"}},
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"s3://{bucket}/{prefix}/output/"}})
+        return {"id": response["jobArn"], "status": "submitted", "bucket": bucket, "prefix": prefix}
+
+    def batch_status(self, job):
+        response = self._service_client("bedrock").get_model_invocation_job(jobIdentifier=job["id"])
+        status = {"Completed": "completed", "PartiallyCompleted": "completed", "Failed": "failed",
+                  "Stopped": "cancelled", "Expired": "expired"}.get(response["status"], "in_progress")
+        return dict(job, status=status, error=response.get("message"))
+
+    def batch_results(self, job):
+        # Output lands in <output prefix>/<job id>/<input file name>.out
+        key = f"{job['prefix']}/output/{job['id'].rsplit('/', 1)[-1]}/input.jsonl.out"
+        body = self._service_client("s3").get_object(Bucket=job["bucket"], Key=key)["Body"].read()
+        results = {}
+        for line in body.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("modelOutput") is not None:
+                results[record["recordId"]] = self.parse_response(record["modelOutput"])
+            else:
+                error = record.get("error") or {}
+                results[record["recordId"]] = {"error": error.get("errorMessage") or str(error)}
+        return results
+
+    def stream_sync(self, system_prompt, prompt, max_tokens=1024, temperature=None, **options):
+        """Blocking `stream`: Anthropic message events from `invoke_model_with_response_stream`"""
+        from botocore.exceptions import ClientError
+
+        body = self.request_body(system_prompt, prompt, max_tokens, temperature, None, None, options)
+        usage = {}
+        text = []
+        try:
+            response = self.client.invoke_model_with_response_stream(modelId=self.model, body=json.dumps(body))
+            for event in response["body"]:
+                chunk = json.loads(event["chunk"]["bytes"])
+                if chunk["type"] == "message_start":
+                    usage.update(chunk["message"].get("usage", {}))
+                elif chunk["type"] == "content_block_delta" and chunk["delta"].get("type") == "text_delta":
+                    text.append(chunk["delta"]["text"])
+                    yield {"text": chunk["delta"]["text"]}
+                elif chunk["type"] == "message_delta":
+                    usage.update(chunk.get("usage", {}))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in BEDROCK_THROTTLING_CODES:
+                raise Throttled() from e
+            raise
+        yield _final_event({"prompt_tokens": usage.get("input_tokens", 0),
+                            "completion_tokens": usage.get("output_tokens", estimate_tokens("".join(text))),
+                            "cached_tokens": usage.get("cache_read_input_tokens")})
+
+    async def stream(self, system_prompt, prompt, max_tokens=1024, temperature=None, **options):
+        async for event in self._stream_from_thread(
+                self.stream_sync(system_prompt, prompt, max_tokens=max_tokens, temperature=temperature, **options)):
+            yield event
+
+
+class OpenAIBackend(Backend):
+    """
+    OpenAI-compatible chat completions over pooled httpx clients.
+
+    Parameters:
+    - model (str): Model name.
+    - base_url (str): API root, e.g. https://api.openai.com/v1 or a `MockServer` URL.
+    - api_key (str, optional): Defaults to OPENAI_API_KEY.
+    - max_connections (int): Connection pool size, shared by all requests.
+    - timeout (float): Per-request timeout in seconds.
+    - max_retries (int): Attempts per request; rate-limited requests honor Retry-After.
+    """
+
+    name = "openai"
+
+    def __init__(self, model=None, base_url=None, api_key=None, max_connections=100, timeout=120.0, max_retries=5):
+        super().__init__(model)
+        self.base_url = (base_url or os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._sync_http = None
+        self._async_http = None
+        self._lock = threading.Lock()
+
+    def _client_options(self):
+        import httpx
+        return {
+            "base_url": self.base_url,
+            "headers": {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {},
+            "timeout": self.timeout,
+            "limits": httpx.Limits(max_connections=self.max_connections,
+                                   max_keepalive_connections=self.max_connections),
+        }
+
+    def _sync_client(self):
+        import httpx
+        with self._lock:
+            if self._sync_http is None:
+                self._sync_http = httpx.Client(**self._client_options())
+            return self._sync_http
+
+    def _async_client(self):
+        import httpx
+        if self._async_http is None:
+            self._async_http = httpx.AsyncClient(**self._client_options())
+        return self._async_http
+
+    def request_body(self, system_prompt, prompt, max_tokens, temperature, tools, tool_choice, options):
+        return _chat_request_body(self.model, system_prompt, prompt, max_tokens, temperature, tools, tool_choice,
+                                  options)
+
+    @staticmethod
+    def parse_completion(completion):
+        message = completion["choices"][0]["message"]
+        text = message.get("content") or ""
+        usage = completion.get("usage") or {}
+        result = {
+            "text": text,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", estimate_tokens(text)),
+        }
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if cached_tokens:
+            result["cached_tokens"] = cached_tokens
+        if message.get("tool_calls"):
+            result["tool_calls"] = [{"name": call["function"]["name"], "arguments": call["function"]["arguments"]}
+                                    for call in message["tool_calls"]]
+        return result
+
+    @staticmethod
+    def _retry_after(response, retry):
+        try:
+            return float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return float(2 ** retry)
+
+    def complete_sync(self, system_prompt, prompt, max_tokens=1024, temperature=None, tools=None, tool_choice=None,
+                      **options):
+        body = self.request_body(system_prompt, prompt, max_tokens, temperature, tools, tool_choice, options)
+        for retry in range(self.max_retries):
+            try:
+                response = self._sync_client().post("/chat/completions", json=body)
+            except Exception:
+                if retry == self.max_retries - 1:
+                    raise
+                tracing.note_retry(2 ** retry)
+                time.sleep(2 ** retry)  # Exponential backoff
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                delay = self._retry_after(response, retry)
+                if retry == self.max_retries - 1:
+                    if response.status_code == 429:
+                        raise Throttled(retry_after=delay)
+                    raise BackendError(f"HTTP {response.status_code}: {response.text[:200]}")
+                tracing.note_retry(delay)
+                time.sleep(delay)
+                continue
+            if response.status_code >= 400:
+                raise BackendError(f"HTTP {response.status_code}: {response.text[:200]}")
+            return self.parse_completion(response.json())
+
+    async def complete(self, system_prompt, prompt, max_tokens=1024, temperature=None, tools=None, tool_choice=None,
+                       **options):
+        body = self.request_body(system_prompt, prompt, max_tokens, temperature, tools, tool_choice, options)
+        for retry in range(self.max_retries):
+            try:
+                response = await self._async_client().post("/chat/completions", json=body)
+            except Exception:
+                if retry == self.max_retries - 1:
+                    raise
+                tracing.note_retry(2 ** retry)
+                await asyncio.sleep(2 ** retry)  # Exponential backoff
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                delay = self._retry_after(response, retry)
+                if retry == self.max_retries - 1:
+                    if response.status_code == 429:
+                        raise Throttled(retry_after=delay)
+                    raise BackendError(f"HTTP {response.status_code}: {response.text[:200]}")
+                tracing.note_retry(delay)
+                await asyncio.sleep(delay)
+                continue
+            if response.status_code >= 400:
+                raise BackendError(f"HTTP {response.status_code}: {response.text[:200]}")
+            return self.parse_completion(response.json())
+
+    def _batch_request(self, method, path, **kwargs):
+        response = self._sync_client().request(method, path, **kwargs)
+        if response.status_code >= 400:
+            raise BackendError(f"HTTP {response.status_code}: {response.text[:200]}")
+        return response
+
+    def submit_batch(self, requests):
+        """OpenAI Batch API: the requests are uploaded as a file and processed within 24 hours"""
+        uploaded = self._batch_request("POST", "/files", data={"purpose": "batch"}, files={
+            "file": ("batch.jsonl", _openai_batch_file(self.model, requests), "application/jsonl")}).json()
+        batch = self._batch_request("POST", "/batches", json={
+            "input_file_id": uploaded["id"], "endpoint": BATCH_ENDPOINT, "completion_window": "24h"}).json()
+        return _openai_batch_job(batch)
+
+    def batch_status(self, job):
+        return _openai_batch_job(self._batch_request("GET", f"/batches/{job['id']}").json())
+
+    def batch_results(self, job):
+        results = {}
+        for key in ("output_file_id", "error_file_id"):
+            if job.get(key):
+                results.update(_openai_batch_results(self._batch_request("GET", f"/files/{job[key]}/content").text))
+        return results
+
+    async def stream(self, system_prompt, prompt, max_tokens=1024, temperature=None, **options):
+        body = self.request_body(system_prompt, prompt, max_tokens, temperature, None, None, options)
+        body.update(stream=True, stream_options={"include_usage": True})
+        for retry in range(self.max_retries):
+            started = False
+            try:
+                async with self._async_client().stream("POST", "/chat/completions", json=body) as response:
+                    if response.status_code == 429 or response.status_code >= 500:
+                        await response.aread()
+                        delay = self._retry_after(response, retry)
+                        if retry == self.max_retries - 1:
+                            if response.status_code == 429:
+                                raise Throttled(retry_after=delay)
+                            raise BackendError(f"HTTP {response.status_code}: {response.text[:200]}")
+                    elif response.status_code >= 400:
+                        await response.aread()
+                        raise BackendError(f"HTTP {response.status_code}: {response.text[:200]}")
+                    else:
+                        async for event in self._sse_events(response):
+                            started = True
+                            yield event
+                        return
+            except (Throttled, BackendError):
+                raise
+            except Exception:
+                # Text already delivered cannot be taken back, so only failures before it are retried
+                if started or retry == self.max_retries - 1:
+                    raise
+                delay = 2 ** retry  # Exponential backoff
+            tracing.note_retry(delay)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _sse_events(response):
+        """Text deltas and the final usage event from a server-sent `chat.completion.chunk` stream"""
+        usage = {}
+        text = []
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    text.append(delta)
+                    yield {"text": delta}
+        yield _final_event({"prompt_tokens": usage.get("prompt_tokens", 0),
+                            "completion_tokens": usage.get("completion_tokens", estimate_tokens("".join(text))),
+                            "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens")})
+
+    def close(self):
+        with self._lock:
+            if self._sync_http is not None:
+                self._sync_http.close()
+                self._sync_http = None
+        server = getattr(self, "server", None)
+        if server is not None:
+            server.stop()
+
+    async def aclose(self):
+        if self._async_http is not None:
+            await self._async_http.aclose()
+            self._async_http = None
+        self.close()
+
+
+_NUMBERED_ITEM = re.compile(r"^\[\d+\] ", re.MULTILINE)
+_STREAM_PIECE = re.compile(r"\s*\S+")
+_MOCK_WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet",
+               "kilo", "lima", "mike", "november", "oscar", "papa", "quebec", "romeo", "sierra", "tango")
+
+
+def _fill_schema(schema, rng, name="value"):
+    """Deterministic value conforming to a (simple) JSON schema, for mock tool calls"""
+    kind = schema.get("type", "string")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if kind == "object":
+        return {key: _fill_schema(sub, rng, key) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_fill_schema(schema.get("items", {}), rng, name) for _ in range(rng.randint(2, 5))]
+    if kind in ("integer", "number"):
+        return rng.randint(2, 10)
+    if kind == "boolean":
+        return True
+    return f"{name} " + " ".join(rng.choice(_MOCK_WORDS) for _ in range(rng.randint(2, 6)))
+
+
+class MockBackend(Backend):
+    """
+    Deterministic simulated model.
+
+    A response takes `prefill_per_token` per prompt token plus `ttft`, then
+    `per_token` per generated token, scaled by +/- `jitter` (a fraction). The
+    completion length is a stable function of the prompt within
+    `output_tokens`, capped by `max_tokens`. Requests beyond `rpm` in any
+    60-second window raise `Throttled`; `throttle_rate` and `error_rate` inject
+    throttles and `BackendError`s at random, and `tail_rate` makes a fraction
+    of requests stragglers whose latency is multiplied by a Pareto-distributed
+    factor. A prompt that lists numbered items
+    (lines starting `[1]`, `[2]`, ...) gets one numbered answer of that length
+    per item, as chunked sub-requests expect. With `prefix_cache_block` set, the
+    prompt is hashed in blocks of that many characters (each hash chained to the
+    previous block's) and the leading blocks seen before are served from cache:
+    they are reported as `cached_tokens` and skip the prefill cost, much like
+    KV-cache reuse in a local server. Blocks are cached as soon as a request is
+    admitted. Batch jobs are run by a `batch.LocalBatchStore` under `batch_dir`:
+    each stays in progress for `batch_delay` seconds, then every request is
+    answered at once (rate limits and injected failures still apply per request).
+
+    Parameters:
+    - model (str): Model name reported in responses.
+    - ttft (float): Seconds to the first token.
+    - per_token (float): Seconds per generated token.
+    - prefill_per_token (float): Seconds per prompt token.
+    - output_tokens (tuple): (min, max) generated tokens.
+    - jitter (float): Relative latency jitter.
+    - tail_rate (float): Probability a request is a straggler.
+    - tail_scale (float): Minimum slowdown of a straggler.
+    - tail_alpha (float): Pareto shape of the straggler slowdown; smaller is heavier-tailed.
+    - error_rate (float): Probability a request fails with BackendError.
+    - throttle_rate (float): Probability a request is throttled.
+    - rpm (int, optional): Requests per minute before throttling.
+    - responder (callable, optional): `responder(system_prompt, prompt)` returning the response text.
+    - seed (int): Seed for jitter and injected failures.
+    - time_scale (float): Multiplies every simulated delay (0 for instant responses).
+    - prefix_cache_block (int, optional): Characters per prefix-cache block (default: no prefix cache).
+    - prefix_cache_size (int): Blocks kept, least recently used evicted first.
+    - batch_dir (str, optional): Batch job storage; defaults to a directory under the system temp dir.
+    - batch_delay (float): Seconds a batch job stays in progress.
+    """
+
+    name = "mock"
+
+    def __init__(self, model=None, ttft=0.2, per_token=0.01, prefill_per_token=0.0, output_tokens=(50, 400),
+                 jitter=0.1, error_rate=0.0, throttle_rate=0.0, rpm=None, responder=None, seed=0, time_scale=1.0,
+                 prefix_cache_block=None, prefix_cache_size=100000, tail_rate=0.0, tail_scale=3.0, tail_alpha=1.5,
+                 batch_dir=None, batch_delay=0.0):
+        super().__init__(model)
+        self.ttft = ttft
+        self.per_token = per_token
+        self.prefill_per_token = prefill_per_token
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rpm = rpm
+        self.responder = responder
+        self.time_scale = time_scale
+        self.tail_rate = tail_rate
+        self.tail_scale = tail_scale
+        self.tail_alpha = tail_alpha
+        self.prefix_cache_block = prefix_cache_block
+        self.prefix_cache_size = prefix_cache_size
+        self.batch_dir = batch_dir or os.path.join(tempfile.gettempdir(), "parallelprompt-mock-batches")
+        self.batch_delay = batch_delay
+        self._batch_store = None
+
+        self.calls = 0
+        self.stragglers = 0
+        self.cached_tokens = 0
+        self._prefix_blocks = OrderedDict()
+        self.throttled = 0
+        self.errors = 0
+        self.inflight = 0
+        self.peak_inflight = 0
+        self._rng = random.Random(seed)
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prompt_rng(system_prompt, prompt):
+        digest = hashlib.sha256(f"{system_prompt}\x00{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _admit(self):
+        """Apply rate limits and injected failures; returns the latency jitter factor"""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            if self.rpm is not None:
+                while self._window and now - self._window[0] >= 60.0:
+                    self._window.popleft()
+                if len(self._window) >= self.rpm:
+                    self.throttled += 1
+                    raise Throttled(retry_after=60.0 - (now - self._window[0]))
+                self._window.append(now)
+            if self._rng.random() < self.throttle_rate:
+                self.throttled += 1
+                raise Throttled(retry_after=1.0)
+            if self._rng.random() < self.error_rate:
+                self.errors += 1
+                raise BackendError("Injected mock error")
+            factor = 1.0 + self._rng.uniform(-self.jitter, self.jitter)
+            if self._rng.random() < self.tail_rate:
+                # A straggler: heavy-tailed slowdown, drawn per call so a duplicate of it is usually fast
+                self.stragglers += 1
+                factor *= self.tail_scale * self._rng.paretovariate(self.tail_alpha)
+            return factor
+
+    def _cached_prefix(self, system_prompt, prompt):
+        """Characters at the start of the request already in the prefix cache; caches the rest"""
+        text = f"{system_prompt}\n{prompt}".encode("utf-8")
+        block = self.prefix_cache_block
+        digest = hashlib.sha256()
+        cached = 0
+        hit = True
+        with self._lock:
+            for start in range(0, len(text) - block + 1, block):
+                digest.update(text[start:start + block])
+                key = digest.digest()
+                if hit and key in self._prefix_blocks:
+                    self._prefix_blocks.move_to_end(key)
+                    cached += block
+                    continue
+                hit = False
+                self._prefix_blocks[key] = None
+                if len(self._prefix_blocks) > self.prefix_cache_size:
+                    self._prefix_blocks.popitem(last=False)
+        return cached
+
+    def plan(self, system_prompt, prompt, max_tokens=1024, tools=None, tool_choice=None):
+        """
+        Build a response and its simulated timing without sleeping.
+
+        Returns:
+        - tuple: (response dict, seconds to first token, seconds per generated token)
+        """
+        factor = self._admit()
+        rng = self._prompt_rng(system_prompt, prompt)
+        prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt)
+        low, high = self.output_tokens
+        response = {"prompt_tokens": prompt_tokens}
+        cached_tokens = 0
+        if self.prefix_cache_block:
+            cached_tokens = min(prompt_tokens, self._cached_prefix(system_prompt, prompt) // 4)
+            if cached_tokens:
+                response["cached_tokens"] = cached_tokens
+                with self._lock:
+                    self.cached_tokens += cached_tokens
+
+        if tools:
+            name = _tool_name(tools, tool_choice)
+            tool = next((t for t in tools if t["function"]["name"] == name), tools[0])
+            arguments = json.dumps(_fill_schema(tool["function"].get("parameters", {}), rng))
+            response.update(text="", tool_calls=[{"name": tool["function"]["name"], "arguments": arguments}],
+                            completion_tokens=estimate_tokens(arguments))
+        elif self.responder is not None:
+            text = self.responder(system_prompt, prompt)
+            response.update(text=text, completion_tokens=estimate_tokens(text))
+        else:
+            # A prompt listing numbered items ("[1] ...") gets one numbered answer per item
+            items = len(_NUMBERED_ITEM.findall(prompt))
+            words = []
+            for i in range(1, max(items, 1) + 1):
+                if items > 1:
+                    words.append(f"\n[{i}]")
+                words.extend(rng.choice(_MOCK_WORDS) for _ in range(rng.randint(low, high)))
+            if max_tokens is not None:
+                words = words[:max_tokens]
+            response.update(text=" ".join(words).strip(), completion_tokens=len(words))
+
+        ttft = (self.prefill_per_token * (prompt_tokens - cached_tokens) + self.ttft) * factor * self.time_scale
+        per_token = self.per_token * factor * self.time_scale
+        return response, ttft, per_token
+
+    def _enter(self):
+        with self._lock:
+            self.inflight += 1
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+
+    def _exit(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def complete_sync(self, system_prompt, prompt, max_tokens=1024, temperature=None, tools=None, tool_choice=None,
+                      **options):
+        response, ttft, per_token = self.plan(system_prompt, prompt, max_tokens, tools, tool_choice)
+        self._enter()
+        try:
+            time.sleep(ttft + per_token * response["completion_tokens"])
+        finally:
+            self._exit()
+        return response
+
+    async def complete(self, system_prompt, prompt, max_tokens=1024, temperature=None, tools=None, tool_choice=None,
+                       **options):
+        response, ttft, per_token = self.plan(system_prompt, prompt, max_tokens, tools, tool_choice)
+        self._enter()
+        try:
+            await asyncio.sleep(ttft + per_token * response["completion_tokens"])
+        finally:
+            self._exit()
+        return response
+
+    @staticmethod
+    def _pieces(response, per_token):
+        """Text pieces of a planned response (a word with its leading whitespace) and the decode delay of each"""
+        pieces = _STREAM_PIECE.findall(response["text"])
+        delay = per_token * response["completion_tokens"] / len(pieces) if pieces else 0.0
+        return pieces, delay
+
+    def stream_sync(self, system_prompt, prompt, max_tokens=1024, temperature=None, **options):
+        """Blocking `stream`, used by `MockServer`"""
+        response, ttft, per_token = self.plan(system_prompt, prompt, max_tokens)
+        pieces, delay = self._pieces(response, per_token)
+        self._enter()
+        try:
+            time.sleep(ttft)
+            for piece in pieces:
+                yield {"text": piece}
+                time.sleep(delay)
+        finally:
+            self._exit()
+        yield _final_event(response)
+
+    async def stream(self, system_prompt, prompt, max_tokens=1024, temperature=None, **options):
+        response, ttft, per_token = self.plan(system_prompt, prompt, max_tokens)
+        pieces, delay = self._pieces(response, per_token)
+        self._enter()
+        try:
+            await asyncio.sleep(ttft)
+            for piece in pieces:
+                yield {"text": piece}
+                await asyncio.sleep(delay)
+        finally:
+            self._exit()
+        yield _final_event(response)
+
+    @property
+    def batch_store(self):
+        """`batch.LocalBatchStore` running this backend's batch jobs, created on first use"""
+        with self._lock:
+            if self._batch_store is None:
+                self._batch_store = LocalBatchStore(self.batch_dir, self.answer, delay=self.batch_delay * self.time_scale)
+            return self._batch_store
+
+    def answer(self, request):
+        """Answer an OpenAI chat completions request body without the simulated delay; returns (status, body)"""
+        system_prompt, prompt = _chat_prompts(request)
+        try:
+            response, _, _ = self.plan(system_prompt, prompt, request.get("max_tokens"), request.get("tools"),
+                                       request.get("tool_choice"))
+        except (Throttled, BackendError) as e:
+            return _error_response(e)[:2]
+        return 200, _chat_completion(request.get("model", self.model), response)
+
+    def submit_batch(self, requests):
+        store = self.batch_store
+        uploaded = store.put_file(_openai_batch_file(self.model, requests))
+        return _openai_batch_job(store.create_batch(uploaded["id"]))
+
+    def batch_status(self, job):
+        return _openai_batch_job(self.batch_store.get_batch(job["id"]))
+
+    def batch_results(self, job):
+        results = {}
+        for key in ("output_file_id", "error_file_id"):
+            if job.get(key):
+                results.update(_openai_batch_results(self.batch_store.file_content(job[key]).decode("utf-8")))
+        return results
+
+    def stats(self):
+        return {"calls": self.calls, "throttled": self.throttled, "errors": self.errors,
+                "peak_inflight": self.peak_inflight, "cached_tokens": self.cached_tokens, "stragglers": self.stragglers}
+
+
+def _chat_prompts(request):
+    """System prompt and prompt of an OpenAI chat completions request body"""
+    messages = request.get("messages", [])
+    system_prompt = "\n".join(m["content"] for m in messages if m.get("role") == "system")
+    prompt = "\n".join(m["content"] for m in messages if m.get("role") != "system")
+    return system_prompt, prompt
+
+
+def _chat_completion(model, response):
+    """OpenAI `chat.completion` body of a mock response"""
+    message = {"role": "assistant", "content": response["text"] or None}
+    if response.get("tool_calls"):
+        message["tool_calls"] = [{"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+                                  "function": call} for call in response["tool_calls"]]
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": message,
+                     "finish_reason": "tool_calls" if response.get("tool_calls") else "stop"}],
+        "usage": {"prompt_tokens": response["prompt_tokens"],
+                  "completion_tokens": response["completion_tokens"],
+                  "total_tokens": response["prompt_tokens"] + response["completion_tokens"],
+                  "prompt_tokens_details": {"cached_tokens": response.get("cached_tokens", 0)}},
+    }
+
+
+def _error_response(e):
+    """(status, body, headers) of a mock failure"""
+    if isinstance(e, Throttled):
+        retry_after = e.retry_after or 1.0
+        return (429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}},
+                {"Retry-After": f"{retry_after:.3f}"})
+    return 500, {"error": {"message": str(e), "type": "server_error"}}, None
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, e):
+        self._send_json(*_error_response(e))
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _stream(self, request, system_prompt, prompt):
+        """Answer with server-sent `chat.completion.chunk` events, as the OpenAI API does for `stream: true`"""
+        events = self.server.backend.stream_sync(system_prompt, prompt, max_tokens=request.get("max_tokens"))
+        try:
+            # Rate limits and injected errors are decided before the first event
+            first = next(events)
+        except (Throttled, BackendError) as e:
+            self._send_error(e)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get("model", self.server.backend.model)
+        include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+
+        def send(choices, usage=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices}
+            if usage is not None:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for event in itertools.chain([first], events):
+            if not event.get("done"):
+                send([{"index": 0, "delta": {"content": event["text"]}, "finish_reason": None}])
+                continue
+            send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                send([], {"prompt_tokens": event["prompt_tokens"], "completion_tokens": event["completion_tokens"],
+                          "total_tokens": event["prompt_tokens"] + event["completion_tokens"],
+                          "prompt_tokens_details": {"cached_tokens": event.get("cached_tokens", 0)}})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _not_found(self):
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _upload_file(self):
+        """`POST /files`: a multipart upload, as the OpenAI Batch API expects"""
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + self._read_body())
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        if "file" not in fields:
+            self._send_json(400, {"error": {"message": "Missing file"}})
+            return
+        purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+        self._send_json(200, self.server.backend.batch_store.put_file(
+            fields["file"].get_payload(decode=True), purpose=purpose, filename=fields["file"].get_filename()))
+
+    def _create_batch(self):
+        request = json.loads(self._read_body() or b"{}")
+        if request.get("endpoint") != BATCH_ENDPOINT:
+            self._send_json(400, {"error": {"message": f"Unsupported endpoint {request.get('endpoint')}"}})
+            return
+        try:
+            batch = self.server.backend.batch_store.create_batch(request["input_file_id"], request["endpoint"],
+                                                                 request.get("completion_window", "24h"))
+        except KeyError:
+            self._send_json(404, {"error": {"message": f"No such file {request.get('input_file_id')}"}})
+            return
+        self._send_json(200, batch)
+
+    def do_GET(self):
+        """`GET /batches/{id}` and `GET /files/{id}/content`"""
+        parts = self.path.strip("/").split("/")
+        store = self.server.backend.batch_store
+        try:
+            if len(parts) >= 2 and parts[-2] == "batches":
+                self._send_json(200, store.get_batch(parts[-1]))
+            elif len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content":
+                content = store.file_content(parts[-2])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/jsonl")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+            else:
+                self._not_found()
+        except FileNotFoundError:
+            self._not_found()
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path.endswith("/files"):
+            self._upload_file()
+            return
+        if path.endswith("/batches"):
+            self._create_batch()
+            return
+        if not path.endswith("/chat/completions"):
+            self._not_found()
+            return
+        request = json.loads(self._read_body() or b"{}")
+        system_prompt, prompt = _chat_prompts(request)
+        if request.get("stream"):
+            self._stream(request, system_prompt, prompt)
+            return
+
+        try:
+            response = self.server.backend.complete_sync(
+                system_prompt, prompt, max_tokens=request.get("max_tokens"),
+                tools=request.get("tools"), tool_choice=request.get("tool_choice"))
+        except (Throttled, BackendError) as e:
+            self._send_error(e)
+            return
+        self._send_json(200, _chat_completion(request.get("model", self.server.backend.model), response))
+
+
+class MockServer:
+    """
+    OpenAI-compatible `/v1/chat/completions` endpoint backed by a `MockBackend`, served from a daemon thread.
+    The `/v1/files` and `/v1/batches` endpoints of the Batch API are served from the backend's `batch_store`.
+
+    Parameters:
+    - backend (MockBackend, optional): Simulation to serve; defaults to `MockBackend()`.
+    - host (str): Interface to bind.
+    - port (int): Port to bind; 0 picks a free one.
+    """
+
+    def __init__(self, backend=None, host="127.0.0.1", port=0):
+        self.backend = backend or MockBackend()
+        self._server = ThreadingHTTPServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.backend = self.backend
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self):
+        """Serve from the calling thread until interrupted"""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def create_backend(name, model=None, base_url=None, **options):
+    """
+    Instantiate a backend by name (one of BACKENDS).
+
+    `mock-http` starts a `MockServer` on localhost and returns an `OpenAIBackend`
+    pointed at it; closing the backend stops the server. Mock options are
+    passed to `MockBackend`, the rest to the backend itself. While tracing is on
+    (see `parallelprompt.tracing`), every call of the backend is traced.
+    """
+    if name == "bedrock":
+        backend = BedrockBackend(model=model, **options)
+    elif name == "openai":
+        backend = OpenAIBackend(model=model, base_url=base_url, **options)
+    elif name == "mock":
+        backend = MockBackend(model=model, **options)
+    elif name == "mock-http":
+        client_options = {key: options.pop(key) for key in ("max_connections", "timeout", "max_retries")
+                          if key in options}
+        server = MockServer(MockBackend(model=model, **options))
+        backend = OpenAIBackend(model=model or DEFAULT_MODELS["mock-http"], base_url=server.start(), **client_options)
+        backend.server = server
+    else:
+        raise ValueError(f"Unknown backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return tracing.traced(backend)
+
+
+def add_backend_arguments(parser, default="openai"):
+    """Add --backend, --model, --base-url and --mock-* options to an argparse parser"""
+    group = parser.add_argument_group("model backend")
+    group.add_argument("--backend", type=str, choices=BACKENDS, default=default,
+                       help="Model provider; mock and mock-http simulate one locally without credentials")
+    group.add_argument("--model", type=str, default=None, help="Model id (default depends on the backend)")
+    group.add_argument("--base-url", type=str, default=None, help="OpenAI-compatible API root for --backend openai")
+    group.add_argument("--mock-ttft", type=float, default=0.2, help="Mock: seconds to first token")
+    group.add_argument("--mock-per-token", type=float, default=0.01, help="Mock: seconds per generated token")
+    group.add_argument("--mock-prefill-per-token", type=float, default=0.0, help="Mock: seconds per uncached prompt token")
+    group.add_argument("--mock-prefix-cache", type=int, default=None, metavar="BLOCK",
+                       help="Mock: serve repeated prompt prefixes from cache, in blocks of BLOCK characters")
+    group.add_argument("--mock-output-tokens", type=int, nargs=2, default=(50, 400), metavar=("MIN", "MAX"),
+                       help="Mock: range of generated tokens")
+    group.add_argument("--mock-rpm", type=int, default=None, help="Mock: requests per minute before throttling")
+    group.add_argument("--mock-throttle-rate", type=float, default=0.0, help="Mock: random throttle probability")
+    group.add_argument("--mock-error-rate", type=float, default=0.0, help="Mock: random error probability")
+    group.add_argument("--mock-tail-rate", type=float, default=0.0,
+                       help="Mock: fraction of requests that are heavy-tailed stragglers")
+    group.add_argument("--mock-tail-alpha", type=float, default=1.5,
+                       help="Mock: Pareto shape of the straggler slowdown (smaller is heavier)")
+    group.add_argument("--mock-seed", type=int, default=0, help="Mock: seed for jitter and injected failures")
+    group.add_argument("--mock-batch-delay", type=float, default=0.0,
+                       help="Mock: seconds a batch job stays in progress before it is answered")
+    add_trace_arguments(group)
+    return group
+
+
+def add_trace_arguments(parser):
+    """Add --trace and --trace-format options (see `parallelprompt.tracing`)"""
+    parser.add_argument("--trace", type=str, default=None, metavar="FILE",
+                        help="Append a span per model call (queueing, retries, backoff, timings, tokens) to FILE")
+    parser.add_argument("--trace-format", type=str, choices=tracing.TRACE_FORMATS, default="jsonl",
+                        help="Flat JSON lines, or OTLP/JSON spans for OpenTelemetry tooling")
+
+
+def tracing_from_args(args):
+    """Enable tracing if --trace was given"""
+    if getattr(args, "trace", None):
+        tracing.configure(args.trace, args.trace_format)
+
+
+def backend_from_args(args, **options):
+    """Create the backend selected by `add_backend_arguments` options; extra keyword args go to the backend"""
+    tracing_from_args(args)
+    if args.backend in ("mock", "mock-http"):
+        options = dict(ttft=args.mock_ttft, per_token=args.mock_per_token,
+                       prefill_per_token=args.mock_prefill_per_token, prefix_cache_block=args.mock_prefix_cache,
+                       output_tokens=tuple(args.mock_output_tokens), rpm=args.mock_rpm,
+                       throttle_rate=args.mock_throttle_rate, error_rate=args.mock_error_rate,
+                       tail_rate=args.mock_tail_rate, tail_alpha=args.mock_tail_alpha, seed=args.mock_seed,
+                       batch_delay=args.mock_batch_delay, **options)
+    return create_backend(args.backend, model=args.model, base_url=args.base_url, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI-compatible chat completions endpoint.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_backend_arguments(parser, default="mock")
+    args = parser.parse_args()
+
+    backend = backend_from_args(argparse.Namespace(**dict(vars(args), backend="mock")))
+    server = MockServer(backend, host=args.host, port=args.port)
+    print(f"Mock endpoint listening on {server.base_url}/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
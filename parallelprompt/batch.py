@@ -0,0 +1,264 @@
+"""
+Offline batch inference for bulk curation, conversion and judging.
+
+Interactive calls are priced and rate-limited per request. Providers also
+accept a file of requests, process it within hours at a discount and
+outside the interactive limits. `run_batch` drives such a job through a
+backend (`submit_batch`, `batch_status`, `batch_results`, see `backends.py`):
+
+1. the requests, each with a stable `custom_id`, are written to
+   `<job_dir>/requests.jsonl`;
+2. the job is submitted and its handle saved to `<job_dir>/job.json`;
+3. the job is polled until it finishes;
+4. the results are saved to `<job_dir>/results.jsonl` and returned by id,
+   for the caller to join back into its usual outputs.
+
+An interrupted script that calls `run_batch` again with the same requests
+and `job_dir` resumes polling the job it already submitted (or reuses the
+saved results) instead of paying for a second job.
+
+`LocalBatchStore` is a file-based stand-in for a provider's batch service.
+The mock backend uses it, and `MockServer` serves it under the OpenAI
+`/files` and `/batches` endpoints, so the whole flow runs offline:
+
+    python data_curation/find_parallelprompts.py --dataset prompts.jsonl --mode batch-job --backend mock-http
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+# Job states reported by `batch_status`, whatever the provider calls them
+PENDING_STATES = ("submitted", "in_progress")
+FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchJobError(Exception):
+    """A batch job that failed, expired or was cancelled, or did not finish in time"""
+
+
+def custom_id(*parts):
+    """Stable request id from the values identifying a request, e.g. (stage, index, prompt)"""
+    digest = hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+    return f"req-{digest[:32]}"
+
+
+def write_jsonl(path, rows):
+    """Write rows to a JSONL file atomically (written to a temporary file, then renamed)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _write_json(path, payload):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _requests_digest(requests):
+    return hashlib.sha256(json.dumps(requests, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def run_batch(backend, requests, job_dir, poll_interval=60.0, timeout=None, log=print):
+    """
+    Run requests as one offline batch job and return the completions by id.
+
+    Parameters:
+    - backend: A `parallelprompt.backends` backend with batch support.
+    - requests (list): Dicts with a unique `custom_id`, `system_prompt` and `prompt`, and optionally
+      `max_tokens`, `temperature`, `tools` and `tool_choice`.
+    - job_dir (str): Directory holding the job file, handle and results; reused to resume.
+    - poll_interval (float): Seconds between status checks.
+    - timeout (float, optional): Seconds to wait for the job before raising `BatchJobError`;
+      the job keeps running and a later call resumes it.
+    - log (callable): Progress messages.
+
+    Returns:
+    - dict: custom_id -> completion (as returned by `complete`), or {"error": message} for
+      requests the provider failed. Requests missing from the job's output are absent.
+    """
+    if len({request["custom_id"] for request in requests}) != len(requests):
+        raise ValueError("custom_id values must be unique within a batch")
+    os.makedirs(job_dir, exist_ok=True)
+    requests_path = os.path.join(job_dir, "requests.jsonl")
+    job_path = os.path.join(job_dir, "job.json")
+    results_path = os.path.join(job_dir, "results.jsonl")
+    digest = _requests_digest(requests)
+
+    saved = None
+    if os.path.exists(job_path):
+        with open(job_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("digest") != digest or saved["job"].get("status") in ("failed", "expired", "cancelled"):
+            saved = None
+
+    if saved is not None and saved.get("results_saved") and os.path.exists(results_path):
+        log(f"Batch job {saved['job']['id']}: reusing saved results")
+        return {row.pop("custom_id"): row for row in read_jsonl(results_path)}
+
+    if saved is None:
+        write_jsonl(requests_path, requests)
+        job = backend.submit_batch(requests)
+        saved = {"digest": digest, "requests": len(requests), "submitted_at": time.time(), "job": job}
+        _write_json(job_path, saved)
+        log(f"Submitted batch job {job['id']} with {len(requests)} requests")
+    else:
+        job = saved["job"]
+        log(f"Resuming batch job {job['id']}")
+
+    start = time.monotonic()
+    while True:
+        job = backend.batch_status(job)
+        if job["status"] != saved["job"].get("status"):
+            saved["job"] = job
+            _write_json(job_path, saved)
+            log(f"Batch job {job['id']}: {job['status']}")
+        if job["status"] in FINAL_STATES:
+            break
+        if timeout is not None and time.monotonic() - start > timeout:
+            raise BatchJobError(f"Batch job {job['id']} still {job['status']} after {timeout}s; re-run to resume")
+        time.sleep(poll_interval)
+
+    if job["status"] != "completed":
+        raise BatchJobError(f"Batch job {job['id']} {job['status']}: {job.get('error')}")
+
+    results = backend.batch_results(job)
+    write_jsonl(results_path, [dict(completion, custom_id=request_id) for request_id, completion in results.items()])
+    saved["results_saved"] = True
+    _write_json(job_path, saved)
+    failed = sum("error" in completion for completion in results.values())
+    log(f"Batch job {job['id']}: {len(results) - failed} succeeded, {failed} failed, "
+        f"{len(requests) - len(results)} missing")
+    return results
+
+
+def add_batch_arguments(parser, default_dir):
+    """Add --batch-dir, --poll-interval and --batch-timeout options"""
+    parser.add_argument("--batch-dir", type=str, default=default_dir,
+                        help="Directory for offline batch job files, handles and results (reused to resume)")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between batch job status checks")
+    parser.add_argument("--batch-timeout", type=float, default=None,
+                        help="Give up waiting for a batch job after this many seconds (it can be resumed later)")
+
+
+class LocalBatchStore:
+    """
+    File-based stand-in for an OpenAI-style batch service.
+
+    Uploaded files and batch objects live under `root` (`files/`, `batches/`),
+    so a job submitted by one process can be polled by another. Batches are
+    processed on a background thread: every input line's `body` is answered
+    by `handler(body)`, returning `(status_code, response_body)`; responses
+    with status 200 go to the batch's output file, the rest to its error file.
+    A batch left in progress by a process that exited is picked up again the
+    next time it is polled.
+
+    Parameters:
+    - root (str): Storage directory.
+    - handler (callable): Answers one chat completions request body.
+    - delay (float): Seconds a batch stays in progress before it is processed.
+    """
+
+    def __init__(self, root, handler, delay=0.0):
+        self.root = root
+        self.handler = handler
+        self.delay = delay
+        os.makedirs(os.path.join(root, "files"), exist_ok=True)
+        os.makedirs(os.path.join(root, "batches"), exist_ok=True)
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    def _file_path(self, file_id):
+        return os.path.join(self.root, "files", f"{os.path.basename(file_id)}.jsonl")
+
+    def _batch_path(self, batch_id):
+        return os.path.join(self.root, "batches", f"{os.path.basename(batch_id)}.json")
+
+    def put_file(self, content, purpose="batch", filename="batch.jsonl"):
+        """Store an uploaded file; returns its file object"""
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with open(self._file_path(file_id), "wb") as f:
+            f.write(content)
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose}
+
+    def file_content(self, file_id):
+        with open(self._file_path(file_id), "rb") as f:
+            return f.read()
+
+    def create_batch(self, input_file_id, endpoint=BATCH_ENDPOINT, completion_window="24h"):
+        if not os.path.exists(self._file_path(input_file_id)):
+            raise KeyError(input_file_id)
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        _write_json(self._batch_path(batch["id"]), batch)
+        self._start(batch["id"])
+        return batch
+
+    def get_batch(self, batch_id):
+        with open(self._batch_path(batch_id), "r", encoding="utf-8") as f:
+            batch = json.load(f)
+        if batch["status"] in ("validating", "in_progress", "finalizing"):
+            self._start(batch_id)
+        return batch
+
+    def _start(self, batch_id):
+        with self._lock:
+            worker = self._workers.get(batch_id)
+            if worker is not None and worker.is_alive():
+                return
+            worker = threading.Thread(target=self._process, args=(batch_id,), name=f"batch-{batch_id}", daemon=True)
+            self._workers[batch_id] = worker
+            worker.start()
+
+    def _process(self, batch_id):
+        path = self._batch_path(batch_id)
+        with open(path, "r", encoding="utf-8") as f:
+            batch = json.load(f)
+        lines = [json.loads(line) for line in self.file_content(batch["input_file_id"]).splitlines() if line.strip()]
+        batch.update(status="in_progress", in_progress_at=int(time.time()))
+        batch["request_counts"]["total"] = len(lines)
+        _write_json(path, batch)
+        time.sleep(self.delay)
+
+        outputs, errors = [], []
+        for line in lines:
+            try:
+                status_code, body = self.handler(line["body"])
+            except Exception as e:
+                status_code, body = 500, {"error": {"message": str(e), "type": "server_error"}}
+            row = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": line["custom_id"],
+                   "response": {"status_code": status_code, "request_id": uuid.uuid4().hex, "body": body},
+                   "error": None}
+            (outputs if status_code == 200 else errors).append(row)
+
+        for key, rows in (("output_file_id", outputs), ("error_file_id", errors)):
+            if rows:
+                content = "".join(json.dumps(row) + "\n" for row in rows).encode("utf-8")
+                batch[key] = self.put_file(content, purpose="batch_output")["id"]
+        batch["request_counts"].update(completed=len(outputs), failed=len(errors))
+        batch.update(status="completed", completed_at=int(time.time()))
+        _write_json(path, batch)
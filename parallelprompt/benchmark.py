@@ -0,0 +1,402 @@
+"""
+Repeated serial vs. parallel measurements with bootstrap confidence intervals.
+
+The C++ drivers run every record once and report plain means, so a single
+slow response or a drift in provider load over the run moves the reported
+speedup, and two runs cannot be told apart from noise. This benchmark:
+
+- runs `warmup` unrecorded records first (connection pools, provider caches),
+- measures every record `repetitions` times, in a shuffled record order per
+  repetition, alternating whether the serial or the parallel side goes first
+  (so drift within a run affects both sides alike),
+- reports speedup and normalized speedup per category and per fan-out size n
+  (as totals over the group, like the C++ summary) with percentile bootstrap
+  confidence intervals, resampling records with all of their repetitions.
+
+`--n` re-runs generate_n records at each given n instead of their own, like
+`src/parallel_vary_n.cpp`. Results are written as JSON with every
+measurement, so runs can be compared later: `compare` bootstraps the
+difference in speedup between two result files per group and flags the
+groups whose interval excludes zero. Groups with fewer than `--min-records`
+records (e.g. per-n groups of a `--limit` run) get a point estimate only: a
+bootstrap over one or two records has no spread to speak of.
+
+Usage:
+    python -m parallelprompt.benchmark run datasets/lmsys_old/*.json --repetitions 5 --warmup 3 \\
+        --output bench_gpt4o.json
+    python -m parallelprompt.benchmark run datasets/lmsys_old/generate_n_lmsys.json --n 1 2 4 8 16 32 --limit 5 \\
+        --output bench_vary_n.json
+    python -m parallelprompt.benchmark compare bench_gpt4o.json bench_gpt4o_shared_prefix.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import random
+import time
+
+import numpy as np
+
+from parallelprompt.backends import add_backend_arguments, backend_from_args
+from parallelprompt.engine import ENGINE_MODEL, LAYOUTS, TASKS, ParallelEngine, fan_out_size, fill_template
+from parallelprompt.latency_model import load_dataset_records
+
+# Fewest records a group needs for a bootstrap interval (and a significance flag)
+MIN_RECORDS = 3
+
+
+def vary_n(records, values):
+    """generate_n records re-targeted at each n in `values` (n < 1 is skipped); other records unchanged"""
+    varied = []
+    for record in records:
+        if record.get("data") or record.get("n") is None:
+            varied.append(record)
+            continue
+        for n in values:
+            if n < 1:
+                continue
+            serial = fill_template(record["template"], {"n": str(n), "context": record.get("context") or ""})
+            varied.append(dict(record, n=n, serial=serial))
+    return varied
+
+
+async def measure_record(engine, record, serial_first):
+    """One serial and one parallel run of a record, in the given order"""
+    task = record["category"] if record["category"] in TASKS else None
+    if serial_first:
+        serial = await engine.run_serial(record, task)
+        completions, parallel_ms = await engine.run_parallel(record, task)
+    else:
+        completions, parallel_ms = await engine.run_parallel(record, task)
+        serial = await engine.run_serial(record, task)
+    return {
+        "serial_ms": serial["duration_ms"],
+        "parallel_ms": parallel_ms,
+        "serial_tokens": serial["completion_tokens"],
+        "parallel_tokens": sum(c["completion_tokens"] for c in completions),
+        "requests": len(completions),
+    }
+
+
+async def measure(engine, records, repetitions=5, warmup=2, seed=0, progress=None):
+    """
+    Measure every record `repetitions` times after `warmup` unrecorded runs.
+
+    Parameters:
+    - engine (ParallelEngine): Engine to run the records with.
+    - records (list): Dataset records tagged with `category`.
+    - repetitions (int): Measurements per record.
+    - warmup (int): Records run first and discarded (cycling through `records`).
+    - seed (int): Seed for the record order of each repetition.
+    - progress (callable, optional): Called with (done, total) after each measurement.
+
+    Returns:
+    - list: One dict per measurement with `record` (its index), `category`, `n`,
+      `repetition`, `order`, durations and token counts, or `error` if it failed.
+    """
+    for i in range(warmup if records else 0):
+        try:
+            await measure_record(engine, records[i % len(records)], serial_first=True)
+        except Exception:
+            pass
+
+    rng = random.Random(seed)
+    measurements = []
+    total = repetitions * len(records)
+    for repetition in range(repetitions):
+        order = list(range(len(records)))
+        rng.shuffle(order)
+        for index in order:
+            record = records[index]
+            # Alternate which side runs first, per record and per repetition
+            serial_first = (index + repetition) % 2 == 0
+            measurement = {
+                "record": index,
+                "category": record["category"],
+                "n": fan_out_size(record),
+                "repetition": repetition,
+                "order": "serial-first" if serial_first else "parallel-first",
+            }
+            try:
+                measurement.update(await measure_record(engine, record, serial_first))
+            except Exception as e:
+                measurement["error"] = f"{type(e).__name__}: {e}"
+            measurements.append(measurement)
+            if progress is not None:
+                progress(len(measurements), total)
+    return measurements
+
+
+def _record_totals(measurements):
+    """Per-record sums over the successful repetitions, as arrays of serial/parallel ms and tokens"""
+    totals = {}
+    for m in measurements:
+        if "error" in m:
+            continue
+        row = totals.setdefault(m["record"], np.zeros(4))
+        row += (m["serial_ms"], m["parallel_ms"], m["serial_tokens"], m["parallel_tokens"])
+    if not totals:
+        return np.zeros((0, 4))
+    return np.array(list(totals.values()))
+
+
+def _speedups(totals):
+    """Speedup and normalized speedup of groups of records; `totals` is (..., records, 4)"""
+    serial_ms, parallel_ms, serial_tokens, parallel_tokens = np.moveaxis(totals.sum(axis=-2), -1, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speedup = serial_ms / parallel_ms
+        normalized = (serial_ms / serial_tokens) / (parallel_ms / parallel_tokens)
+    return speedup, normalized
+
+
+def _interval(estimate, samples, confidence):
+    tail = (1 - confidence) / 2 * 100
+    if samples is None:
+        return {"estimate": float(estimate) if np.isfinite(estimate) else None, "low": None, "high": None}
+    samples = samples[np.isfinite(samples)]
+    if not np.isfinite(estimate) or not len(samples):
+        return {"estimate": None, "low": None, "high": None}
+    low, high = np.percentile(samples, [tail, 100 - tail])
+    return {"estimate": float(estimate), "low": float(low), "high": float(high)}
+
+
+def _resampled(totals, resamples, rng, min_records):
+    """Speedups of bootstrap resamples of the records, or (None, None) below `min_records` records"""
+    if len(totals) < min_records:
+        return None, None
+    return _speedups(totals[rng.integers(0, len(totals), size=(resamples, len(totals)))])
+
+
+def bootstrap(totals, resamples=2000, confidence=0.95, rng=None, min_records=MIN_RECORDS):
+    """
+    Speedup and normalized speedup of a group with percentile bootstrap intervals.
+
+    Parameters:
+    - totals (np.ndarray): Per-record sums, shape (records, 4), from `_record_totals`.
+    - resamples (int): Bootstrap resamples of the records.
+    - confidence (float): Interval coverage.
+    - min_records (int): Fewer records get the estimate without an interval.
+
+    Returns:
+    - dict: `speedup` and `normalized_speedup`, each {"estimate", "low", "high"}.
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    if not len(totals):
+        empty = {"estimate": None, "low": None, "high": None}
+        return {"speedup": empty, "normalized_speedup": empty}
+    speedup, normalized = _speedups(totals)
+    boot_speedup, boot_normalized = _resampled(totals, resamples, rng, min_records)
+    return {
+        "speedup": _interval(speedup, boot_speedup, confidence),
+        "normalized_speedup": _interval(normalized, boot_normalized, confidence),
+    }
+
+
+def groups_of(measurements):
+    """Measurements keyed by (category, n) and by (category, None) for the whole category"""
+    groups = {}
+    for m in measurements:
+        groups.setdefault((m["category"], None), []).append(m)
+        groups.setdefault((m["category"], m["n"]), []).append(m)
+    return groups
+
+
+def summarize(measurements, resamples=2000, confidence=0.95, seed=0, min_records=MIN_RECORDS):
+    """
+    Per-category and per-(category, n) results with bootstrap intervals.
+
+    Returns:
+    - list: Dicts with `category`, `n` (None for the whole category), `records`,
+      `measurements`, `failed`, mean serial and parallel ms, and the `speedup`
+      and `normalized_speedup` intervals.
+    """
+    rng = np.random.default_rng(seed)
+    summary = []
+    for (category, n), group in sorted(groups_of(measurements).items(),
+                                       key=lambda item: (item[0][0], item[0][1] is not None, item[0][1] or 0)):
+        ok = [m for m in group if "error" not in m]
+        totals = _record_totals(group)
+        row = {
+            "category": category,
+            "n": n,
+            "records": len(totals),
+            "measurements": len(ok),
+            "failed": len(group) - len(ok),
+            "mean_serial_ms": float(np.mean([m["serial_ms"] for m in ok])) if ok else None,
+            "mean_parallel_ms": float(np.mean([m["parallel_ms"] for m in ok])) if ok else None,
+        }
+        row.update(bootstrap(totals, resamples, confidence, rng, min_records))
+        summary.append(row)
+    return summary
+
+
+def compare(base, new, resamples=2000, confidence=0.95, seed=0, min_records=MIN_RECORDS):
+    """
+    Difference in speedup (new - base) per group shared by two result files.
+
+    Records are resampled independently in each run. A group is `significant`
+    when the interval of the difference excludes zero; groups with fewer than
+    `min_records` records in either run get no interval and are never significant.
+    """
+    rng = np.random.default_rng(seed)
+    base_groups, new_groups = groups_of(base["measurements"]), groups_of(new["measurements"])
+    rows = []
+    for key in sorted(set(base_groups) & set(new_groups), key=lambda k: (k[0], k[1] is not None, k[1] or 0)):
+        base_totals, new_totals = _record_totals(base_groups[key]), _record_totals(new_groups[key])
+        if not len(base_totals) or not len(new_totals):
+            continue
+        row = {"category": key[0], "n": key[1]}
+        base_point, new_point = _speedups(base_totals), _speedups(new_totals)
+        base_boot = _resampled(base_totals, resamples, rng, min_records)
+        new_boot = _resampled(new_totals, resamples, rng, min_records)
+        for name, i in (("speedup", 0), ("normalized_speedup", 1)):
+            samples = None if base_boot[i] is None or new_boot[i] is None else new_boot[i] - base_boot[i]
+            difference = _interval(new_point[i] - base_point[i], samples, confidence)
+            difference["base"] = float(base_point[i])
+            difference["new"] = float(new_point[i])
+            difference["significant"] = (difference["low"] is not None
+                                         and (difference["low"] > 0 or difference["high"] < 0))
+            row[name] = difference
+        rows.append(row)
+    return rows
+
+
+def _format_interval(interval):
+    if interval["estimate"] is None:
+        return f"{'-':>22}"
+    if interval["low"] is None:
+        return f"{interval['estimate']:>8.2f}x [too few]".rjust(22)
+    return f"{interval['estimate']:>8.2f}x [{interval['low']:.2f}, {interval['high']:.2f}]".rjust(22)
+
+
+def run(args):
+    paths = sorted({p for pattern in args.paths for p in (glob.glob(pattern) or [pattern])})
+    records = load_dataset_records(paths)
+    if args.limit:
+        by_category = {}
+        for record in records:
+            by_category.setdefault(record["category"], []).append(record)
+        records = [record for group in by_category.values() for record in group[:args.limit]]
+    if args.n:
+        records = vary_n(records, args.n)
+
+    if args.model is None and args.backend == "openai":
+        args.model = ENGINE_MODEL
+    options = {} if args.backend in ("mock", "bedrock") else {"max_connections": args.max_concurrency}
+    backend = backend_from_args(args, **options)
+    engine = ParallelEngine(backend, max_concurrency=args.max_concurrency,
+                            per_record_concurrency=args.per_record_concurrency, layout=args.layout,
+                            chunk_size=args.chunk_size)
+
+    def progress(done, total):
+        print(f"\rMeasured {done}/{total}", end="", flush=True)
+
+    async def measure_all():
+        try:
+            return await measure(engine, records, args.repetitions, args.warmup, args.seed, progress)
+        finally:
+            await backend.aclose()
+
+    print(f"Benchmarking {len(records)} records from {len(paths)} files, "
+          f"{args.repetitions} repetitions after {args.warmup} warmup runs")
+    start = time.perf_counter()
+    measurements = asyncio.run(measure_all())
+    print()
+    summary = summarize(measurements, args.resamples, args.confidence, args.seed, args.min_records)
+
+    level = f"{args.confidence:.0%} CI"
+    print(f"{'category':<24}{'n':>5}{'records':>9}{'failed':>8}{'speedup (' + level + ')':>24}"
+          f"{'normalized (' + level + ')':>27}")
+    for row in summary:
+        n = "all" if row["n"] is None else row["n"]
+        print(f"{row['category']:<24}{n:>5}{row['records']:>9}{row['failed']:>8}"
+              f"{_format_interval(row['speedup']):>24}{_format_interval(row['normalized_speedup']):>27}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "paths": paths,
+                    "backend": args.backend,
+                    "model": backend.model,
+                    "layout": args.layout,
+                    "chunk_size": args.chunk_size,
+                    "n": args.n,
+                    "repetitions": args.repetitions,
+                    "warmup": args.warmup,
+                    "seed": args.seed,
+                    "confidence": args.confidence,
+                    "resamples": args.resamples,
+                    "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "wall_time_s": time.perf_counter() - start,
+                },
+                "summary": summary,
+                "measurements": measurements,
+            }, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+def run_compare(args):
+    with open(args.base, "r") as f:
+        base = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+    rows = compare(base, new, args.resamples, args.confidence, args.seed, args.min_records)
+
+    print(f"{'category':<24}{'n':>5}{'base':>9}{'new':>9}{'difference (' + format(args.confidence, '.0%') + ' CI)':>30}")
+    for row in rows:
+        n = "all" if row["n"] is None else row["n"]
+        speedup = row["speedup"]
+        if speedup["estimate"] is None:
+            continue
+        flag = " *" if speedup["significant"] else ""
+        interval = "[too few records]" if speedup["low"] is None else f"[{speedup['low']:+.2f}, {speedup['high']:+.2f}]"
+        print(f"{row['category']:<24}{n:>5}{speedup['base']:>8.2f}x{speedup['new']:>8.2f}x"
+              f"{speedup['estimate']:>+12.2f}x {interval}{flag}")
+    print(f"* interval excludes zero (groups with at least {args.min_records} records in both runs)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"base": args.base, "new": args.new, "confidence": args.confidence, "groups": rows}, f, indent=2)
+        print(f"Comparison saved to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serial vs. parallel execution with confidence intervals.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Measure datasets and write the results")
+    run_parser.add_argument("paths", nargs="+", help="Dataset JSON/JSONL files or globs, e.g. datasets/lmsys_old/*.json")
+    run_parser.add_argument("--repetitions", type=int, default=5, help="Measurements per record")
+    run_parser.add_argument("--warmup", type=int, default=2, help="Unrecorded record runs before measuring")
+    run_parser.add_argument("--n", type=int, nargs="+", default=None,
+                            help="Run generate_n records at each of these n instead of their own")
+    run_parser.add_argument("--limit", type=int, default=None, help="Only use the first N records of each category")
+    run_parser.add_argument("--max-concurrency", type=int, default=64, help="Requests in flight")
+    run_parser.add_argument("--per-record-concurrency", type=int, default=None, help="Sub-requests in flight per record")
+    run_parser.add_argument("--layout", type=str, choices=LAYOUTS, default="inline")
+    run_parser.add_argument("--chunk-size", type=int, default=1, help="Items per sub-request")
+    run_parser.add_argument("--output", type=str, default=None, help="Write the summary and all measurements as JSON")
+    add_backend_arguments(run_parser, default="openai")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument("base", type=str, help="Baseline results JSON")
+    compare_parser.add_argument("new", type=str, help="Results JSON to compare against the baseline")
+    compare_parser.add_argument("--output", type=str, default=None, help="Write the comparison as JSON")
+
+    for command in (run_parser, compare_parser):
+        command.add_argument("--confidence", type=float, default=0.95, help="Confidence interval coverage")
+        command.add_argument("--resamples", type=int, default=2000, help="Bootstrap resamples")
+        command.add_argument("--seed", type=int, default=0, help="Seed for record order and resampling")
+        command.add_argument("--min-records", type=int, default=MIN_RECORDS,
+                             help="Fewest records a group needs for a confidence interval")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        run_compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Persistent, content-addressed cache for model responses.
+
+Keys are a SHA-256 over everything that determines a response: the prompt
+with whitespace normalized, the system prompt, the model id, the sampling
+temperature and any extra request parameters (e.g. tool schemas). Exact and
+whitespace-only duplicate prompts therefore share one entry, and re-runs or
+overlapping datasets are served from disk instead of the API.
+
+Entries live in a single SQLite file and are evicted least-recently-used once
+the stored payload exceeds `max_bytes`.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """Collapse whitespace runs so whitespace-only variants hash identically"""
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+
+def make_key(prompt, system_prompt, model_id, temperature, extra=None):
+    """
+    Build the cache key for a model request.
+
+    Parameters:
+    - prompt (str): User prompt; normalized before hashing.
+    - system_prompt (str): System prompt sent with the request.
+    - model_id (str): Provider model identifier.
+    - temperature (float): Sampling temperature.
+    - extra (optional): Any other JSON-serializable request parameters that affect the output.
+
+    Returns:
+    - str: Hex digest identifying the request.
+    """
+    payload = json.dumps(
+        [normalize_prompt(prompt), system_prompt, model_id, temperature, extra],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with size-based LRU eviction.
+
+    Parameters:
+    - path (str): SQLite database file; created if missing.
+    - max_bytes (int): Payload size above which least-recently-used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        """Return the cached value for `key`, or None on a miss"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        """Store a JSON-serializable value under `key`"""
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode("utf-8"))
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, encoded, size, time.time()),
+            )
+            self._bytes += size - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Trim to 90% of the budget so we do not evict on every insert at the limit
+        target = self.max_bytes * 0.9
+        self._db.execute("BEGIN")
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY last_access")
+        evicted = []
+        for key, size in rows:
+            if self._bytes <= target:
+                break
+            evicted.append((key,))
+            self._bytes -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._db.execute("COMMIT")
+
+    def get_or_call(self, key, call):
+        """Return the cached value for `key`, calling `call()` and caching its result on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = call()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": self._bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,189 @@
+"""
+Fan-out granularity: how many data items each sub-request answers.
+
+By default every item of a record's `data` (or each of its `n` answers) is
+its own sub-request. For records with dozens of items that means dozens of
+small calls, whose per-request overhead and rate-limit cost can outweigh
+the parallelism. With `ParallelEngine(chunk_size=k)` consecutive items are
+grouped k to a sub-request, which asks for numbered answers that are split
+back into per-item outputs.
+
+This module picks k per record from the latency model (`auto_chunk_size`)
+and sweeps a dataset over several values of k, reporting latency, tokens,
+request count and split failures for each. It only runs the decomposed
+side of each record; the serial prompt does not depend on k.
+
+Usage:
+    python -m parallelprompt.chunking --queries datasets/lmsys_old/keyword_extraction_lmsys.json \\
+        --task keyword_extraction --chunk-sizes 1 2 4 8 auto --backend mock --output chunk_sweep.json
+"""
+import argparse
+import asyncio
+import json
+
+import numpy as np
+
+from parallelprompt.backends import add_backend_arguments, backend_from_args
+from parallelprompt.engine import ENGINE_MODEL, LAYOUTS, TASKS, ParallelEngine, item_outputs
+from parallelprompt.latency_model import (DEFAULT_CHUNK_SIZES, PROFILES, CostModel, best_chunk_sizes,
+                                          load_dataset_records, predict_chunked, record_features)
+
+
+def auto_chunk_size(records, cost_model, candidates=DEFAULT_CHUNK_SIZES, max_parallelism=None, request_cost=0.0,
+                    output_tokens_per_item=None):
+    """
+    Per-record chunk sizes chosen by the latency model.
+
+    Parameters:
+    - records (list): Dataset records, tagged with `category` (see `latency_model.load_dataset_records`).
+    - cost_model (CostModel): Backend costs.
+    - candidates (tuple): Chunk sizes to choose from.
+    - max_parallelism (int, optional): Sub-requests in flight per record.
+    - request_cost (float): Seconds charged per request on top of the predicted latency.
+    - output_tokens_per_item (dict, optional): Category -> generated tokens per item.
+
+    Returns:
+    - callable: `chunk_size(record)` for `ParallelEngine`, defined for the given records.
+    """
+    sizes, _ = best_chunk_sizes(record_features(records), cost_model, candidates, max_parallelism,
+                                output_tokens_per_item, request_cost)
+    by_record = {id(record): int(size) for record, size in zip(records, sizes)}
+    return lambda record: by_record[id(record)]
+
+
+async def sweep_record(engine, record, task):
+    """Run one record's decomposed side; returns its measurements"""
+    completions, parallel_ms = await engine.run_parallel(record, task)
+    outputs, split_failures = item_outputs(completions)
+    return {
+        "prompt": record.get("original"),
+        "chunk_size": engine.record_chunk_size(record),
+        "items": len(outputs),
+        "requests": len(completions),
+        "parallel_duration_ms": parallel_ms,
+        "prompt_tokens": sum(c["prompt_tokens"] for c in completions),
+        "completion_tokens": sum(c["completion_tokens"] for c in completions),
+        "split_failures": split_failures,
+    }
+
+
+def summarize(runs, predicted_s=None):
+    """Sweep summary for one chunk size"""
+    durations = np.array([run["parallel_duration_ms"] for run in runs], dtype=np.float64)
+    summary = {
+        "records": len(runs),
+        "requests": sum(run["requests"] for run in runs),
+        "mean_requests": float(np.mean([run["requests"] for run in runs])) if runs else 0.0,
+        "mean_parallel_ms": float(durations.mean()) if runs else 0.0,
+        "median_parallel_ms": float(np.median(durations)) if runs else 0.0,
+        "p90_parallel_ms": float(np.percentile(durations, 90)) if runs else 0.0,
+        "prompt_tokens": sum(run["prompt_tokens"] for run in runs),
+        "completion_tokens": sum(run["completion_tokens"] for run in runs),
+        "split_failures": sum(run["split_failures"] for run in runs),
+    }
+    if predicted_s is not None:
+        summary["predicted_mean_parallel_ms"] = float(np.mean(predicted_s) * 1000) if runs else 0.0
+    return summary
+
+
+async def sweep(records, task, backend, chunk_sizes, cost_model, max_concurrency=64, per_record_concurrency=None,
+                record_concurrency=1, layout="inline", request_cost=0.0, output_tokens_per_item=None):
+    """
+    Run the decomposed side of every record once per chunk size.
+
+    Parameters:
+    - chunk_sizes (list): Ints, or "auto" for the latency model's per-record choice.
+    - cost_model (CostModel): Costs used for "auto" and for the predicted latencies.
+    - output_tokens_per_item (dict, optional): Category -> generated tokens per item, for the predictions.
+
+    Returns:
+    - dict: Chunk size (as a string) -> {"summary": ..., "records": [...]}.
+    """
+    features = record_features(records)
+    results = {}
+    for chunk_size in chunk_sizes:
+        if chunk_size == "auto":
+            policy = auto_chunk_size(records, cost_model, max_parallelism=per_record_concurrency,
+                                     request_cost=request_cost, output_tokens_per_item=output_tokens_per_item)
+            sizes = np.array([policy(record) for record in records])
+        else:
+            policy = sizes = int(chunk_size)
+        predicted = predict_chunked(features, cost_model, sizes, per_record_concurrency,
+                                    output_tokens_per_item)["parallel_s"]
+
+        engine = ParallelEngine(backend, max_concurrency=max_concurrency, per_record_concurrency=per_record_concurrency,
+                                layout=layout, chunk_size=policy)
+        limit = asyncio.Semaphore(record_concurrency)
+
+        async def run(record):
+            async with limit:
+                return await sweep_record(engine, record, task)
+
+        runs = await asyncio.gather(*(run(record) for record in records))
+        results[str(chunk_size)] = {"summary": summarize(runs, predicted), "records": runs}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the number of data items per sub-request.")
+    parser.add_argument("--queries", type=str, required=True, help="Dataset JSON file")
+    parser.add_argument("--task", type=str, choices=TASKS, required=True)
+    parser.add_argument("--chunk-sizes", nargs="+", default=["1", "2", "4", "8", "auto"],
+                        help="Items per sub-request to try; 'auto' picks one per record from the latency model")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Requests in flight across all records")
+    parser.add_argument("--per-record-concurrency", type=int, default=None, help="Sub-requests in flight per record")
+    parser.add_argument("--record-concurrency", type=int, default=1, help="Records run at once")
+    parser.add_argument("--layout", type=str, choices=LAYOUTS, default="inline")
+    parser.add_argument("--request-cost", type=float, default=0.0,
+                        help="Seconds charged per request when choosing 'auto' chunk sizes")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N records")
+    parser.add_argument("--output", type=str, default=None, help="Write the sweep as JSON")
+    add_backend_arguments(parser, default="openai")
+    args = parser.parse_args()
+    if args.model is None and args.backend == "openai":
+        args.model = ENGINE_MODEL
+    for chunk_size in args.chunk_sizes:
+        if chunk_size != "auto" and not (chunk_size.isdigit() and int(chunk_size) > 0):
+            parser.error(f"--chunk-sizes: expected positive integers or 'auto', got '{chunk_size}'")
+
+    records = load_dataset_records([args.queries])
+    records = records[:args.limit] if args.limit else records
+    profile = dict(PROFILES[args.backend])
+    output_tokens_per_item = None
+    if args.backend in ("mock", "mock-http"):
+        profile.update(overhead=args.mock_ttft, decode_per_token=args.mock_per_token,
+                       prefill_per_token=args.mock_prefill_per_token)
+        # The mock answers every item with MIN..MAX tokens whatever the category
+        output_tokens_per_item = {records[0]["category"]: sum(args.mock_output_tokens) / 2} if records else None
+    cost_model = CostModel(**profile)
+
+    options = {} if args.backend in ("mock", "bedrock") else {"max_connections": args.max_concurrency}
+    backend = backend_from_args(args, **options)
+
+    async def run():
+        try:
+            return await sweep(records, args.task, backend, args.chunk_sizes, cost_model,
+                               max_concurrency=args.max_concurrency,
+                               per_record_concurrency=args.per_record_concurrency,
+                               record_concurrency=args.record_concurrency, layout=args.layout,
+                               request_cost=args.request_cost, output_tokens_per_item=output_tokens_per_item)
+        finally:
+            await backend.aclose()
+
+    results = asyncio.run(run())
+    print(f"{'k':>6}{'requests':>10}{'mean ms':>10}{'p90 ms':>10}{'predicted':>11}{'prompt tok':>12}"
+          f"{'output tok':>12}{'split fail':>12}")
+    for chunk_size, result in results.items():
+        summary = result["summary"]
+        print(f"{chunk_size:>6}{summary['requests']:>10}{summary['mean_parallel_ms']:>10.0f}"
+              f"{summary['p90_parallel_ms']:>10.0f}{summary['predicted_mean_parallel_ms']:>11.0f}"
+              f"{summary['prompt_tokens']:>12}{summary['completion_tokens']:>12}{summary['split_failures']:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"task": args.task, "cost_model": cost_model.as_dict(), "chunk_sizes": results}, f, indent=2)
+        print(f"Sweep saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,697 @@
+"""
+Asyncio engine that runs ParallelPrompt records serially and decomposed.
+
+A dataset record (see `datasets/*/*.json`) holds the original `serial` prompt
+and a decomposition: a `template` with `{context}`, `{data}` and `{n}`
+placeholders, the shared `context`, and either a `data` list (one
+sub-request per item) or a count `n` (n sub-requests). `expand_record` turns
+a record into its sub-requests using the same system prompts as
+`src/serial_vs_parallel.cpp`. `ParallelEngine` sends them concurrently through
+one shared backend (see `backends.py`; the OpenAI backend pools its HTTP
+connections), capped both per record and across all records, and
+reports serial and parallel outputs, token counts and timings in the same
+JSON layout as the C++ driver.
+
+With `layout="shared-prefix"` the sub-requests of a record are restructured
+so that everything they have in common comes first and is byte-identical: a
+`{context}` that the template places after `{data}` is hoisted to the front
+of the prompt (and referred to in its original position), and the generate_n
+letter hint moves from the system prompt to the end of the user prompt.
+Providers with prompt caching, and local servers with KV-cache reuse, can then
+prefill the shared part once per record. Each result entry reports the
+shared-prefix ratio and the estimated prompt tokens that need not be
+prefilled again, alongside the cached tokens the backend actually reported.
+
+With `stream=True` every request is streamed (`backend.stream`). The
+sub-responses are merged into one answer in data order as they arrive:
+text of the first unfinished item is passed on immediately, later items are
+buffered until the items before them finish (`OrderedMerger`). Entries then
+also report time to first and last token of the serial answer and of the
+merged parallel answer. Streamed requests bypass the scheduler and hedger.
+
+Usage:
+    python -m parallelprompt.engine --queries datasets/synthetic/keyword_extraction_synthetic.json \\
+        --task keyword_extraction --output keyword_extraction_results.json
+    python -m parallelprompt.engine --queries datasets/lmsys_old/generate_n_lmsys.json \
+        --task generate_n --output generate_n_mock.json --backend mock-http
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import string
+import sys
+import time
+
+from parallelprompt import tracing
+from parallelprompt.backends import add_backend_arguments, backend_from_args, estimate_tokens
+from parallelprompt.scheduler import Scheduler, scheduled_backend_options
+
+TASKS = ("reading_comprehension", "keyword_extraction", "generate_n")
+LAYOUTS = ("inline", "shared-prefix")
+
+SERIAL_SYSTEM_PROMPTS = {
+    "keyword_extraction": "You are a helpful assistant specializing in keyword extraction. Do not include any irrelevant information",
+    "reading_comprehension": "You are a helpful assistant specializing in reading comprehension. Provide concise and accurate answers based on the given context",
+}
+PARALLEL_SYSTEM_PROMPTS = {
+    "keyword_extraction": "You are a helpful assistant specializing in keyword extraction. Only extract values for the given keyword and do not include any irrelevant information",
+    "reading_comprehension": "You are a helpful assistant specializing in reading comprehension. Provide extremely concise and accurate answers based on the given context",
+}
+DEFAULT_SERIAL_SYSTEM_PROMPT = "You are a helpful assistant."
+DEFAULT_PARALLEL_SYSTEM_PROMPT = "You are a helpful assistant. Provide accurate and relevant information based on the given task"
+# Each generate_n sub-request is steered towards a different answer by its first letter
+GENERATE_N_BASE_SYSTEM_PROMPT = ("You are a helpful assistant.  Provide concise and accurate answers based on the given context "
+                                 "and do not include irrelevant information.")
+GENERATE_N_LETTER_HINT = "Try to make your response start with the letter {letter}"
+GENERATE_N_SYSTEM_PROMPT = f"{GENERATE_N_BASE_SYSTEM_PROMPT} {GENERATE_N_LETTER_HINT}"
+
+# Shared-prefix layout: the hoisted context, then the per-item instruction
+CONTEXT_PREFIX = "Text:\n{context}\n\n"
+CONTEXT_REFERENCE = "(see the text above)"
+
+# Chunked sub-requests list their items as "[1] ...", "[2] ..." and the answers reuse the markers
+CHUNK_INSTRUCTION = ("Answer each of the following {count} items separately. Start each answer on a new line "
+                     "with the item's number in square brackets, e.g. [1], and answer nothing else.")
+
+# Model and sampling temperature used by the C++ drivers
+ENGINE_MODEL = "gpt-4-0125-preview"
+ENGINE_TEMPERATURE = 0.7
+
+SERIAL_MAX_TOKENS = 4000
+PARALLEL_MAX_TOKENS = 1000
+
+_PLACEHOLDER = re.compile(r"\{(context|data|n)\}")
+_CHUNK_MARKER = re.compile(r"^\s*\[(\d+)\][ \t]*", re.MULTILINE)
+
+
+def fill_template(template, values):
+    """Substitute `{context}`, `{data}` and `{n}` in one pass, so substituted text is never re-scanned"""
+    return _PLACEHOLDER.sub(lambda m: values[m.group(1)] if m.group(1) in values else m.group(0), template)
+
+
+def fan_out_size(record):
+    """Number of sub-requests a record decomposes into"""
+    if record.get("data"):
+        return len(record["data"])
+    if record.get("n") is not None:
+        return int(record["n"])
+    return 0
+
+
+def shared_prefix_template(template):
+    """
+    Rewrite a template so the context leads it.
+
+    Templates that already start with everything but the item (e.g.
+    `"{context}\\n\\n{data}"`) are returned unchanged. Otherwise every
+    `{context}` is replaced by CONTEXT_REFERENCE and the context is prepended
+    once as CONTEXT_PREFIX.
+    """
+    first_item = min((m.start() for m in _PLACEHOLDER.finditer(template) if m.group(1) != "context"), default=None)
+    if first_item is None or "{context}" not in template[first_item:]:
+        return template
+    return CONTEXT_PREFIX + template.replace("{context}", CONTEXT_REFERENCE)
+
+
+def chunk_instruction(labels):
+    """Instruction appended to a chunked sub-request: one numbered answer per label"""
+    lines = "\n".join(f"[{i}] {label}" for i, label in enumerate(labels, 1))
+    return CHUNK_INSTRUCTION.format(count=len(labels)) + "\n" + lines
+
+
+def split_chunk_output(text, count):
+    """
+    Split a chunked response into per-item answers by their `[i]` markers.
+
+    Returns:
+    - tuple: (list of `count` answers, number of items whose marker was missing).
+      A missing answer is an empty string; if no marker is found at all, the
+      whole text is kept as the first answer.
+    """
+    answers = {}
+    markers = list(_CHUNK_MARKER.finditer(text))
+    for marker, following in zip(markers, markers[1:] + [None]):
+        number = int(marker.group(1))
+        if 1 <= number <= count and number not in answers:
+            answers[number] = text[marker.end():following.start() if following else len(text)].strip()
+    if not answers:
+        return [text.strip()] + [""] * (count - 1), count - 1 if text.strip() else count
+    return [answers.get(i, "") for i in range(1, count + 1)], count - len(answers)
+
+
+def expand_record(record, task=None, layout="inline", chunk_size=1):
+    """
+    Expand a record into its serial request and parallel sub-requests.
+
+    Parameters:
+    - record (dict): Dataset record with `serial`, `template` and `context`, plus `data` or `n`.
+    - task (str, optional): One of TASKS; selects the system prompts.
+    - layout (str): One of LAYOUTS. "inline" reproduces the C++ driver's prompts;
+      "shared-prefix" puts the part shared by all sub-requests first.
+    - chunk_size (int): Items per sub-request. Consecutive `data` items (or
+      generate_n answers) are grouped, and the sub-request asks for one
+      numbered answer per item (see `split_chunk_output`).
+
+    Returns:
+    - tuple: (serial request, list of sub-requests), each a dict with
+      `system_prompt`, `prompt` and `max_tokens`; sub-requests also carry
+      `items`, the positions of the items they answer.
+    """
+    serial = {
+        "system_prompt": SERIAL_SYSTEM_PROMPTS.get(task, DEFAULT_SERIAL_SYSTEM_PROMPT),
+        "prompt": record["serial"],
+        "max_tokens": SERIAL_MAX_TOKENS,
+    }
+
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}'")
+    shared_prefix = layout == "shared-prefix"
+
+    values = {}
+    template = record["template"]
+    if record.get("context"):
+        values["context"] = str(record["context"])
+        if shared_prefix:
+            template = shared_prefix_template(template)
+
+    size = fan_out_size(record)
+    chunk_size = max(1, int(chunk_size))
+    sub_requests = []
+    for start in range(0, size, chunk_size):
+        items = list(range(start, min(start + chunk_size, size)))
+        max_tokens = min(PARALLEL_MAX_TOKENS * len(items), SERIAL_MAX_TOKENS)
+        if not record.get("data"):
+            letters = [string.ascii_uppercase[i % 26] for i in items]
+            prompt = fill_template(template, dict(values, n=str(len(items))))
+            if len(items) > 1:
+                system_prompt = GENERATE_N_BASE_SYSTEM_PROMPT
+                hints = [GENERATE_N_LETTER_HINT.format(letter=letter) for letter in letters]
+                prompt = f"{prompt}\n\n{chunk_instruction(hints)}"
+            elif shared_prefix:
+                # Only the trailing hint differs between sub-requests
+                system_prompt = GENERATE_N_BASE_SYSTEM_PROMPT
+                prompt = f"{prompt}\n\n{GENERATE_N_LETTER_HINT.format(letter=letters[0])}"
+            else:
+                system_prompt = GENERATE_N_SYSTEM_PROMPT.format(letter=letters[0])
+        else:
+            system_prompt = PARALLEL_SYSTEM_PROMPTS.get(task, DEFAULT_PARALLEL_SYSTEM_PROMPT)
+            chunk = [str(record["data"][i]) for i in items]
+            prompt = fill_template(template, dict(values, data="; ".join(chunk)))
+            if len(items) > 1:
+                prompt = f"{prompt}\n\n{chunk_instruction(chunk)}"
+        sub_requests.append({"system_prompt": system_prompt, "prompt": prompt, "max_tokens": max_tokens,
+                             "items": items})
+    return serial, sub_requests
+
+
+def prefix_stats(sub_requests, min_cached_tokens=0):
+    """
+    Measure how much of a record's sub-requests is a common leading prefix.
+
+    Requests are compared as the system prompt followed by the user prompt,
+    the order in which providers hash them for prompt caching.
+
+    Parameters:
+    - sub_requests (list): Sub-requests from `expand_record`.
+    - min_cached_tokens (int): Shortest prefix the provider caches; shorter prefixes save nothing.
+
+    Returns:
+    - dict: `shared_prefix_tokens`, `shared_prefix_ratio` (shared prefix over the
+      mean request length) and `prefill_tokens_saved` (shared prefix tokens
+      for every sub-request after the first).
+    """
+    texts = [f"{request['system_prompt']}\n{request['prompt']}" for request in sub_requests]
+    if len(texts) < 2:
+        return {"shared_prefix_tokens": 0, "shared_prefix_ratio": 0.0, "prefill_tokens_saved": 0}
+    prefix = os.path.commonprefix(texts)
+    mean_length = sum(map(len, texts)) / len(texts)
+    prefix_tokens = estimate_tokens(prefix)
+    saved = prefix_tokens * (len(texts) - 1) if prefix_tokens >= max(min_cached_tokens, 1) else 0
+    return {
+        "shared_prefix_tokens": prefix_tokens,
+        "shared_prefix_ratio": len(prefix) / mean_length if mean_length else 0.0,
+        "prefill_tokens_saved": saved,
+    }
+
+
+class OrderedMerger:
+    """
+    Merges sub-response text that arrives concurrently into one answer in data order.
+
+    Text of the first unfinished sub-response goes to `emit` as it arrives;
+    text of later ones is buffered until every sub-response before them has
+    finished. Sub-responses are joined with `separator`, like the C++ driver's
+    `"\\n\\n".join(...)`.
+
+    Parameters:
+    - count (int): Number of sub-responses.
+    - emit (callable, optional): Called with each piece of merged text.
+    - separator (str): Text between consecutive sub-responses.
+    """
+
+    def __init__(self, count, emit=None, separator="\n\n"):
+        self.count = count
+        self.separator = separator
+        self.current = 0
+        self.start = time.perf_counter()
+        self.first_emit = None
+        self.last_emit = None
+        self._emit_text = emit
+        self._pieces = []
+        self._buffers = [[] for _ in range(count)]
+        self._done = [False] * count
+
+    @property
+    def text(self):
+        return "".join(self._pieces)
+
+    def feed(self, index, text):
+        if index == self.current:
+            self._emit(text)
+        else:
+            self._buffers[index].append(text)
+
+    def finish(self, index):
+        self._done[index] = True
+        while self.current < self.count and self._done[self.current]:
+            self.current += 1
+            if self.current < self.count:
+                self._emit(self.separator)
+                self._emit("".join(self._buffers[self.current]))
+                self._buffers[self.current] = []
+
+    def _emit(self, text):
+        if not text:
+            return
+        now = time.perf_counter()
+        if self.first_emit is None and text.strip():
+            self.first_emit = now
+        self.last_emit = now
+        self._pieces.append(text)
+        if self._emit_text is not None:
+            self._emit_text(text)
+
+    def ttft_ms(self):
+        return ((self.first_emit or time.perf_counter()) - self.start) * 1000
+
+    def ttlt_ms(self):
+        return ((self.last_emit or time.perf_counter()) - self.start) * 1000
+
+
+class ParallelEngine:
+    """
+    Runs records serially and decomposed, sharing one backend and one global concurrency limit.
+
+    Parameters:
+    - backend: A `parallelprompt.backends` backend (anything with `async complete(...)`).
+    - max_concurrency (int): Requests in flight across all records.
+    - per_record_concurrency (int, optional): Sub-requests in flight per record (default: unbounded).
+    - temperature (float): Sampling temperature for every request.
+    - layout (str): Sub-request layout, one of LAYOUTS (see `expand_record`).
+    - min_cached_tokens (int): Shortest prefix the provider caches, for the prefill savings estimate.
+    - chunk_size (int or callable): Items per sub-request, or `chunk_size(record)` returning it.
+    - scheduler (Scheduler, optional): Shared `parallelprompt.scheduler.Scheduler` that admits every
+      request under its rate limits and backoff, oldest record first; it then also caps concurrency.
+    - hedger (Hedger, optional): `parallelprompt.hedging.Hedger` that duplicates slow sub-requests.
+    - stream (bool): Stream every request and merge the sub-responses incrementally.
+    - on_text (callable, optional): With `stream`, called with each piece of a record's merged parallel answer.
+    """
+
+    def __init__(self, backend, max_concurrency=64, per_record_concurrency=None, temperature=ENGINE_TEMPERATURE,
+                 layout="inline", min_cached_tokens=0, chunk_size=1, scheduler=None, hedger=None, stream=False,
+                 on_text=None):
+        self.backend = backend
+        self.stream = stream
+        self.on_text = on_text
+        self.scheduler = scheduler
+        self.hedger = hedger
+        self.per_record_concurrency = per_record_concurrency
+        self.temperature = temperature
+        self.layout = layout
+        self.min_cached_tokens = min_cached_tokens
+        self.chunk_size = chunk_size
+        self._global = asyncio.Semaphore(max_concurrency)
+
+    async def _call(self, request, record_limit=None, priority=0):
+        with tracing.queued():
+            # Hold the per-record slot first so one wide record cannot starve the global pool
+            if record_limit is None:
+                return await self._admitted(request, priority)
+            async with record_limit:
+                return await self._admitted(request, priority)
+
+    async def _admitted(self, request, priority):
+        if self.scheduler is not None:
+            return await self._timed(request, priority)
+        async with self._global:
+            return await self._timed(request)
+
+    async def _send(self, request, priority=0):
+        if self.scheduler is not None:
+            return await self.scheduler.complete(request["system_prompt"], request["prompt"],
+                                                 max_tokens=request["max_tokens"], temperature=self.temperature,
+                                                 priority=priority)
+        return await self.backend.complete(request["system_prompt"], request["prompt"],
+                                           max_tokens=request["max_tokens"], temperature=self.temperature)
+
+    async def _timed(self, request, priority=0):
+        start = time.perf_counter()
+        if self.hedger is not None and "items" in request:
+            # Only fan-out sub-requests are hedged; the serial request is the baseline
+            prompt_tokens = estimate_tokens(request["system_prompt"]) + estimate_tokens(request["prompt"])
+            completion = await self.hedger.run(lambda: self._send(request, priority), prompt_tokens)
+        else:
+            completion = await self._send(request, priority)
+        completion["duration_ms"] = (time.perf_counter() - start) * 1000
+        if "items" in request:
+            completion["items"] = request["items"]
+        return completion
+
+    def record_chunk_size(self, record):
+        return self.chunk_size(record) if callable(self.chunk_size) else self.chunk_size
+
+    def expand(self, record, task=None):
+        return expand_record(record, task, self.layout, self.record_chunk_size(record))
+
+    async def run_serial(self, record, task=None, priority=0):
+        serial, _ = expand_record(record, task)
+        with tracing.span("serial"):
+            return await self._call(serial, priority=priority)
+
+    async def run_parallel(self, record, task=None, priority=0):
+        """Fan out a record's sub-requests; returns (completions in data order, wall time in ms)"""
+        _, sub_requests = self.expand(record, task)
+        record_limit = asyncio.Semaphore(self.per_record_concurrency) if self.per_record_concurrency else None
+        with tracing.span("parallel", requests=len(sub_requests)):
+            start = time.perf_counter()
+            completions = await asyncio.gather(*(self._call(request, record_limit, priority)
+                                                 for request in sub_requests))
+        return completions, (time.perf_counter() - start) * 1000
+
+    async def _stream_call(self, request, on_text, record_limit=None):
+        with tracing.queued():
+            if record_limit is None:
+                async with self._global:
+                    return await self._streamed(request, on_text)
+            async with record_limit:
+                async with self._global:
+                    return await self._streamed(request, on_text)
+
+    async def _streamed(self, request, on_text):
+        start = time.perf_counter()
+        first_token = None
+        text = []
+        final = {}
+        async for event in self.backend.stream(request["system_prompt"], request["prompt"],
+                                               max_tokens=request["max_tokens"], temperature=self.temperature):
+            if event.get("done"):
+                final = event
+                continue
+            if first_token is None and event["text"].strip():
+                first_token = time.perf_counter()
+            text.append(event["text"])
+            on_text(event["text"])
+        end = time.perf_counter()
+        completion = {
+            "text": "".join(text),
+            "prompt_tokens": final.get("prompt_tokens", 0),
+            "completion_tokens": final.get("completion_tokens", 0),
+            "duration_ms": (end - start) * 1000,
+            "ttft_ms": ((first_token or end) - start) * 1000,
+        }
+        if final.get("cached_tokens"):
+            completion["cached_tokens"] = final["cached_tokens"]
+        if "items" in request:
+            completion["items"] = request["items"]
+        return completion
+
+    async def stream_serial(self, record, task=None):
+        """Stream the serial request; the completion gains `ttft_ms` (its `duration_ms` is the time to last token)"""
+        serial, _ = expand_record(record, task)
+        with tracing.span("serial"):
+            return await self._stream_call(serial, lambda text: None)
+
+    async def stream_parallel(self, record, task=None):
+        """
+        Stream a record's sub-requests concurrently, merging them in data order.
+
+        Returns:
+        - tuple: (completions in data order, wall time in ms, the `OrderedMerger`
+          with the merged text and its first and last emit times)
+        """
+        _, sub_requests = self.expand(record, task)
+        record_limit = asyncio.Semaphore(self.per_record_concurrency) if self.per_record_concurrency else None
+        merger = OrderedMerger(len(sub_requests), self.on_text)
+
+        async def run(index, request):
+            completion = await self._stream_call(request, lambda text: merger.feed(index, text), record_limit)
+            merger.finish(index)
+            return completion
+
+        with tracing.span("parallel", requests=len(sub_requests)):
+            merger.start = start = time.perf_counter()
+            completions = await asyncio.gather(*(run(index, request) for index, request in enumerate(sub_requests)))
+        return completions, (time.perf_counter() - start) * 1000, merger
+
+    async def run_record(self, record, task=None, priority=0):
+        """Serial then parallel execution of one record, as a C++-compatible result entry"""
+        if self.stream:
+            serial = await self.stream_serial(record, task)
+            completions, parallel_ms, merger = await self.stream_parallel(record, task)
+        else:
+            serial = await self.run_serial(record, task, priority)
+            completions, parallel_ms = await self.run_parallel(record, task, priority)
+        _, sub_requests = self.expand(record, task)
+        prefix = prefix_stats(sub_requests, self.min_cached_tokens)
+        entry = result_entry(record, serial, completions, parallel_ms, prefix, task)
+        entry["chunk_size"] = self.record_chunk_size(record)
+        if self.stream:
+            entry["serial_ttft_ms"] = round(serial["ttft_ms"])
+            entry["serial_ttlt_ms"] = round(serial["duration_ms"])
+            entry["parallel_ttft_ms"] = round(merger.ttft_ms())
+            entry["parallel_ttlt_ms"] = round(merger.ttlt_ms())
+        return entry
+
+    async def run_dataset(self, records, task=None, record_concurrency=1):
+        """
+        Run every record; records are measured one at a time unless `record_concurrency` > 1.
+
+        With a scheduler, a record's position is its priority, so earlier
+        records' requests are admitted first and stragglers finish before
+        later records take the rate budget.
+
+        Returns:
+        - list: Result entries in input order.
+        """
+        limit = asyncio.Semaphore(record_concurrency)
+
+        async def run(index, record):
+            async with limit:
+                with tracing.span("record", index=index, task=task):
+                    return await self.run_record(record, task, priority=index)
+
+        return await asyncio.gather(*(run(index, record) for index, record in enumerate(records)))
+
+
+def item_outputs(completions):
+    """
+    Per-item answers of a record in data order, splitting chunked completions.
+
+    Returns:
+    - tuple: (list of answers, number of items that could not be split out)
+    """
+    outputs, failures = [], 0
+    for completion in completions:
+        items = completion.get("items")
+        if items is None or len(items) == 1:
+            outputs.append(completion["text"])
+            continue
+        answers, missing = split_chunk_output(completion["text"], len(items))
+        outputs.extend(answers)
+        failures += missing
+    return outputs, failures
+
+
+def result_entry(record, serial, completions, parallel_ms, prefix=None, task=None):
+    serial_ms = serial["duration_ms"]
+    parallel_output, split_failures = item_outputs(completions)
+    parallel_tokens = [c["completion_tokens"] for c in completions]
+    total_parallel_tokens = sum(parallel_tokens)
+    entry = {
+        "prompt": record.get("original"),
+        # Lets the judge break results down by task (see evaluation/openai_eval)
+        "category": record.get("category") or task,
+        "serial_output": serial["text"],
+        "serial_num_tokens": serial["completion_tokens"],
+        "parallel_output": parallel_output,
+        "parallel_num_tokens": parallel_tokens,
+        "total_parallel_tokens": total_parallel_tokens,
+        "serial_duration_ms": round(serial_ms),
+        "parallel_duration_ms": [round(c["duration_ms"]) for c in completions],
+        "total_parallel_duration_ms": round(parallel_ms),
+        "speedup": serial_ms / parallel_ms if parallel_ms else None,
+        "normalized_speedup": None,
+        # Token counts and durations are per request; a chunked request answers several items
+        "num_requests": len(completions),
+        "parallel_prompt_tokens": sum(c["prompt_tokens"] for c in completions),
+        "split_failures": split_failures,
+    }
+    # Latency per generated token, serial over parallel
+    if serial["completion_tokens"] and total_parallel_tokens and parallel_ms:
+        entry["normalized_speedup"] = (serial_ms / serial["completion_tokens"]) / (parallel_ms / total_parallel_tokens)
+    if prefix is not None:
+        entry["shared_prefix_ratio"] = prefix["shared_prefix_ratio"]
+        entry["prefill_tokens_saved"] = prefix["prefill_tokens_saved"]
+        entry["cached_prompt_tokens"] = sum(c.get("cached_tokens", 0) for c in completions)
+    return entry
+
+
+def averages(entries):
+    """Dataset-level averages, matching the C++ driver's summary"""
+    count = len(entries)
+    total_serial_ms = sum(e["serial_duration_ms"] for e in entries)
+    total_parallel_ms = sum(e["total_parallel_duration_ms"] for e in entries)
+    total_serial_tokens = sum(e["serial_num_tokens"] for e in entries)
+    total_parallel_tokens = sum(e["total_parallel_tokens"] for e in entries)
+    summary = {
+        "avg_serial_duration": total_serial_ms / count if count else 0,
+        "avg_parallel_duration": total_parallel_ms / count if count else 0,
+        "avg_serial_tokens": total_serial_tokens / count if count else 0,
+        "avg_parallel_tokens": total_parallel_tokens / count if count else 0,
+        "speedup": total_serial_ms / total_parallel_ms if total_parallel_ms else None,
+        "normalized_speedup": None,
+    }
+    if total_serial_tokens and total_parallel_tokens and total_parallel_ms:
+        summary["normalized_speedup"] = ((total_serial_ms / total_serial_tokens) /
+                                         (total_parallel_ms / total_parallel_tokens))
+    if count and all("shared_prefix_ratio" in e for e in entries):
+        summary["avg_shared_prefix_ratio"] = sum(e["shared_prefix_ratio"] for e in entries) / count
+        summary["prefill_tokens_saved"] = sum(e["prefill_tokens_saved"] for e in entries)
+        summary["cached_prompt_tokens"] = sum(e["cached_prompt_tokens"] for e in entries)
+    if count and all("parallel_ttft_ms" in e for e in entries):
+        for key in ("serial_ttft_ms", "serial_ttlt_ms", "parallel_ttft_ms", "parallel_ttlt_ms"):
+            summary[f"avg_{key}"] = sum(e[key] for e in entries) / count
+    return summary
+
+
+def load_records(path, limit=None, category=None):
+    """Records of a dataset JSON file, or of a `parallelprompt.store` file (only those of `category` if given)"""
+    if path.endswith(".ppstore"):
+        from itertools import islice
+        from parallelprompt.store import DatasetStore
+        with DatasetStore(path) as store:
+            return list(islice(store.filter(category=category), limit or None))
+    with open(path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    return records[:limit] if limit else records
+
+
+async def run_file(queries, task, output, backend, max_concurrency=64, per_record_concurrency=None,
+                   record_concurrency=1, limit=None, layout="inline", min_cached_tokens=0, chunk_size=1,
+                   rpm=None, tpm=None, hedger=None, stream=False, on_text=None):
+    records = load_records(queries, limit, category=task)
+    scheduler = Scheduler(backend, rpm=rpm, tpm=tpm, max_concurrency=max_concurrency) if rpm or tpm else None
+    engine = ParallelEngine(backend, max_concurrency=max_concurrency, per_record_concurrency=per_record_concurrency,
+                            layout=layout, min_cached_tokens=min_cached_tokens, chunk_size=chunk_size,
+                            scheduler=scheduler, hedger=hedger, stream=stream, on_text=on_text)
+    start = time.perf_counter()
+    try:
+        entries = await engine.run_dataset(records, task, record_concurrency=record_concurrency)
+    finally:
+        await backend.aclose()
+
+    summary = averages(entries)
+    summary["wall_time_s"] = time.perf_counter() - start
+    if scheduler is not None:
+        summary["scheduler"] = scheduler.stats()
+    if hedger is not None:
+        summary["hedging"] = hedger.stats()
+    with open(output, "w", encoding="utf-8") as f:
+        # Same layout as the C++ driver: entries followed by ["averages", {...}]
+        json.dump(entries + [["averages", summary]], f, indent=2, ensure_ascii=False)
+    return entries, summary
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run ParallelPrompt records serially and in parallel.")
+    parser.add_argument("--queries", type=str, required=True, help="Dataset JSON file, e.g. datasets/synthetic/keyword_extraction_synthetic.json, or a "
+                        "store built with parallelprompt.store (its --task records are used)")
+    parser.add_argument("--task", type=str, choices=TASKS, required=True)
+    parser.add_argument("--output", type=str, required=True, help="Where to write the results JSON")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Requests in flight across all records")
+    parser.add_argument("--per-record-concurrency", type=int, default=None, help="Sub-requests in flight per record")
+    parser.add_argument("--record-concurrency", type=int, default=1,
+                        help="Records measured at once (1 keeps per-record timings undisturbed)")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N records")
+    parser.add_argument("--layout", type=str, choices=LAYOUTS, default="inline",
+                        help="Sub-request layout; shared-prefix puts the shared context first for prompt caching")
+    parser.add_argument("--min-cached-tokens", type=int, default=0,
+                        help="Shortest prefix the provider caches (e.g. 1024 for OpenAI), for the savings estimate")
+    parser.add_argument("--chunk-size", type=int, default=1,
+                        help="Items per sub-request (see parallelprompt.chunking to sweep or pick it per record)")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="Requests per minute; with --rpm or --tpm all records share one scheduler and backoff")
+    parser.add_argument("--tpm", type=float, default=None, help="Prompt plus completion tokens per minute")
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="Duplicate sub-requests still running past this latency percentile (default: off)")
+    parser.add_argument("--hedge-budget", type=float, default=0.05, help="Extra hedged requests per sub-request")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream all requests, merge sub-responses in data order and report time to first/last token")
+    parser.add_argument("--echo", action="store_true", help="With --stream, print the merged parallel answers as they arrive")
+    add_backend_arguments(parser, default="openai")
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.stream and (args.rpm or args.tpm or args.hedge_percentile is not None):
+        parser.error("--stream cannot be combined with --rpm, --tpm or --hedge-percentile")
+    if args.model is None and args.backend == "openai":
+        args.model = ENGINE_MODEL
+    options = {} if args.backend in ("mock", "bedrock") else {"max_connections": args.max_concurrency}
+    if args.rpm or args.tpm:
+        options.update(scheduled_backend_options(args.backend))
+    backend = backend_from_args(args, **options)
+    hedger = None
+    if args.hedge_percentile is not None:
+        # Imported here: parallelprompt.hedging builds on this module
+        from parallelprompt.hedging import HedgePolicy, Hedger
+        hedger = Hedger(HedgePolicy(args.hedge_percentile, args.hedge_budget))
+
+    def echo(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    print(f"Queries: {args.queries}")
+    print(f"Task: {args.task}")
+    print(f"Output location : {args.output}")
+    _, summary = asyncio.run(run_file(args.queries, args.task, args.output, backend,
+                                      max_concurrency=args.max_concurrency,
+                                      per_record_concurrency=args.per_record_concurrency,
+                                      record_concurrency=args.record_concurrency, limit=args.limit,
+                                      layout=args.layout, min_cached_tokens=args.min_cached_tokens,
+                                      chunk_size=args.chunk_size, rpm=args.rpm, tpm=args.tpm, hedger=hedger,
+                                      stream=args.stream, on_text=echo if args.echo else None))
+    print(f"Results saved to {args.output}")
+    print(f"Average Speedup: {summary['speedup']}x")
+    print(f"Average Normalized speedup: {summary['normalized_speedup']}x")
+    if "avg_shared_prefix_ratio" in summary:
+        print(f"Average shared prefix: {summary['avg_shared_prefix_ratio']:.1%}, "
+              f"estimated prefill tokens saved: {summary['prefill_tokens_saved']} "
+              f"(backend reported {summary['cached_prompt_tokens']} cached)")
+    if "avg_parallel_ttft_ms" in summary:
+        print(f"Time to first token: serial {summary['avg_serial_ttft_ms']:.0f}ms, "
+              f"parallel {summary['avg_parallel_ttft_ms']:.0f}ms; time to last token: serial "
+              f"{summary['avg_serial_ttlt_ms']:.0f}ms, parallel {summary['avg_parallel_ttlt_ms']:.0f}ms")
+    print(f"Wall time: {summary['wall_time_s']:.1f}s")
+    if "scheduler" in summary:
+        print(f"Scheduler: {summary['scheduler']}")
+    if "hedging" in summary:
+        print(f"Hedging: {summary['hedging']}")
+
+
+if __name__ == "__main__":
+    main()
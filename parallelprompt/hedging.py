@@ -0,0 +1,245 @@
+"""
+Hedged requests for the parallel fan-out.
+
+A decomposed record finishes when its slowest sub-request does, so past
+about ten sub-requests a single straggler sets the record's latency. With
+hedging, a sub-request still running after the `percentile`-th percentile of
+recently observed sub-request latencies gets a duplicate. Whichever
+completes first is used and the other is cancelled.
+
+Duplicates cost extra requests and tokens, so a `HedgePolicy` caps them. At
+most `budget` extra requests per primary request are sent (e.g. 0.05 for 5%),
+and optionally at most `token_budget` estimated extra prompt tokens in total.
+No hedges are sent until `min_samples` latencies have been observed.
+
+`python -m parallelprompt.hedging` measures p50/p99 record latency of the
+decomposed side of a dataset without hedging and under each policy, usually
+against the mock backend with heavy-tailed latency (`--mock-tail-rate`).
+
+Usage:
+    python -m parallelprompt.hedging --queries datasets/lmsys_old/keyword_extraction_lmsys.json \\
+        --task keyword_extraction --backend mock --mock-tail-rate 0.05 --percentiles 90 95 --budget 0.1
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+import numpy as np
+
+from parallelprompt.backends import add_backend_arguments, backend_from_args
+from parallelprompt.engine import ENGINE_MODEL, TASKS, ParallelEngine, load_records
+
+
+class HedgePolicy:
+    """
+    When to send a duplicate request, and how many duplicates are allowed.
+
+    Parameters:
+    - percentile (float): Latency percentile after which a request is hedged.
+    - budget (float): Extra requests allowed per primary request.
+    - token_budget (int, optional): Total estimated extra prompt tokens allowed.
+    - min_samples (int): Observed latencies needed before hedging starts.
+    - window (int): Recent latencies the percentile is computed over.
+    """
+
+    def __init__(self, percentile=95.0, budget=0.05, token_budget=None, min_samples=20, window=1000):
+        self.percentile = percentile
+        self.budget = budget
+        self.token_budget = token_budget
+        self.min_samples = min_samples
+        self.window = window
+
+    def as_dict(self):
+        return {"percentile": self.percentile, "budget": self.budget, "token_budget": self.token_budget,
+                "min_samples": self.min_samples, "window": self.window}
+
+
+class Hedger:
+    """
+    Runs request coroutines with at most one hedged duplicate each, as allowed by a `HedgePolicy`.
+
+    Parameters:
+    - policy (HedgePolicy): Trigger and budgets.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.latencies = deque(maxlen=policy.window)
+
+        self.primaries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.extra_prompt_tokens = 0
+
+    def threshold(self):
+        """Seconds after which a request is hedged, or None while there are too few samples"""
+        if len(self.latencies) < self.policy.min_samples:
+            return None
+        return float(np.percentile(self.latencies, self.policy.percentile))
+
+    def _allow(self, prompt_tokens):
+        if self.hedges + 1 > self.policy.budget * self.primaries:
+            return False
+        token_budget = self.policy.token_budget
+        return token_budget is None or self.extra_prompt_tokens + prompt_tokens <= token_budget
+
+    async def run(self, call, prompt_tokens=0):
+        """
+        Await `call()`, hedging it with a second `call()` if it runs past the threshold.
+
+        Parameters:
+        - call (callable): Zero-argument coroutine function issuing the request.
+        - prompt_tokens (int): Prompt size of the request, charged to the token budget when hedged.
+
+        Returns:
+        - The first successful result; the result dict gains `hedged` (True if
+          a duplicate was sent) and `hedge_won`.
+        """
+        self.primaries += 1
+        start = time.monotonic()
+        primary = asyncio.ensure_future(call())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.threshold())
+            if not done and self._allow(prompt_tokens):
+                self.hedges += 1
+                self.extra_prompt_tokens += prompt_tokens
+                tasks.add(asyncio.ensure_future(call()))
+
+            winner, error = None, None
+            pending = tasks
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = error or task.exception()
+            if winner is None:
+                raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        self.latencies.append(time.monotonic() - start)
+        result = winner.result()
+        if isinstance(result, dict):
+            result["hedged"] = len(tasks) > 1
+            result["hedge_won"] = winner is not primary
+        if winner is not primary:
+            self.hedge_wins += 1
+        return result
+
+    def stats(self):
+        return {
+            "primaries": self.primaries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "extra_request_ratio": self.hedges / self.primaries if self.primaries else 0.0,
+            "extra_prompt_tokens": self.extra_prompt_tokens,
+        }
+
+
+def latency_summary(durations_ms):
+    durations = np.asarray(durations_ms, dtype=np.float64)
+    if not len(durations):
+        return {"p50_ms": 0.0, "p90_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+    return {
+        "p50_ms": float(np.percentile(durations, 50)),
+        "p90_ms": float(np.percentile(durations, 90)),
+        "p99_ms": float(np.percentile(durations, 99)),
+        "mean_ms": float(durations.mean()),
+    }
+
+
+async def measure(records, task, backend, policies, max_concurrency=64, per_record_concurrency=None,
+                  record_concurrency=1, repeat=1):
+    """
+    p50/p99 record latency of the decomposed side, without hedging and under each policy.
+
+    Parameters:
+    - policies (list): HedgePolicy objects; None stands for no hedging.
+    - repeat (int): Passes over the records per policy; the first pass also warms the latency window.
+
+    Returns:
+    - list: One dict per policy with `policy`, record latency percentiles,
+      `requests` sent and the hedger's stats.
+    """
+    results = []
+    for policy in policies:
+        hedger = Hedger(policy) if policy is not None else None
+        engine = ParallelEngine(backend, max_concurrency=max_concurrency, per_record_concurrency=per_record_concurrency,
+                                hedger=hedger)
+        limit = asyncio.Semaphore(record_concurrency)
+
+        async def run(record):
+            async with limit:
+                completions, parallel_ms = await engine.run_parallel(record, task)
+                return len(completions), parallel_ms
+
+        durations, requests = [], 0
+        for _ in range(repeat):
+            for count, parallel_ms in await asyncio.gather(*(run(record) for record in records)):
+                requests += count
+                durations.append(parallel_ms)
+        result = {"policy": policy.as_dict() if policy is not None else None}
+        result.update(latency_summary(durations))
+        result["requests"] = requests + (hedger.hedges if hedger is not None else 0)
+        if hedger is not None:
+            result.update(hedger.stats())
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure hedged requests against record tail latency.")
+    parser.add_argument("--queries", type=str, required=True, help="Dataset JSON file")
+    parser.add_argument("--task", type=str, choices=TASKS, required=True)
+    parser.add_argument("--percentiles", type=float, nargs="+", default=[90.0, 95.0, 99.0],
+                        help="Hedge trigger percentiles to compare against no hedging")
+    parser.add_argument("--budget", type=float, default=0.05, help="Extra requests allowed per primary request")
+    parser.add_argument("--token-budget", type=int, default=None, help="Extra prompt tokens allowed in total")
+    parser.add_argument("--min-samples", type=int, default=20, help="Latencies observed before hedging starts")
+    parser.add_argument("--repeat", type=int, default=2, help="Passes over the records per policy")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Requests in flight across all records")
+    parser.add_argument("--per-record-concurrency", type=int, default=None, help="Sub-requests in flight per record")
+    parser.add_argument("--record-concurrency", type=int, default=1, help="Records run at once")
+    parser.add_argument("--limit", type=int, default=None, help="Only run the first N records")
+    parser.add_argument("--output", type=str, default=None, help="Write the measurements as JSON")
+    add_backend_arguments(parser, default="mock")
+    args = parser.parse_args()
+    if args.model is None and args.backend == "openai":
+        args.model = ENGINE_MODEL
+
+    records = load_records(args.queries, args.limit, category=args.task)
+    policies = [None] + [HedgePolicy(percentile, args.budget, args.token_budget, args.min_samples)
+                         for percentile in args.percentiles]
+    options = {} if args.backend in ("mock", "bedrock") else {"max_connections": args.max_concurrency}
+    backend = backend_from_args(args, **options)
+
+    async def run():
+        try:
+            return await measure(records, args.task, backend, policies, max_concurrency=args.max_concurrency,
+                                 per_record_concurrency=args.per_record_concurrency,
+                                 record_concurrency=args.record_concurrency, repeat=args.repeat)
+        finally:
+            await backend.aclose()
+
+    results = asyncio.run(run())
+    print(f"{'hedge at':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'requests':>10}{'hedges':>8}{'wins':>6}")
+    for result in results:
+        label = "off" if result["policy"] is None else f"p{result['policy']['percentile']:g}"
+        print(f"{label:>10}{result['p50_ms']:>10.0f}{result['p90_ms']:>10.0f}{result['p99_ms']:>10.0f}"
+              f"{result['requests']:>10}{result.get('hedges', 0):>8}{result.get('hedge_wins', 0):>6}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"task": args.task, "results": results}, f, indent=2)
+        print(f"Measurements saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Token-level latency model that predicts serial vs. parallel latency of records without calling a model.
+
+A request costs a fixed overhead (network plus queueing), a prefill time per
+prompt token and a decode time per generated token:
+
+    latency = overhead + prefill_per_token * prompt_tokens + decode_per_token * output_tokens
+
+The serial prompt is one request that generates the answers to every item.
+The decomposed prompt sends `fan_out` sub-requests that each generate one
+answer. At most `max_parallelism` of them run at once, so they complete in
+ceil(fan_out / max_parallelism) waves. A `contention` factor slows decoding
+as more requests share the provider concurrently. Output lengths are
+estimated per category (tokens per item) because they are not known before
+calling the model.
+
+`predict_chunked` models sub-requests that each answer k consecutive items
+(see `ParallelEngine(chunk_size=k)`): fewer, longer requests, each with the
+chunk instruction and k items in its prompt and k answers to decode.
+`best_chunk_sizes` picks k per record from a set of candidates, optionally
+charging `request_cost` seconds per request for rate-limit pressure.
+
+`record_features` does one pass over the records to get token counts. After
+that, `predict` is pure NumPy array arithmetic, so a dataset can be
+re-scored under another backend profile or parallelism cap in milliseconds.
+
+Usage:
+    python -m parallelprompt.latency_model datasets/*/*.json --backend openai --max-parallelism 8
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from parallelprompt.backends import BACKENDS
+from parallelprompt.engine import CHUNK_INSTRUCTION, PARALLEL_SYSTEM_PROMPTS, SERIAL_SYSTEM_PROMPTS, TASKS
+from parallelprompt.store import DatasetStore, is_store
+
+CHARS_PER_TOKEN = 4
+
+# Rough per-backend costs in seconds; calibrate against measured runs with `CostModel.fit`
+PROFILES = {
+    "openai": {"overhead": 0.35, "prefill_per_token": 0.00005, "decode_per_token": 0.015, "contention": 0.01},
+    "bedrock": {"overhead": 0.45, "prefill_per_token": 0.00004, "decode_per_token": 0.008, "contention": 0.01},
+    # Defaults of parallelprompt.backends.MockBackend
+    "mock": {"overhead": 0.2, "prefill_per_token": 0.0, "decode_per_token": 0.01, "contention": 0.0},
+}
+PROFILES["mock-http"] = PROFILES["mock"]
+
+# Estimated generated tokens per decomposed item, by category
+OUTPUT_TOKENS_PER_ITEM = {
+    "keyword_extraction": 24,
+    "reading_comprehension": 48,
+    "generate_n": 160,
+}
+DEFAULT_OUTPUT_TOKENS_PER_ITEM = 64
+
+# Extra tokens the serial answer spends on numbering, headings and transitions
+SERIAL_OUTPUT_OVERHEAD = 16
+
+# Prompt tokens a chunked sub-request adds: the instruction plus a "[i] " marker per item
+CHUNK_INSTRUCTION_TOKENS = len(CHUNK_INSTRUCTION) // CHARS_PER_TOKEN
+CHUNK_MARKER_TOKENS = 2
+
+DEFAULT_CHUNK_SIZES = (1, 2, 4, 8, 16)
+
+
+class CostModel:
+    """
+    Prefill/decode latency model for one backend.
+
+    Parameters:
+    - overhead (float): Seconds per request before the first prompt token is processed.
+    - prefill_per_token (float): Seconds per prompt token.
+    - decode_per_token (float): Seconds per generated token.
+    - contention (float): Relative decode slowdown per additional concurrent request.
+    """
+
+    def __init__(self, overhead, prefill_per_token, decode_per_token, contention=0.0):
+        self.overhead = overhead
+        self.prefill_per_token = prefill_per_token
+        self.decode_per_token = decode_per_token
+        self.contention = contention
+
+    @classmethod
+    def for_backend(cls, name):
+        return cls(**PROFILES[name])
+
+    @classmethod
+    def fit(cls, prompt_tokens, output_tokens, latencies, contention=0.0):
+        """Least-squares fit of overhead, prefill and decode costs to measured single requests"""
+        design = np.column_stack([np.ones(len(latencies)), prompt_tokens, output_tokens]).astype(np.float64)
+        (overhead, prefill, decode), *_ = np.linalg.lstsq(design, np.asarray(latencies, dtype=np.float64), rcond=None)
+        return cls(max(0.0, overhead), max(0.0, prefill), max(0.0, decode), contention)
+
+    def latency(self, prompt_tokens, output_tokens, concurrency=1):
+        """Seconds for requests with the given token counts (arrays broadcast)"""
+        decode = self.decode_per_token * (1.0 + self.contention * (np.asarray(concurrency) - 1))
+        return self.overhead + self.prefill_per_token * np.asarray(prompt_tokens) + decode * np.asarray(output_tokens)
+
+    def as_dict(self):
+        return {"overhead": self.overhead, "prefill_per_token": self.prefill_per_token,
+                "decode_per_token": self.decode_per_token, "contention": self.contention}
+
+
+def category_from_path(path):
+    """Category of a dataset file, e.g. datasets/synthetic/keyword_extraction_synthetic.json -> keyword_extraction"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for task in TASKS:
+        if stem.startswith(task):
+            return task
+    return stem
+
+
+def load_dataset_records(paths):
+    """Read records from dataset JSON (arrays), JSONL or `parallelprompt.store` files, tagging each with its category"""
+    records = []
+    for path in paths:
+        if is_store(path):
+            with DatasetStore(path) as store:
+                records.extend(record for record in store.records(with_category=True) if "template" in record)
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                rows = json.load(f)
+        fallback = category_from_path(path)
+        for row in rows:
+            if not isinstance(row, dict) or "template" not in row:
+                continue
+            if not row.get("category"):
+                row = dict(row, category=fallback)
+            records.append(row)
+    return records
+
+
+def _tokens(chars):
+    return np.ceil(np.asarray(chars, dtype=np.float64) / CHARS_PER_TOKEN)
+
+
+def record_features(records):
+    """
+    Token counts that the latency model needs, one row per record.
+
+    Returns:
+    - dict: NumPy arrays `fan_out`, `serial_prompt_tokens`, `sub_prompt_tokens`
+      (of the longest sub-request), `item_tokens` (mean tokens per item) and `category`.
+    """
+    count = len(records)
+    fan_out = np.zeros(count, dtype=np.int64)
+    serial_chars = np.zeros(count, dtype=np.int64)
+    sub_chars = np.zeros(count, dtype=np.int64)
+    item_chars = np.zeros(count, dtype=np.float64)
+    categories = np.empty(count, dtype=object)
+
+    for i, record in enumerate(records):
+        category = record.get("category") or "unknown"
+        template = record.get("template") or ""
+        context = str(record["context"]) if record.get("context") else ""
+        data = record.get("data")
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except json.JSONDecodeError:
+                data = None
+        if data:
+            fan_out[i] = len(data)
+            longest_item = max(len(str(item)) for item in data)
+            item_chars[i] = sum(len(str(item)) for item in data) / len(data)
+        else:
+            fan_out[i] = int(record.get("n") or 0)
+            longest_item = 1
+            # A generate_n chunk lists one letter hint per answer
+            item_chars[i] = 48
+
+        # Template with the placeholders replaced by the longest item
+        sub_chars[i] = (len(template)
+                        + template.count("{context}") * (len(context) - len("{context}"))
+                        + template.count("{data}") * (longest_item - len("{data}"))
+                        + template.count("{n}") * (1 - len("{n}"))
+                        + len(PARALLEL_SYSTEM_PROMPTS.get(category, "")))
+        serial_chars[i] = len(record.get("serial") or "") + len(SERIAL_SYSTEM_PROMPTS.get(category, ""))
+        categories[i] = category
+
+    return {
+        "fan_out": fan_out,
+        "serial_prompt_tokens": _tokens(serial_chars),
+        "sub_prompt_tokens": _tokens(sub_chars),
+        "item_tokens": _tokens(item_chars),
+        "category": categories,
+    }
+
+
+def predict(features, cost_model, max_parallelism=None, output_tokens_per_item=None,
+            serial_output_overhead=SERIAL_OUTPUT_OVERHEAD):
+    """
+    Predict per-record latencies.
+
+    Parameters:
+    - features (dict): Output of `record_features`.
+    - cost_model (CostModel): Backend costs.
+    - max_parallelism (int, optional): Sub-requests in flight per record; None for no cap.
+    - output_tokens_per_item (dict, optional): Category -> generated tokens per item.
+    - serial_output_overhead (int): Extra tokens in the serial answer.
+
+    Returns:
+    - dict: NumPy arrays `serial_s`, `parallel_s`, `speedup`, `waves`, `concurrency`.
+    """
+    per_item = _output_tokens_per_item(features, output_tokens_per_item)
+    fan_out = np.maximum(features["fan_out"], 1)
+    cap = fan_out if max_parallelism is None else np.minimum(fan_out, max_parallelism)
+    waves = np.ceil(fan_out / cap)
+
+    serial_s = cost_model.latency(features["serial_prompt_tokens"], fan_out * per_item + serial_output_overhead)
+    parallel_s = waves * cost_model.latency(features["sub_prompt_tokens"], per_item, concurrency=cap)
+    return {
+        "serial_s": serial_s,
+        "parallel_s": parallel_s,
+        "speedup": serial_s / parallel_s,
+        "waves": waves,
+        "concurrency": cap,
+    }
+
+
+def predict_chunked(features, cost_model, chunk_size, max_parallelism=None, output_tokens_per_item=None):
+    """
+    Predict decomposed latency when every sub-request answers `chunk_size` items.
+
+    Parameters:
+    - features (dict): Output of `record_features`.
+    - cost_model (CostModel): Backend costs.
+    - chunk_size (int or array): Items per sub-request, for all records or per record.
+    - max_parallelism (int, optional): Sub-requests in flight per record; None for no cap.
+    - output_tokens_per_item (dict, optional): Category -> generated tokens per item.
+
+    Returns:
+    - dict: NumPy arrays `parallel_s`, `requests`, `prompt_tokens` (summed over requests) and `waves`.
+    """
+    per_item = _output_tokens_per_item(features, output_tokens_per_item)
+    fan_out = np.maximum(features["fan_out"], 1)
+    k = np.minimum(np.maximum(np.asarray(chunk_size), 1), fan_out)
+    requests = np.ceil(fan_out / k)
+    cap = requests if max_parallelism is None else np.minimum(requests, max_parallelism)
+    waves = np.ceil(requests / cap)
+
+    chunked = k > 1
+    prompt_tokens = (features["sub_prompt_tokens"]
+                     + chunked * (CHUNK_INSTRUCTION_TOKENS + k * (features["item_tokens"] + CHUNK_MARKER_TOKENS)))
+    parallel_s = waves * cost_model.latency(prompt_tokens, k * per_item, concurrency=cap)
+    return {
+        "parallel_s": parallel_s,
+        "requests": requests,
+        "prompt_tokens": requests * prompt_tokens,
+        "waves": waves,
+    }
+
+
+def best_chunk_sizes(features, cost_model, candidates=DEFAULT_CHUNK_SIZES, max_parallelism=None,
+                     output_tokens_per_item=None, request_cost=0.0):
+    """
+    Pick the chunk size with the lowest predicted cost for each record.
+
+    The cost is the predicted decomposed latency plus `request_cost` seconds
+    per request, so a positive `request_cost` trades latency for fewer calls.
+
+    Returns:
+    - tuple: (NumPy array of chunk sizes, NumPy array of their predicted `parallel_s`)
+    """
+    candidates = np.asarray(sorted(set(candidates)))
+    latencies = np.stack([predict_chunked(features, cost_model, k, max_parallelism, output_tokens_per_item)["parallel_s"]
+                          for k in candidates])
+    requests = np.stack([np.ceil(np.maximum(features["fan_out"], 1) / k) for k in candidates])
+    # Ties go to the smaller chunk size, i.e. the first candidate
+    best = np.argmin(latencies + request_cost * requests, axis=0)
+    columns = np.arange(latencies.shape[1])
+    return candidates[best], latencies[best, columns]
+
+
+def _output_tokens_per_item(features, output_tokens_per_item=None):
+    per_item_table = dict(OUTPUT_TOKENS_PER_ITEM, **(output_tokens_per_item or {}))
+    categories = features["category"]
+    per_item = np.full(len(categories), DEFAULT_OUTPUT_TOKENS_PER_ITEM, dtype=np.float64)
+    for category in np.unique(categories):
+        if category in per_item_table:
+            per_item[categories == category] = per_item_table[category]
+    return per_item
+
+
+def rank_categories(features, predictions, min_speedup=1.5):
+    """
+    Summarize predicted speedups per category, best first.
+
+    Returns:
+    - list: Dicts with `category`, `records`, `median_speedup`, `mean_speedup`,
+      `p10_speedup`, `share_above` (fraction of records at or above `min_speedup`)
+      and `seconds_saved` (total serial minus parallel latency).
+    """
+    categories = features["category"]
+    speedup = predictions["speedup"]
+    saved = predictions["serial_s"] - predictions["parallel_s"]
+    ranking = []
+    for category in np.unique(categories):
+        mask = categories == category
+        ranking.append({
+            "category": category,
+            "records": int(mask.sum()),
+            "median_speedup": float(np.median(speedup[mask])),
+            "mean_speedup": float(np.mean(speedup[mask])),
+            "p10_speedup": float(np.percentile(speedup[mask], 10)),
+            "share_above": float(np.mean(speedup[mask] >= min_speedup)),
+            "seconds_saved": float(np.sum(saved[mask])),
+        })
+    return sorted(ranking, key=lambda row: row["median_speedup"], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict serial vs. parallel latency of ParallelPrompt records.")
+    parser.add_argument("paths", nargs="+", help="Dataset JSON/JSONL files, stores or globs, e.g. datasets/*/*.json")
+    parser.add_argument("--backend", type=str, choices=BACKENDS, default="openai", help="Cost profile to use")
+    parser.add_argument("--overhead", type=float, default=None, help="Override the profile's per-request overhead (s)")
+    parser.add_argument("--prefill-per-token", type=float, default=None, help="Override prefill seconds per token")
+    parser.add_argument("--decode-per-token", type=float, default=None, help="Override decode seconds per token")
+    parser.add_argument("--contention", type=float, default=None, help="Override decode slowdown per concurrent request")
+    parser.add_argument("--max-parallelism", type=int, default=None, help="Sub-requests in flight per record")
+    parser.add_argument("--min-speedup", type=float, default=1.5, help="Speedup that makes decomposition worthwhile")
+    parser.add_argument("--output", type=str, default=None, help="Write per-record predictions and the ranking as JSON")
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.paths for p in (glob.glob(pattern) or [pattern])})
+    profile = dict(PROFILES[args.backend])
+    for key in ("overhead", "prefill_per_token", "decode_per_token", "contention"):
+        if getattr(args, key) is not None:
+            profile[key] = getattr(args, key)
+    cost_model = CostModel(**profile)
+
+    records = load_dataset_records(paths)
+    start = time.perf_counter()
+    features = record_features(records)
+    featurized = time.perf_counter()
+    predictions = predict(features, cost_model, max_parallelism=args.max_parallelism)
+    ranking = rank_categories(features, predictions, min_speedup=args.min_speedup)
+    scored = time.perf_counter()
+
+    print(f"Scored {len(records)} records from {len(paths)} files: features {(featurized - start) * 1000:.1f}ms, "
+          f"prediction {(scored - featurized) * 1000:.2f}ms")
+    print(f"{'category':<28}{'records':>8}{'median':>9}{'p10':>8}{'>= min':>8}{'saved (s)':>11}")
+    for row in ranking:
+        print(f"{row['category']:<28}{row['records']:>8}{row['median_speedup']:>8.2f}x{row['p10_speedup']:>7.2f}x"
+              f"{row['share_above'] * 100:>7.0f}%{row['seconds_saved']:>11.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "cost_model": cost_model.as_dict(),
+                "max_parallelism": args.max_parallelism,
+                "ranking": ranking,
+                "records": [
+                    {"original": record.get("original"), "category": record["category"],
+                     "fan_out": int(fan_out), "serial_s": float(serial_s), "parallel_s": float(parallel_s),
+                     "speedup": float(speedup)}
+                    for record, fan_out, serial_s, parallel_s, speedup in zip(
+                        records, features["fan_out"], predictions["serial_s"], predictions["parallel_s"],
+                        predictions["speedup"])
+                ],
+            }, f, indent=2)
+        print(f"Predictions saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
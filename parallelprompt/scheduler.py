@@ -0,0 +1,300 @@
+"""
+Global request scheduler shared by every record of a benchmark run.
+
+The C++ drivers run one record at a time (serial call, then all of its
+parallel calls), and every retry loop backs off on its own. `Scheduler`
+instead admits requests from many records at once, under three shared limits:
+
+- a requests-per-minute `TokenBucket`,
+- a tokens-per-minute `TokenBucket`, charged with the prompt estimate plus
+  `max_tokens` on admission and settled against the reported usage afterwards,
+- a cap on requests in flight.
+
+Waiting requests sit in one priority heap. Lower priorities go first, and a
+retried request goes ahead of every fresh one, so records that are already
+under way finish before new ones take the budget. Throttles and errors feed a
+single `BackoffController`, which pauses all admissions instead of letting
+each request sleep on its own schedule. The backend should therefore be
+created without its own retries (see `scheduled_backend_options`).
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import random
+import time
+
+from parallelprompt import tracing
+from parallelprompt.aimd import Throttled
+from parallelprompt.backends import estimate_tokens
+
+
+class TokenBucket:
+    """
+    Continuously refilled budget, e.g. requests or tokens per minute.
+
+    Parameters:
+    - per_minute (float): Refill rate.
+    - capacity (float, optional): Largest burst; defaults to one second's worth, which paces
+      requests evenly so no sliding one-minute window sees more than `per_minute`.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else max(1.0, self.rate))
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` can be taken (amounts above capacity only need a full bucket)"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def settle(self, reserved, used):
+        """Correct an earlier `take(reserved)` once the actual amount is known; the level may go negative"""
+        self._refill()
+        self.level = min(self.capacity, self.level + reserved - used)
+
+
+class BackoffController:
+    """
+    One backoff schedule for all requests: a throttle or error pauses every admission.
+
+    Parameters:
+    - base_delay (float): Pause after the first failure in a row, in seconds.
+    - max_delay (float): Cap on a single pause.
+    - jitter (float): Random extra fraction added to each pause.
+    """
+
+    def __init__(self, base_delay=1.0, max_delay=60.0, jitter=0.1):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+        self.consecutive = 0
+        self.throttles = 0
+        self.errors = 0
+        self.paused_s = 0.0
+        self._paused_until = 0.0
+
+    def remaining(self):
+        """Seconds until admissions may resume"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def on_success(self):
+        self.consecutive = 0
+
+    def on_failure(self, exc):
+        """Pause admissions for the provider's Retry-After, or exponentially longer per failure in a row"""
+        if isinstance(exc, Throttled):
+            self.throttles += 1
+        else:
+            self.errors += 1
+        self.consecutive += 1
+        delay = getattr(exc, "retry_after", None)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** (self.consecutive - 1))
+        delay *= 1.0 + random.uniform(0.0, self.jitter)
+
+        now = time.monotonic()
+        until = now + delay
+        if until > self._paused_until:
+            self.paused_s += until - max(now, self._paused_until)
+            self._paused_until = until
+
+
+class _Job:
+    __slots__ = ("args", "options", "priority", "future", "attempt", "tokens", "enqueued", "queued", "context", "task")
+
+    def __init__(self, args, options, priority, future, tokens):
+        self.args = args
+        self.options = options
+        self.priority = priority
+        self.future = future
+        self.attempt = 0
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.queued = 0.0  # Seconds spent waiting for admission, over all attempts
+        self.context = contextvars.copy_context()  # The caller's, so traced calls nest under its spans
+        self.task = None  # The running attempt once admitted
+
+
+class Scheduler:
+    """
+    Admits backend requests in priority order under shared rate limits.
+
+    Parameters:
+    - backend: A `parallelprompt.backends` backend, ideally with its own retries disabled.
+    - rpm (float, optional): Requests per minute (default: unlimited).
+    - tpm (float, optional): Prompt plus completion tokens per minute (default: unlimited).
+    - max_concurrency (int): Requests in flight.
+    - max_retries (int): Attempts per request before its error is raised to the caller.
+    - backoff (BackoffController, optional): Shared backoff; a default one is created.
+    """
+
+    def __init__(self, backend, rpm=None, tpm=None, max_concurrency=64, max_retries=8, backoff=None):
+        self.backend = backend
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff or BackoffController()
+
+        self.submitted = 0
+        self.admitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.cancelled = 0
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.queued_s = 0.0
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self._tasks = set()  # Strong references, so running attempts are not garbage-collected
+
+    async def complete(self, system_prompt, prompt, max_tokens=1024, temperature=None, priority=0, **options):
+        """
+        Queue one request and wait for its completion.
+
+        Parameters:
+        - priority: Any comparable value; lower is admitted first.
+        - Other arguments are passed to `backend.complete`.
+
+        Returns:
+        - dict: The backend's completion, plus `queued_ms` spent waiting for admission.
+        """
+        future = asyncio.get_running_loop().create_future()
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(prompt) + (max_tokens or 0)
+        options = dict(options, max_tokens=max_tokens, temperature=temperature)
+        job = _Job((system_prompt, prompt), options, priority, future, tokens)
+        # A caller that gives up (e.g. a hedge loser) also stops the request it is waiting for
+        future.add_done_callback(lambda f: self._abandon(job, f))
+        self.submitted += 1
+        self._push(job, retry=False)
+        return await future
+
+    @staticmethod
+    def _abandon(job, future):
+        """Cancel the running attempt of a job whose caller cancelled its future"""
+        if future.cancelled() and job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def _push(self, job, retry):
+        # Retries sort ahead of every fresh request, then by priority, then FIFO
+        heapq.heappush(self._heap, (0 if retry else 1, job.priority, next(self._seq), job))
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def _admission_delay(self, job):
+        """Seconds until `job` may be sent, 0 if it can go now, None if it waits for a free slot"""
+        if self.inflight >= self.max_concurrency:
+            return None
+        delay = self.backoff.remaining()
+        if self.requests is not None:
+            delay = max(delay, self.requests.wait_time(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.wait_time(job.tokens))
+        return delay
+
+    async def _dispatch(self):
+        while self._heap:
+            # Cleared before checking, so a wakeup during the checks is not lost
+            self._wakeup.clear()
+            job = self._heap[0][-1]
+            if job.future.cancelled():
+                heapq.heappop(self._heap)
+                continue
+            delay = self._admission_delay(job)
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(job.tokens)
+            self.inflight += 1
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+            job.queued += time.monotonic() - job.enqueued
+            self.queued_s += time.monotonic() - job.enqueued
+            self.admitted += 1
+            job.task = job.context.run(asyncio.ensure_future, self._run(job))
+            self._tasks.add(job.task)
+            job.task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job):
+        try:
+            completion = await self.backend.complete(*job.args, **job.options)
+        except asyncio.CancelledError:
+            # Nothing was returned to charge; release the estimate reserved at admission
+            if self.tokens is not None:
+                self.tokens.settle(job.tokens, 0)
+            self.cancelled += 1
+            raise
+        except Exception as e:
+            if self.tokens is not None:
+                self.tokens.settle(job.tokens, 0)
+            self.backoff.on_failure(e)
+            tracing.note_backoff(self.backoff.remaining())
+            job.attempt += 1
+            if job.attempt < self.max_retries and not job.future.cancelled():
+                self.retried += 1
+                job.enqueued = time.monotonic()
+                self._push(job, retry=True)
+            else:
+                self.failed += 1
+                if not job.future.cancelled():
+                    job.future.set_exception(e)
+        else:
+            self.backoff.on_success()
+            if self.tokens is not None:
+                self.tokens.settle(job.tokens, completion.get("prompt_tokens", 0) + completion.get("completion_tokens", 0))
+            self.completed += 1
+            if not job.future.cancelled():
+                completion["queued_ms"] = job.queued * 1000
+                job.future.set_result(completion)
+        finally:
+            self.inflight -= 1
+            self._wakeup.set()
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "cancelled": self.cancelled,
+            "throttled": self.backoff.throttles,
+            "errors": self.backoff.errors,
+            "paused_s": round(self.backoff.paused_s, 3),
+            "peak_inflight": self.peak_inflight,
+            "mean_queued_ms": self.queued_s / self.admitted * 1000 if self.admitted else 0.0,
+        }
+
+
+def scheduled_backend_options(backend_name):
+    """Backend options that turn off per-request retries, leaving backoff to the scheduler"""
+    if backend_name in ("openai", "mock-http"):
+        return {"max_retries": 1}
+    if backend_name == "bedrock":
+        return {"max_attempts": 1}
+    return {}
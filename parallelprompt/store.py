@@ -0,0 +1,538 @@
+"""
+Compact, memory-mapped store for ParallelPrompt dataset records.
+
+The dataset JSON files repeat a lot of text: reading-comprehension and
+keyword-extraction records carry the same passage in `original`, `serial`
+and `context`, and the same records appear in several dataset versions.
+A store keeps every distinct string once and lays the records out in
+columns, so it is a fraction of the JSON's size and opening it costs one
+mmap, not a parse of every file.
+
+Layout of a `.ppstore` file (little-endian):
+
+- magic `PPSTORE1`, a uint64 header length and a JSON header listing the
+  sections (offset, dtype, length) and the field names;
+- the string table: `string_offsets` (uint64, one more than the number of
+  strings) into `string_data` (UTF-8);
+- per text field (`original`, `serial`, `template`, `context`): string ids
+  in `<field>_segments` and per-record ranges in `<field>_offsets`. A text
+  containing the record's context is stored as the pieces around it plus
+  the context's id, so the passage is stored once;
+- `data_items` / `data_offsets`: the string ids of each record's `data`;
+- fixed-width columns: `n` (int64), `data_len` (int32), `category` and
+  `source` (string ids), `present` and `null` (bit per field) and `extra`
+  (string id of a JSON object with any other keys).
+
+Records are decoded on access, so iterating or filtering a store never
+materializes more than the current record; `select` filters on category,
+`n` and `len(data)` with NumPy over the fixed-width columns. `from_json` /
+`to_json` convert from and to the dataset JSON files; values round-trip
+exactly, with keys in the canonical field order. `engine.load_records` and
+`latency_model.load_dataset_records` (and so the benchmark) read stores
+directly.
+
+Usage:
+    python -m parallelprompt.store build "datasets/*/*.json" --output datasets.ppstore
+    python -m parallelprompt.store info datasets.ppstore
+    python -m parallelprompt.store select datasets.ppstore --category reading_comprehension --min-data-len 3 --output rc.json
+    python -m parallelprompt.store export datasets.ppstore --output-dir datasets_roundtrip
+"""
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+STORE_SUFFIX = ".ppstore"
+MAGIC = b"PPSTORE1"
+VERSION = 1
+
+TEXT_FIELDS = ("original", "serial", "template", "context")
+FIELDS = TEXT_FIELDS + ("data", "n", "category")
+NO_STRING = 0xFFFFFFFF
+
+# Contexts shorter than this are not split out of the other text fields
+MIN_SHARED_CHARS = 32
+
+_SECTION_ALIGN = 8
+
+
+def default_category(path):
+    """Category of a record without one, from its file name (see `latency_model.category_from_path`)"""
+    from parallelprompt.latency_model import category_from_path  # Imported late: latency_model reads stores
+    return category_from_path(path)
+
+
+def is_store(path):
+    return path.endswith(STORE_SUFFIX)
+
+
+class StoreWriter:
+    """
+    Accumulates records and writes them as a store.
+
+    Parameters:
+    - category_of (callable): Category of a record without a `category` key, from its source path.
+    """
+
+    def __init__(self, category_of=default_category):
+        self.category_of = category_of
+        self._ids = {}
+        self._strings = []
+        self._segments = {field: array("I") for field in TEXT_FIELDS}
+        self._segment_offsets = {field: array("Q", [0]) for field in TEXT_FIELDS}
+        self._data_items = array("I")
+        self._data_offsets = array("Q", [0])
+        self._n = array("q")
+        self._data_len = array("i")
+        self._category = array("I")
+        self._source = array("I")
+        self._present = array("B")
+        self._null = array("B")
+        self._extra = array("I")
+        self._categories = {}
+        self.text_bytes = 0
+
+    def __len__(self):
+        return len(self._n)
+
+    def intern(self, text):
+        string_id = self._ids.get(text)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._ids[text] = string_id
+            self._strings.append(text.encode("utf-8"))
+        return string_id
+
+    def _segment(self, text, shared):
+        """Split out every occurrence of the shared passage"""
+        if not shared or shared == text or shared not in text:
+            return [text]
+        segments = []
+        for i, piece in enumerate(text.split(shared)):
+            if i:
+                segments.append(shared)
+            if piece:
+                segments.append(piece)
+        return segments
+
+    def add(self, record, source=""):
+        """Append one record (a dict as found in the dataset JSON files)"""
+        present = null = 0
+        extra = {key: value for key, value in record.items() if key not in FIELDS}
+        context = record.get("context")
+        shared = context if isinstance(context, str) and len(context) >= MIN_SHARED_CHARS else None
+
+        for bit, field in enumerate(TEXT_FIELDS):
+            if field in record:
+                value = record[field]
+                if value is None:
+                    present |= 1 << bit
+                    null |= 1 << bit
+                elif isinstance(value, str):
+                    present |= 1 << bit
+                    self.text_bytes += len(value.encode("utf-8"))
+                    segments = [value] if field == "context" else self._segment(value, shared)
+                    self._segments[field].extend(self.intern(segment) for segment in segments)
+                else:
+                    extra[field] = value  # Not text: kept verbatim
+            self._segment_offsets[field].append(len(self._segments[field]))
+
+        data = record.get("data")
+        data_bit, n_bit, category_bit = (1 << FIELDS.index(name) for name in ("data", "n", "category"))
+        if "data" in record and data is None:
+            present |= data_bit
+            null |= data_bit
+        elif isinstance(data, list) and all(isinstance(item, str) for item in data):
+            present |= data_bit
+            self.text_bytes += sum(len(item.encode("utf-8")) for item in data)
+            self._data_items.extend(self.intern(item) for item in data)
+        elif "data" in record:
+            extra["data"] = data
+        self._data_offsets.append(len(self._data_items))
+        self._data_len.append(len(data) if present & data_bit and data is not None else -1)
+
+        n = record.get("n")
+        if "n" in record and n is None:
+            present |= n_bit
+            null |= n_bit
+        elif isinstance(n, int) and not isinstance(n, bool):
+            present |= n_bit
+        elif "n" in record:
+            extra["n"] = n
+        self._n.append(n if present & n_bit and n is not None else -1)
+
+        category = record.get("category")
+        if "category" in record and category is None:
+            present |= category_bit
+            null |= category_bit
+        elif isinstance(category, str):
+            present |= category_bit
+        elif "category" in record:
+            extra["category"] = category
+        if not isinstance(category, str) or not category:
+            category = self._categories.get(source)
+            if category is None:
+                category = self._categories[source] = self.category_of(source)
+        self._category.append(self.intern(category))
+
+        self._source.append(self.intern(source))
+        self._present.append(present)
+        self._null.append(null)
+        self._extra.append(self.intern(json.dumps(extra, ensure_ascii=False)) if extra else NO_STRING)
+
+    def sections(self):
+        """(name, array) pairs in file order"""
+        lengths = np.fromiter((len(s) for s in self._strings), dtype=np.uint64, count=len(self._strings))
+        string_offsets = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(lengths, dtype=np.uint64)])
+        sections = [("string_offsets", string_offsets),
+                    ("string_data", np.frombuffer(b"".join(self._strings), dtype=np.uint8))]
+        for field in TEXT_FIELDS:
+            sections.append((f"{field}_segments", np.frombuffer(self._segments[field], dtype="<u4")))
+            sections.append((f"{field}_offsets", np.frombuffer(self._segment_offsets[field], dtype="<u8")))
+        sections += [
+            ("data_items", np.frombuffer(self._data_items, dtype="<u4")),
+            ("data_offsets", np.frombuffer(self._data_offsets, dtype="<u8")),
+            ("n", np.frombuffer(self._n, dtype="<i8")),
+            ("data_len", np.frombuffer(self._data_len, dtype="<i4")),
+            ("category", np.frombuffer(self._category, dtype="<u4")),
+            ("source", np.frombuffer(self._source, dtype="<u4")),
+            ("present", np.frombuffer(self._present, dtype="u1")),
+            ("null", np.frombuffer(self._null, dtype="u1")),
+            ("extra", np.frombuffer(self._extra, dtype="<u4")),
+        ]
+        return sections
+
+    def write(self, path):
+        """Write the store (to a temporary file, then renamed)"""
+        sections = self.sections()
+        header = {"version": VERSION, "records": len(self), "strings": len(self._strings), "fields": list(FIELDS),
+                  "text_bytes": self.text_bytes, "sections": {}}
+        # Section offsets depend on the header length, which depends on the offsets; reserve room for them
+        offset = 0
+        for name, values in sections:
+            header["sections"][name] = [offset, values.dtype.str, int(values.size)]
+            offset += -(-values.nbytes // _SECTION_ALIGN) * _SECTION_ALIGN
+        placeholder = json.dumps(header).encode("utf-8")
+        base = -(-(len(MAGIC) + 8 + len(placeholder) + 32 * len(sections)) // _SECTION_ALIGN) * _SECTION_ALIGN
+        for name in header["sections"]:
+            header["sections"][name][0] += base
+        encoded = json.dumps(header).encode("utf-8")
+        assert len(MAGIC) + 8 + len(encoded) <= base
+        encoded += b" " * (base - len(MAGIC) - 8 - len(encoded))
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(encoded)))
+            f.write(encoded)
+            for name, values in sections:
+                f.write(values.tobytes())
+                f.write(b"\0" * (-values.nbytes % _SECTION_ALIGN))
+        os.replace(tmp_path, path)
+
+
+class DatasetStore:
+    """
+    Read-only view of a store file over mmap.
+
+    `store[i]` decodes record i; iterating yields every record lazily.
+    The fixed-width columns (`n`, `data_len`, `category_ids`) are NumPy views
+    of the file for vectorized filtering.
+
+    Parameters:
+    - path (str): A `.ppstore` file written by `StoreWriter` / `from_json`.
+    - string_cache (int): Decoded strings kept in memory, least recently used evicted first.
+    """
+
+    def __init__(self, path, string_cache=4096):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a ParallelPrompt store")
+        (header_length,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        self.header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + header_length])
+        if self.header["version"] != VERSION:
+            self.close()
+            raise ValueError(f"{path}: unsupported store version {self.header['version']}")
+        self._columns = {name: np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=count, offset=offset)
+                         for name, (offset, dtype, count) in self.header["sections"].items()}
+        self._string = lru_cache(maxsize=string_cache)(self._decode)
+        self._bits = {field: 1 << bit for bit, field in enumerate(self.header["fields"])}
+
+    def __len__(self):
+        return self.header["records"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._columns = {}
+        if getattr(self, "_string", None) is not None:
+            self._string.cache_clear()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # Column views are still referenced elsewhere; the mapping is released with them
+        self._file.close()
+
+    def _decode(self, string_id):
+        offsets = self._columns["string_offsets"]
+        start, end = int(offsets[string_id]), int(offsets[string_id + 1])
+        base = self.header["sections"]["string_data"][0]
+        return self._mmap[base + start:base + end].decode("utf-8")
+
+    def string(self, string_id):
+        """Interned string by id"""
+        return self._string(int(string_id))
+
+    @property
+    def n(self):
+        """`n` of every record (-1 where missing)"""
+        return self._columns["n"]
+
+    @property
+    def data_len(self):
+        """`len(data)` of every record (-1 where missing)"""
+        return self._columns["data_len"]
+
+    @property
+    def category_ids(self):
+        return self._columns["category"]
+
+    def categories(self):
+        """Record count per category"""
+        ids, counts = np.unique(self.category_ids, return_counts=True)
+        return {self.string(string_id): int(count) for string_id, count in zip(ids, counts)}
+
+    def _text(self, field, index):
+        offsets = self._columns[f"{field}_offsets"]
+        segments = self._columns[f"{field}_segments"][int(offsets[index]):int(offsets[index + 1])]
+        return "".join(self.string(segment) for segment in segments)
+
+    def record(self, index, with_category=False):
+        """
+        Decode one record.
+
+        Parameters:
+        - index (int): Record position; negative counts from the end.
+        - with_category (bool): Add the category derived from the source file to records without one.
+
+        Returns:
+        - dict: The record as in the dataset JSON.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        present, null = int(self._columns["present"][index]), int(self._columns["null"][index])
+        record = {}
+        for field in FIELDS:
+            bit = self._bits[field]
+            if not present & bit:
+                continue
+            if null & bit:
+                record[field] = None
+            elif field in TEXT_FIELDS:
+                record[field] = self._text(field, index)
+            elif field == "data":
+                offsets = self._columns["data_offsets"]
+                items = self._columns["data_items"][int(offsets[index]):int(offsets[index + 1])]
+                record[field] = [self.string(item) for item in items]
+            elif field == "n":
+                record[field] = int(self._columns["n"][index])
+            else:
+                record[field] = self.string(self._columns["category"][index])
+        extra = int(self._columns["extra"][index])
+        if extra != NO_STRING:
+            record.update(json.loads(self.string(extra)))
+        if with_category and record.get("category") is None:
+            record["category"] = self.string(self._columns["category"][index])
+        return record
+
+    def source(self, index):
+        """Dataset file a record was read from"""
+        return self.string(self._columns["source"][index])
+
+    def __getitem__(self, index):
+        return self.record(index)
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self, indices=None, with_category=False):
+        """Decode records lazily, all of them or those at `indices`"""
+        for index in (range(len(self)) if indices is None else indices):
+            yield self.record(int(index), with_category=with_category)
+
+    def select(self, category=None, n=None, data_len=None, min_data_len=None, max_data_len=None, source=None):
+        """
+        Positions of the records matching every given criterion.
+
+        Parameters:
+        - category (str or list, optional): Category name(s).
+        - n (int or list, optional): Value(s) of `n`.
+        - data_len (int or list, optional): Value(s) of `len(data)`.
+        - min_data_len, max_data_len (int, optional): Bounds on `len(data)`, inclusive.
+        - source (str or list, optional): Dataset file(s) the records were read from.
+
+        Returns:
+        - np.ndarray: Record positions in store order.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if category is not None:
+            mask &= np.isin(self.category_ids, self._lookup([category] if isinstance(category, str) else category))
+        if source is not None:
+            mask &= np.isin(self._columns["source"], self._lookup([source] if isinstance(source, str) else source))
+        if n is not None:
+            mask &= np.isin(self.n, np.atleast_1d(n))
+        if data_len is not None:
+            mask &= np.isin(self.data_len, np.atleast_1d(data_len))
+        if min_data_len is not None:
+            mask &= self.data_len >= min_data_len
+        if max_data_len is not None:
+            mask &= (self.data_len <= max_data_len) & (self.data_len >= 0)
+        return np.flatnonzero(mask)
+
+    def _lookup(self, names):
+        """Ids of the given strings among the categories and sources (unknown names match nothing)"""
+        wanted = set(names)
+        candidates = np.unique(np.concatenate([self.category_ids, self._columns["source"]]))
+        return np.array([string_id for string_id in candidates if self.string(string_id) in wanted], dtype=np.uint32)
+
+    def filter(self, with_category=False, **criteria):
+        """Decode the records matching `select(**criteria)` lazily"""
+        return self.records(self.select(**criteria), with_category=with_category)
+
+    def info(self):
+        """Sizes and deduplication of the store"""
+        string_bytes = self.header["sections"]["string_data"][2]
+        return {
+            "records": len(self),
+            "strings": self.header["strings"],
+            "text_bytes": self.header["text_bytes"],
+            "string_bytes": string_bytes,
+            "dedup_ratio": self.header["text_bytes"] / max(1, string_bytes),
+            "file_bytes": os.path.getsize(self.path),
+            "categories": self.categories(),
+        }
+
+
+def expand_paths(patterns):
+    return sorted({path for pattern in patterns for path in (glob.glob(pattern) or [pattern])})
+
+
+def from_json(paths, output, category_of=default_category):
+    """
+    Build a store from dataset JSON (arrays of records) or JSONL files.
+
+    Parameters:
+    - paths (list): Dataset files; each record remembers its file as `source`.
+    - output (str): Store path.
+    - category_of (callable): Category of records without one, from their file path.
+
+    Returns:
+    - StoreWriter: The writer, for its counts.
+    """
+    writer = StoreWriter(category_of=category_of)
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                rows = [json.loads(line) for line in f if line.strip()]
+            else:
+                rows = json.load(f)
+        for row in rows:
+            if isinstance(row, dict):
+                writer.add(row, source=path)
+    writer.write(output)
+    return writer
+
+
+def write_json(records, path):
+    """Write records as a dataset JSON file, as the schema converters do"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(list(records), f, indent=4)
+
+
+def to_json(store, output_dir):
+    """
+    Write a store back to one dataset JSON file per source, under `output_dir` at the
+    sources' paths relative to their common directory.
+
+    Returns:
+    - list: The files written.
+    """
+    source_ids = store._columns["source"]
+    sources = {int(string_id): store.string(string_id) for string_id in np.unique(source_ids)}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in sources.values()])
+    written = []
+    for string_id, source in sorted(sources.items(), key=lambda item: item[1]):
+        path = os.path.join(output_dir, os.path.relpath(os.path.abspath(source), root))
+        write_json(store.records(np.flatnonzero(source_ids == string_id)), path)
+        written.append(path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, inspect, filter and export ParallelPrompt dataset stores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build a store from dataset JSON/JSONL files")
+    build.add_argument("paths", nargs="+", help="Dataset files or globs, e.g. 'datasets/*/*.json'")
+    build.add_argument("--output", type=str, required=True, help=f"Store file ({STORE_SUFFIX})")
+
+    info = subparsers.add_parser("info", help="Print record counts, sizes and deduplication")
+    info.add_argument("store", type=str)
+
+    select = subparsers.add_parser("select", help="Filter records by category, n and len(data)")
+    select.add_argument("store", type=str)
+    select.add_argument("--category", type=str, nargs="+", default=None)
+    select.add_argument("--n", type=int, nargs="+", default=None)
+    select.add_argument("--data-len", type=int, nargs="+", default=None)
+    select.add_argument("--min-data-len", type=int, default=None)
+    select.add_argument("--max-data-len", type=int, default=None)
+    select.add_argument("--output", type=str, default=None, help="Write the matching records as a dataset JSON file")
+
+    export = subparsers.add_parser("export", help="Write the store back to one JSON file per source")
+    export.add_argument("store", type=str)
+    export.add_argument("--output-dir", type=str, required=True)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        paths = expand_paths(args.paths)
+        from_json(paths, args.output)
+        with DatasetStore(args.output) as store:
+            stats = store.info()
+        print(f"Wrote {stats['records']} records from {len(paths)} files to {args.output}: "
+              f"{stats['file_bytes'] / 1024:.1f} KiB, {stats['strings']} distinct strings "
+              f"({stats['dedup_ratio']:.2f}x less text than the records hold)")
+        return
+
+    with DatasetStore(args.store) as store:
+        if args.command == "info":
+            print(json.dumps(store.info(), indent=2))
+        elif args.command == "select":
+            indices = store.select(category=args.category, n=args.n, data_len=args.data_len,
+                                   min_data_len=args.min_data_len, max_data_len=args.max_data_len)
+            print(f"{len(indices)} of {len(store)} records match")
+            if args.output:
+                write_json(store.records(indices), args.output)
+                print(f"Saved to {args.output}")
+        else:
+            for path in to_json(store, args.output_dir):
+                print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
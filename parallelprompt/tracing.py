@@ -0,0 +1,534 @@
+"""
+Per-call trace events for the curation, conversion, evaluation and benchmarking scripts.
+
+A single `duration_ms` around a model call hides where the time went: waiting
+for a concurrency slot or the rate limiter, retry sleeps, failed attempts, and
+the request itself. With tracing enabled (`--trace FILE` on every script that
+takes the `--backend` options, or `configure(path)`), each model call is
+written to FILE as one span with its timeline:
+
+- `enqueued_at`: when the caller queued the call (`queued()`), before any
+  semaphore, scheduler or retry loop;
+- `started_at`: when the attempt was handed to the backend;
+- `first_token_at`: when the first text arrived (streamed calls only);
+- `ended_at`: when the completion (or error) came back;
+
+split into `queue_ms`, `retry_ms` (failed attempts plus backoff sleeps, of
+which `backoff_ms` is sleeping), `ttft_ms` and `decode_ms` (streamed calls),
+and `service_ms` (the successful attempt: network, prefill and decode), plus
+`retries`, `prompt_tokens`, `completion_tokens` and `cached_tokens`. Calls
+are nested under the spans of the code that issued them, e.g. the engine's
+`record` > `serial` / `parallel` spans, so speedups can be decomposed per phase.
+
+Spans are written as JSON lines, either flat (`--trace-format jsonl`) or as
+OTLP/JSON export requests (`--trace-format otlp`, one `resourceSpans` object
+per line, as read by the OpenTelemetry Collector's `otlpjsonfile` receiver),
+with token counts under the `gen_ai.*` semantic-convention names.
+
+Usage:
+    python -m parallelprompt.engine --queries ... --task keyword_extraction --output results.json --trace trace.jsonl
+    python -m parallelprompt.tracing trace.jsonl
+"""
+import argparse
+import asyncio
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+TRACE_FORMATS = ("jsonl", "otlp")
+
+# Flat field -> OpenTelemetry attribute name; other fields are prefixed with "parallelprompt."
+OTEL_ATTRIBUTES = {
+    "backend": "gen_ai.system",
+    "model": "gen_ai.request.model",
+    "prompt_tokens": "gen_ai.usage.input_tokens",
+    "completion_tokens": "gen_ai.usage.output_tokens",
+}
+_SPAN_FIELDS = ("name", "kind", "trace_id", "span_id", "parent_id", "parent", "start", "end", "duration_ms",
+                "status", "error", "events")
+_KINDS = {"internal": 1, "client": 3}
+
+_tracer = None
+_current = contextvars.ContextVar("parallelprompt_span", default=None)
+_queue = contextvars.ContextVar("parallelprompt_queue", default=None)
+
+
+class Tracer:
+    """
+    Appends finished spans to a file, one JSON object per line; safe to share between threads.
+
+    Parameters:
+    - path (str): Trace file, appended to.
+    - format (str): One of TRACE_FORMATS.
+    - service (str): `service.name` resource attribute of OTLP output.
+    """
+
+    def __init__(self, path, format="jsonl", service="parallelprompt"):
+        if format not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format '{format}', expected one of {TRACE_FORMATS}")
+        self.path = path
+        self.format = format
+        self.service = service
+        self.spans = 0
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        payload = to_otlp(record, self.service) if self.format == "otlp" else record
+        line = json.dumps(payload, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self.spans += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Span:
+    """
+    One timed operation, nested under the span current when it was created.
+
+    Parameters:
+    - tracer (Tracer): Where the span is written when it finishes.
+    - name (str): Operation name, e.g. "record" or "openai.complete".
+    - attributes (dict, optional): Extra fields written with the span.
+    """
+
+    kind = "internal"
+
+    def __init__(self, tracer, name, attributes=None):
+        parent = _current.get()
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.start = time.time()
+        self.end = None
+        self.status = "ok"
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def event(self, name, **attributes):
+        self.events.append({"name": name, "time": time.time(), **attributes})
+
+    def finish(self, error=None):
+        if self.end is not None:
+            return
+        self.end = time.time()
+        if error is not None:
+            self.status = "cancelled" if isinstance(error, (GeneratorExit, asyncio.CancelledError)) else "error"
+            self.error = f"{type(error).__name__}: {error}"[:500]
+        self.tracer.emit(self.record())
+
+    def record(self):
+        """The span as a flat dict (the `jsonl` format)"""
+        record = {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "parent": self.parent.name if self.parent is not None else None,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": (self.end - self.start) * 1000,
+            "status": self.status,
+        }
+        if self.error is not None:
+            record["error"] = self.error
+        if self.events:
+            record["events"] = self.events
+        record.update(self.attributes)
+        return record
+
+
+class CallSpan(Span):
+    """
+    A model call. Besides its own attempt it accounts for the caller's queue
+    (`queued()`): time since the call was enqueued, and attempts and backoff
+    that failed before this one.
+    """
+
+    kind = "client"
+
+    def __init__(self, tracer, name, attributes=None):
+        super().__init__(tracer, name, attributes)
+        self.queue = _queue.get()
+        # Caller-side retries so far; later ones belong to the next attempt
+        queue = self.queue or {}
+        self.enqueued = queue.get("enqueued", self.start)
+        self.caller_retries = queue.get("retries", 0)
+        self.caller_backoff = queue.get("backoff_s", 0.0)
+        self.caller_lost = queue.get("lost_s", 0.0)
+
+        self.attempt_start = self.start
+        self.first_token_at = None
+        self.retries = 0
+        self.backoff = 0.0
+        self.usage = {}
+
+    def retry(self, delay):
+        """The backend retries after sleeping `delay` seconds"""
+        self.retries += 1
+        self.backoff += delay
+        self.event("retry", delay_s=delay)
+        self.attempt_start = time.time() + delay
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.time()
+
+    def set_usage(self, completion):
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+            if completion.get(key) is not None:
+                self.usage[key] = completion[key]
+
+    def finish(self, error=None):
+        if self.end is None and self.queue is not None and isinstance(error, Exception):
+            # The caller's next attempt inherits this one as lost time
+            self.queue["retries"] = self.queue.get("retries", 0) + 1
+            self.queue["lost_s"] = self.queue.get("lost_s", 0.0) + (time.time() - self.start)
+        super().finish(error)
+
+    def record(self):
+        record = super().record()
+        attempt_start = min(self.attempt_start, self.end)
+        record.update({
+            "enqueued_at": self.enqueued,
+            "started_at": self.start,
+            "first_token_at": self.first_token_at,
+            "ended_at": self.end,
+            "queue_ms": max(0.0, self.start - self.enqueued - self.caller_lost) * 1000,
+            "retry_ms": (self.caller_lost + attempt_start - self.start) * 1000,
+            "backoff_ms": (self.caller_backoff + self.backoff) * 1000,
+            "service_ms": (self.end - attempt_start) * 1000,
+            "total_ms": (self.end - self.enqueued) * 1000,
+            "retries": self.caller_retries + self.retries,
+        })
+        if self.first_token_at is not None:
+            record["ttft_ms"] = (self.first_token_at - attempt_start) * 1000
+            record["decode_ms"] = (self.end - self.first_token_at) * 1000
+        record.update(self.usage)
+        return record
+
+
+class _NullSpan:
+    """Stands in for a span while tracing is off"""
+
+    def set(self, **attributes):
+        pass
+
+    def event(self, name, **attributes):
+        pass
+
+    def retry(self, delay):
+        pass
+
+    def first_token(self):
+        pass
+
+    def set_usage(self, completion):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def configure(path, format="jsonl", service="parallelprompt"):
+    """Enable tracing to `path` for the rest of the process; returns the `Tracer`"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = Tracer(path, format, service)
+    atexit.register(_tracer.close)
+    return _tracer
+
+
+def get_tracer():
+    """The configured `Tracer`, or None while tracing is off"""
+    return _tracer
+
+
+@contextlib.contextmanager
+def _activate(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.finish(e)
+        raise
+    else:
+        span.finish()
+    finally:
+        _current.reset(token)
+
+
+def span(name, **attributes):
+    """Context manager timing a block as a span; calls inside it become its children"""
+    if _tracer is None:
+        return contextlib.nullcontext(NULL_SPAN)
+    return _activate(Span(_tracer, name, attributes))
+
+
+def call_span(name, **attributes):
+    """Context manager timing one model call; use `set_usage` to attach its token counts"""
+    if _tracer is None:
+        return contextlib.nullcontext(NULL_SPAN)
+    return _activate(CallSpan(_tracer, name, attributes))
+
+
+@contextlib.contextmanager
+def queued(enqueued=None):
+    """
+    Mark the start of a call's time in the caller's queue.
+
+    Model calls made inside the block measure their queueing from here, and
+    attempts that fail inside it (with `note_backoff` for the caller's sleeps)
+    count as the retries of the calls that follow.
+    """
+    if _tracer is None:
+        yield
+        return
+    token = _queue.set({"enqueued": enqueued if enqueued is not None else time.time()})
+    try:
+        yield
+    finally:
+        _queue.reset(token)
+
+
+def note_backoff(seconds):
+    """The caller sleeps `seconds` before retrying the call queued with `queued()`"""
+    queue = _queue.get()
+    if queue is not None:
+        queue["backoff_s"] = queue.get("backoff_s", 0.0) + seconds
+        queue["lost_s"] = queue.get("lost_s", 0.0) + seconds
+
+
+def note_retry(delay):
+    """The backend retries the current call after sleeping `delay` seconds"""
+    current = _current.get()
+    if isinstance(current, CallSpan) and current.end is None:
+        current.retry(delay)
+
+
+class TracedBackend:
+    """
+    Wraps a backend so every `complete_sync`, `complete` and `stream` call is a `CallSpan`.
+    Everything else is passed through to the wrapped backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def _call_span(self, method):
+        return call_span(f"{self.backend.name}.{method}", backend=self.backend.name, model=self.backend.model)
+
+    def complete_sync(self, system_prompt, prompt, **options):
+        with self._call_span("complete") as call:
+            completion = self.backend.complete_sync(system_prompt, prompt, **options)
+            call.set_usage(completion)
+            return completion
+
+    async def complete(self, system_prompt, prompt, **options):
+        with self._call_span("complete") as call:
+            completion = await self.backend.complete(system_prompt, prompt, **options)
+            call.set_usage(completion)
+            return completion
+
+    async def stream(self, system_prompt, prompt, **options):
+        call = CallSpan(_tracer, f"{self.backend.name}.stream",
+                        {"backend": self.backend.name, "model": self.backend.model})
+        token = _current.set(call)
+        try:
+            async for event in self.backend.stream(system_prompt, prompt, **options):
+                if event.get("done"):
+                    call.set_usage(event)
+                elif event["text"]:
+                    call.first_token()
+                yield event
+        except BaseException as e:
+            call.finish(e)
+            raise
+        else:
+            call.finish()
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Closed from another context (e.g. garbage collection of an abandoned stream)
+                pass
+
+
+def traced(backend):
+    """`backend` wrapped in a `TracedBackend` while tracing is on, else unchanged"""
+    if _tracer is None or isinstance(backend, TracedBackend):
+        return backend
+    return TracedBackend(backend)
+
+
+def to_otlp(record, service="parallelprompt"):
+    """A flat span record as an OTLP/JSON `ExportTraceServiceRequest` holding that one span"""
+
+    def value(v):
+        if isinstance(v, bool):
+            return {"boolValue": v}
+        if isinstance(v, int):
+            return {"intValue": str(v)}
+        if isinstance(v, float):
+            return {"doubleValue": v}
+        return {"stringValue": str(v)}
+
+    def attributes(fields):
+        return [{"key": OTEL_ATTRIBUTES.get(key, f"parallelprompt.{key}"), "value": value(v)}
+                for key, v in fields.items() if v is not None]
+
+    span = {
+        "traceId": record["trace_id"],
+        "spanId": record["span_id"],
+        "name": record["name"],
+        "kind": _KINDS[record["kind"]],
+        "startTimeUnixNano": str(int(record["start"] * 1e9)),
+        "endTimeUnixNano": str(int(record["end"] * 1e9)),
+        "attributes": attributes({key: v for key, v in record.items() if key not in _SPAN_FIELDS}),
+        "status": {"code": 1} if record["status"] == "ok" else {"code": 2, "message": record.get("error", record["status"])},
+    }
+    if record["parent_id"]:
+        span["parentSpanId"] = record["parent_id"]
+        span["attributes"].append({"key": "parallelprompt.parent", "value": value(record["parent"])})
+    if record.get("events"):
+        span["events"] = [{"name": event["name"], "timeUnixNano": str(int(event["time"] * 1e9)),
+                           "attributes": attributes({k: v for k, v in event.items() if k not in ("name", "time")})}
+                          for event in record["events"]]
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+        "scopeSpans": [{"scope": {"name": "parallelprompt.tracing"}, "spans": [span]}],
+    }]}
+
+
+def from_otlp(payload):
+    """Flat span records from one OTLP/JSON export request (the inverse of `to_otlp`)"""
+    names = {otel: flat for flat, otel in OTEL_ATTRIBUTES.items()}
+    kinds = {code: kind for kind, code in _KINDS.items()}
+    records = []
+    for resource_spans in payload.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                start = int(span["startTimeUnixNano"]) / 1e9
+                end = int(span["endTimeUnixNano"]) / 1e9
+                record = {
+                    "name": span["name"],
+                    "kind": kinds.get(span.get("kind"), "internal"),
+                    "trace_id": span["traceId"],
+                    "span_id": span["spanId"],
+                    "parent_id": span.get("parentSpanId"),
+                    "parent": None,
+                    "start": start,
+                    "end": end,
+                    "duration_ms": (end - start) * 1000,
+                    "status": "ok" if span.get("status", {}).get("code", 1) != 2 else "error",
+                }
+                for attribute in span.get("attributes", []):
+                    key = names.get(attribute["key"], attribute["key"].replace("parallelprompt.", "", 1))
+                    (v,) = attribute["value"].values()
+                    record[key] = int(v) if "intValue" in attribute["value"] else v
+                records.append(record)
+    return records
+
+
+def load_spans(path):
+    """Span records from a trace file in either format"""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            payload = json.loads(line)
+            records.extend(from_otlp(payload) if "resourceSpans" in payload else [payload])
+    return records
+
+
+def summarize(records):
+    """
+    Break the traced calls down by the span that issued them.
+
+    Returns:
+    - dict: Parent span name ("-" for top-level calls) -> call count, errors,
+      cancelled calls (e.g. hedges that lost), mean milliseconds of queueing, retries, backoff, service, time to first
+      token and decode (streamed calls), total, and token totals; plus the
+      mean duration of the parent spans themselves as `span_ms`.
+    """
+    groups = {}
+    for record in records:
+        if record.get("kind") == "client":
+            groups.setdefault(record.get("parent") or "-", []).append(record)
+    durations = {}
+    for record in records:
+        if record.get("kind") != "client":
+            durations.setdefault(record["name"], []).append(record["duration_ms"])
+
+    def mean(calls, key):
+        values = [call[key] for call in calls if call.get(key) is not None]
+        return float(np.mean(values)) if values else None
+
+    summary = {}
+    for group, calls in groups.items():
+        ok = [call for call in calls if call["status"] == "ok"]
+        summary[group] = {
+            "calls": len(calls),
+            "errors": sum(call["status"] == "error" for call in calls),
+            "cancelled": sum(call["status"] == "cancelled" for call in calls),
+            "retries": sum(call.get("retries", 0) for call in ok),
+            "queue_ms": mean(ok, "queue_ms"),
+            "retry_ms": mean(ok, "retry_ms"),
+            "backoff_ms": mean(ok, "backoff_ms"),
+            "service_ms": mean(ok, "service_ms"),
+            "ttft_ms": mean(ok, "ttft_ms"),
+            "decode_ms": mean(ok, "decode_ms"),
+            "total_ms": mean(ok, "total_ms"),
+            "prompt_tokens": sum(call.get("prompt_tokens", 0) for call in ok),
+            "completion_tokens": sum(call.get("completion_tokens", 0) for call in ok),
+            "span_ms": float(np.mean(durations[group])) if group in durations else None,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a trace written with --trace.")
+    parser.add_argument("trace", type=str, help="Trace file (jsonl or otlp format)")
+    parser.add_argument("--output", type=str, default=None, help="Write the summary as JSON")
+    args = parser.parse_args()
+
+    summary = summarize(load_spans(args.trace))
+    columns = ("calls", "errors", "cancelled", "retries", "queue_ms", "retry_ms", "backoff_ms", "service_ms", "ttft_ms",
+               "decode_ms", "total_ms", "span_ms")
+    print(f"{'issued by':<14}" + "".join(f"{column:>11}" for column in columns))
+    for group, row in sorted(summary.items()):
+        cells = "".join(f"{'-':>11}" if row[column] is None else f"{row[column]:>11.0f}" for column in columns)
+        print(f"{group:<14}{cells}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
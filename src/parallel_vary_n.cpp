@@ -4,19 +4,32 @@
 #include <future>
 #include <string>
 #include <optional>
-#include <regex>
 #include <iostream>
 #include <fstream>
 #include <numeric>
+#include <thread>
+#include <cstdlib>
+#include <getopt.h>
 
 using namespace std;
 using namespace std::chrono;
 
 ofstream log_file("out/serial_vs_n_variations.txt");
 
+// Literal substring replacement; placeholders are fixed strings, so there is no
+// need to build a std::regex (or interpret '$' in the replacement) per call
 string replace_in_string(const string & original, const string & toReplace, const string & replacement) {
-    regex re(toReplace);
-    return regex_replace(original, re, replacement);
+    string result;
+    result.reserve(original.size());
+    size_t pos = 0;
+    size_t found;
+    while ((found = original.find(toReplace, pos)) != string::npos) {
+        result.append(original, pos, found - pos);
+        result += replacement;
+        pos = found + toReplace.size();
+    }
+    result.append(original, pos, string::npos);
+    return result;
 }
 
 string getIthLetter(int i) {
@@ -100,13 +113,13 @@ int serial(nlohmann::json formatted_prompts, int n) {
     string template_str = formatted_prompts["template"];
     string escaped_template = escape_json(template_str);
 
-    string n_regex = "\\{n\\}"; // Escape the curly braces for the regex
-    string replaced_template = replace_in_string(escaped_template, n_regex, to_string(n));
+    string n_placeholder = "{n}";
+    string replaced_template = replace_in_string(escaped_template, n_placeholder, to_string(n));
 
     if ( not formatted_prompts["context"].is_null() ) {
-      string context_regex = "\\{context\\}"; // Escape the curly braces for the regex
+      string context_placeholder = "{context}";
       string escaped_context = escape_json(formatted_prompts["context"]);
-      replaced_template = replace_in_string(replaced_template, context_regex, escaped_context);
+      replaced_template = replace_in_string(replaced_template, context_placeholder, escaped_context);
     }
       
     // cout << "Calling... " << replaced_template << endl;
@@ -122,13 +135,13 @@ int parallel(nlohmann::json formatted_prompts, int n) {
     string template_str = formatted_prompts["template"];
     string escaped_template = escape_json(template_str);
 
-    string n_regex = "\\{n\\}"; // Escape the curly braces for the regex
-    string replaced_template = replace_in_string(escaped_template, n_regex, to_string(1));
+    string n_placeholder = "{n}";
+    string replaced_template = replace_in_string(escaped_template, n_placeholder, to_string(1));
 
     if ( not formatted_prompts["context"].is_null() ) {
-      string context_regex = "\\{context\\}"; // Escape the curly braces for the regex
+      string context_placeholder = "{context}";
       string escaped_context = escape_json(formatted_prompts["context"]);
-      replaced_template = replace_in_string(replaced_template, context_regex, escaped_context);
+      replaced_template = replace_in_string(replaced_template, context_placeholder, escaped_context);
     }
 
     vector<future<openai::Json>> futures;
@@ -153,7 +166,32 @@ int parallel(nlohmann::json formatted_prompts, int n) {
    return parallel_tokens;
 }
 
-int main() {
+int main(int argc, char* argv[]) {
+  // Prompts run per n; 0 runs every prompt in the dataset
+  int max_prompts = 0;
+
+  struct option long_options[] = {
+    {"max-prompts", required_argument, nullptr, 'm'},
+    {nullptr, 0, nullptr, 0},
+  };
+
+  int opt;
+  int option_index = 0;
+  while ((opt = getopt_long(argc, argv, "m:", long_options, &option_index)) != -1) {
+    switch (opt) {
+      case 'm':
+        max_prompts = atoi(optarg);
+        if (max_prompts < 0) {
+          cerr << "--max-prompts must be >= 0." << endl;
+          return 1;
+        }
+        break;
+      default:
+        cerr << "Usage: " << argv[0] << " [--max-prompts <count>]" << endl;
+        return 1;
+    }
+  }
+
   nlohmann::json prompts_list = error_handling("prompts/generate_n_subset.json");
   ofstream log_file("out/serial_vs_n_variations.txt");
 
@@ -165,7 +203,8 @@ int main() {
   vector<vector<int>> all_serial_tokens_counts;
   
   cout << "iterating prompts" << endl;
-  for (int i = 0; i <= 50; i++) {
+  // n = 0 has no parallel calls (and nothing to divide by), so start at 1
+  for (int i = 1; i <= 50; i++) {
     // parallel execution
     vector<int> parallel_durations;
     vector<int> parallel_tokens_counts;
@@ -175,7 +214,7 @@ int main() {
 
     for (auto & prompt : prompts_list) {
       cout << "iterating" << endl;
-      if (task_count >= 5) break; // Only process the first 5
+      if (max_prompts > 0 && task_count >= max_prompts) break;
 
       log_file << "Prompt " << (task_count + 1) << ":" << endl;
       // log_file << prompt.dump(4) << endl;
@@ -209,27 +248,30 @@ int main() {
       
       parallel_durations.push_back(parallel_duration.count());
       parallel_tokens_counts.push_back(parallel_tokens);
+      ++task_count;
     }
 
     all_parallel_durations.push_back(parallel_durations);
     all_parallel_tokens_counts.push_back(parallel_tokens_counts);
     all_serial_durations.push_back(serial_durations);
     all_serial_tokens_counts.push_back(serial_tokens_counts);
-
-    ++task_count;
   }
 
   // Calculate and print averages for all 'n' values
   for (size_t i = 0; i < all_serial_durations.size(); i++) {
+    size_t n = i + 1;  // Results are stored from n = 1
     auto & serial_durations = all_serial_durations[i];
     auto & parallel_durations = all_parallel_durations[i];
     auto & serial_tokens_counts = all_serial_tokens_counts[i];
     auto & parallel_tokens_counts = all_parallel_tokens_counts[i];
 
-    double avg_serial_duration = std::reduce(serial_durations.begin(), serial_durations.end()) / task_count;
-    double avg_parallel_duration = std::reduce(parallel_durations.begin(), parallel_durations.end()) / task_count;
-    double avg_serial_tokens = std::reduce(serial_tokens_counts.begin(), serial_tokens_counts.end()) / task_count;
-    double avg_parallel_tokens = std::reduce(parallel_tokens_counts.begin(), parallel_tokens_counts.end()) / task_count;
+    // Floating-point sums over the prompts actually run for this n (integer division truncated the means)
+    double count = static_cast<double>(serial_durations.size());
+    if (count == 0) continue;
+    double avg_serial_duration = std::reduce(serial_durations.begin(), serial_durations.end(), 0.0) / count;
+    double avg_parallel_duration = std::reduce(parallel_durations.begin(), parallel_durations.end(), 0.0) / count;
+    double avg_serial_tokens = std::reduce(serial_tokens_counts.begin(), serial_tokens_counts.end(), 0.0) / count;
+    double avg_parallel_tokens = std::reduce(parallel_tokens_counts.begin(), parallel_tokens_counts.end(), 0.0) / count;
 
     // Save averages to log file
     log_file << "Average Serial duration: " << avg_serial_duration << " ms" << endl;
@@ -238,11 +280,11 @@ int main() {
     cout << endl << "Average Serial duration: " << avg_serial_duration << " ms" << endl;
     cout << "Average Serial tokens: " << avg_serial_tokens << endl;
 
-    cout << "Average Parallel duration with " << (i) << " parallel calls: " << avg_parallel_duration << " ms" << endl;
-    cout << "Average Parallel tokens with " << (i) << " parallel calls: " << avg_parallel_tokens << endl;
+    cout << "Average Parallel duration with " << n << " parallel calls: " << avg_parallel_duration << " ms" << endl;
+    cout << "Average Parallel tokens with " << n << " parallel calls: " << avg_parallel_tokens << endl;
 
-    log_file << "Average Parallel duration with " << (i) << " parallel calls: " << avg_parallel_duration << " ms" << endl;
-    log_file << "Average Parallel tokens with " << (i) << " parallel calls: " << avg_parallel_tokens << endl;
+    log_file << "Average Parallel duration with " << n << " parallel calls: " << avg_parallel_duration << " ms" << endl;
+    log_file << "Average Parallel tokens with " << n << " parallel calls: " << avg_parallel_tokens << endl;
 
     // Calculate average speedup
     auto speedup = static_cast<double>(avg_serial_duration) / avg_parallel_duration;
@@ -251,11 +293,11 @@ int main() {
     double normalized_speedup = (static_cast<double>(avg_serial_duration) / avg_serial_tokens) /
                                 (static_cast<double>(avg_parallel_duration) / avg_parallel_tokens);
 
-    cout << "Average Speedup for " << (i) << " parallel calls: " << speedup << "x" << endl;
-    cout << "Average Normalized speedup for " << (i) << " parallel calls: " << normalized_speedup << "x" << endl;
+    cout << "Average Speedup for " << n << " parallel calls: " << speedup << "x" << endl;
+    cout << "Average Normalized speedup for " << n << " parallel calls: " << normalized_speedup << "x" << endl;
 
-    log_file << "Average Speedup for " << (i) << " parallel calls: " << speedup << "x" << endl;
-    log_file << "Average Normalized speedup for " << (i) << " parallel calls: " << normalized_speedup << "x" << endl;
+    log_file << "Average Speedup for " << n << " parallel calls: " << speedup << "x" << endl;
+    log_file << "Average Normalized speedup for " << n << " parallel calls: " << normalized_speedup << "x" << endl;
 
   }
 
@@ -4,7 +4,6 @@
 #include <future>
 #include <string>
 #include <optional>
-#include <regex>
 #include <iostream>
 #include <fstream>
 #include <numeric>
@@ -14,9 +13,20 @@
 using namespace std;
 using namespace std::chrono;
 
+// Literal substring replacement; placeholders are fixed strings, so there is no
+// need to build a std::regex (or interpret '$' in the replacement) per call
 string replace_in_string(const string & original, const string & toReplace, const string & replacement) {
-    regex re(toReplace);
-    return regex_replace(original, re, replacement);
+    string result;
+    result.reserve(original.size());
+    size_t pos = 0;
+    size_t found;
+    while ((found = original.find(toReplace, pos)) != string::npos) {
+        result.append(original, pos, found - pos);
+        result += replacement;
+        pos = found + toReplace.size();
+    }
+    result.append(original, pos, string::npos);
+    return result;
 }
 
 string escape_json(const string& input) {
@@ -116,8 +126,8 @@ tuple<vector<int>, int, vector<pair<int, openai::Json>>> parallel(nlohmann::json
     if (formatted_prompts.contains("context") && !formatted_prompts["context"].empty()) {
     	string context = formatted_prompts["context"];
     	string escaped_context = escape_json(context);
-    	string context_regex = "\\{context\\}"; // Escape the curly braces for the regex
-    	template_with_context = replace_in_string(template_escaped, context_regex, escaped_context);
+    	string context_placeholder = "{context}";
+    	template_with_context = replace_in_string(template_escaped, context_placeholder, escaped_context);
     } else {
         template_with_context = template_escaped;
     }
@@ -140,13 +150,13 @@ tuple<vector<int>, int, vector<pair<int, openai::Json>>> parallel(nlohmann::json
         string prompt = template_with_context;
         if (task == "generate_n") {
           system_prompt = "You are a helpful assistant.  Provide concise and accurate answers based on the given context and do not include irrelevant information. Try to make your response start with the letter " + getIthLetter(i);
-          string n_regex = "\\{n\\}"; // Escape the curly braces for the regex
-          prompt = replace_in_string(prompt, n_regex, to_string(1));
+          string n_placeholder = "{n}";
+          prompt = replace_in_string(prompt, n_placeholder, to_string(1));
         }
         else if (formatted_prompts.contains("data")) {
-          string data_regex = "\\{data\\}"; // Escape the curly braces for the regex
+          string data_placeholder = "{data}";
           string escaped_data = escape_json(formatted_prompts["data"][i]);
-          prompt = replace_in_string(prompt, data_regex, escaped_data);
+          prompt = replace_in_string(prompt, data_placeholder, escaped_data);
         }
         futures.push_back(async(launch::async, [system_prompt, prompt]() {
             auto start = high_resolution_clock::now();
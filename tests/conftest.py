@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The curation scripts import each other as top-level modules, like the scripts themselves do
+sys.path.insert(0, os.path.join(ROOT, "data_curation"))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,82 @@
+import json
+import os
+
+import pytest
+
+from parallelprompt.backends import MockBackend
+from parallelprompt.batch import BatchJobError, custom_id, run_batch
+
+
+class CountingBackend(MockBackend):
+    """Mock backend whose batch jobs run in a `LocalBatchStore`, counting submissions"""
+
+    def __init__(self, batch_dir, **options):
+        super().__init__(ttft=0, per_token=0, responder=lambda system_prompt, prompt: prompt.upper(),
+                         batch_dir=batch_dir, **options)
+        self.submitted = 0
+
+    def submit_batch(self, requests):
+        self.submitted += 1
+        return super().submit_batch(requests)
+
+
+def batch_requests(n):
+    return [{"custom_id": custom_id("test", i), "system_prompt": "Answer.", "prompt": f"prompt {i}"}
+            for i in range(n)]
+
+
+def quiet(message):
+    pass
+
+
+def test_results_are_returned_by_id_and_reused(tmp_path):
+    requests = batch_requests(5)
+    job_dir = str(tmp_path / "job")
+    backend = CountingBackend(str(tmp_path / "store"))
+
+    results = run_batch(backend, requests, job_dir, poll_interval=0.01, log=quiet)
+    assert {request_id: completion["text"] for request_id, completion in results.items()} == {
+        request["custom_id"]: request["prompt"].upper() for request in requests}
+    with open(os.path.join(job_dir, "job.json")) as f:
+        assert json.load(f)["results_saved"]
+
+    # A re-run with the same requests reads the saved results instead of submitting again
+    assert run_batch(backend, requests, job_dir, poll_interval=0.01, log=quiet) == results
+    assert backend.submitted == 1
+
+    # Different requests in the same directory are a new job
+    run_batch(backend, requests[:3], job_dir, poll_interval=0.01, log=quiet)
+    assert backend.submitted == 2
+
+
+def test_interrupted_job_is_resumed_not_resubmitted(tmp_path):
+    requests = batch_requests(3)
+    job_dir = str(tmp_path / "job")
+    slow = CountingBackend(str(tmp_path / "store"), batch_delay=0.5)
+    with pytest.raises(BatchJobError):
+        run_batch(slow, requests, job_dir, poll_interval=0.01, timeout=0, log=quiet)
+    with open(os.path.join(job_dir, "job.json")) as f:
+        job_id = json.load(f)["job"]["id"]
+
+    # Another process with the same batch store polls the job already submitted
+    resumed = CountingBackend(str(tmp_path / "store"))
+    results = run_batch(resumed, requests, job_dir, poll_interval=0.01, log=quiet)
+    assert resumed.submitted == 0
+    assert len(results) == 3
+    with open(os.path.join(job_dir, "job.json")) as f:
+        assert json.load(f)["job"]["id"] == job_id
+
+
+def test_failed_requests_are_reported_per_id(tmp_path):
+    requests = batch_requests(3)
+    backend = CountingBackend(str(tmp_path / "store"), error_rate=1.0)
+    results = run_batch(backend, requests, str(tmp_path / "job"), poll_interval=0.01, log=quiet)
+    assert set(results) == {request["custom_id"] for request in requests}
+    assert all("error" in completion for completion in results.values())
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    requests = batch_requests(2)
+    requests[1]["custom_id"] = requests[0]["custom_id"]
+    with pytest.raises(ValueError):
+        run_batch(CountingBackend(str(tmp_path / "store")), requests, str(tmp_path / "job"), log=quiet)
@@ -0,0 +1,57 @@
+import numpy as np
+
+from parallelprompt.benchmark import bootstrap, compare, summarize
+
+
+def measurement(record, serial_ms, parallel_ms, category="generate_n", n=4, error=False):
+    m = {"record": record, "category": category, "n": n, "serial_ms": serial_ms, "parallel_ms": parallel_ms,
+         "serial_tokens": 100, "parallel_tokens": 100}
+    if error:
+        m["error"] = "Timeout: "
+    return m
+
+
+def run(speedups, n=4, repetitions=2):
+    return {"measurements": [measurement(f"r{i}", 1000 * s, 1000, n=n) for i, s in enumerate(speedups)
+                             for _ in range(repetitions)]}
+
+
+def test_bootstrap_empty_and_small_groups():
+    empty = bootstrap(np.zeros((0, 4)))
+    assert empty["speedup"] == {"estimate": None, "low": None, "high": None}
+
+    one = bootstrap(np.array([[2000.0, 1000.0, 100.0, 100.0]]))
+    assert one["speedup"] == {"estimate": 2.0, "low": None, "high": None}
+
+    assert bootstrap(np.array([[2000.0, 1000.0, 100.0, 100.0]]), min_records=1)["speedup"]["low"] == 2.0
+
+
+def test_bootstrap_interval_contains_estimate():
+    rng = np.random.default_rng(1)
+    totals = np.column_stack([rng.uniform(1000, 3000, 30), rng.uniform(900, 1100, 30),
+                              np.full(30, 100.0), np.full(30, 100.0)])
+    result = bootstrap(totals)["speedup"]
+    assert result["low"] < result["estimate"] < result["high"]
+
+
+def test_summarize_skips_failed_measurements():
+    measurements = run([2.0, 2.0, 2.0])["measurements"] + [measurement("r0", 0, 0, error=True)]
+    whole = summarize(measurements)[0]
+    assert (whole["n"], whole["records"], whole["measurements"], whole["failed"]) == (None, 3, 6, 1)
+    assert whole["speedup"]["estimate"] == 2.0
+
+
+def test_compare_small_groups_are_never_significant():
+    rows = compare(run([1.0]), run([1.5]))
+    assert rows and all(row["speedup"]["low"] is None and not row["speedup"]["significant"] for row in rows)
+
+
+def test_compare_flags_clear_differences_only():
+    base = run([1.0, 1.1, 0.9, 1.05, 0.95])
+    assert all(row["speedup"]["significant"] for row in compare(base, run([2.0, 2.1, 1.9, 2.05, 1.95])))
+    assert not any(row["speedup"]["significant"] for row in compare(base, run([1.05, 0.9, 1.1, 0.95, 1.0])))
+
+
+def test_compare_only_shared_groups():
+    rows = compare(run([1.0, 1.0, 1.0], n=4), run([1.0, 1.0, 1.0], n=8))
+    assert [(row["category"], row["n"]) for row in rows] == [("generate_n", None)]
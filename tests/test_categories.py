@@ -0,0 +1,30 @@
+from categories import CategoryRegistry
+
+
+def test_spellings_merge_and_persist(tmp_path):
+    prefix = str(tmp_path / "run")
+    registry = CategoryRegistry(prefix)
+    assert registry.observe("Multi-part Question", "several questions in one") == ("Multi-part Question", True)
+    assert registry.observe("multi-part questions", "") == ("Multi-part Question", False)
+    registry.close()
+
+    reloaded = CategoryRegistry(prefix)
+    assert reloaded.categories["Multi-part Question"]["count"] == 2
+    assert reloaded.categories["Multi-part Question"]["aliases"] == ["multi-part questions"]
+    assert reloaded.canonical("Multipart Question") == "Multi-part Question"
+    reloaded.close()
+
+
+def test_resolved_only_names_are_not_persisted(tmp_path):
+    prefix = str(tmp_path / "run")
+    registry = CategoryRegistry(prefix)
+    registry.observe("Batch Translation", "translate a list of sentences")
+    assert registry.resolve("Recipe Variants", "several versions of a recipe") == ("Recipe Variants", True)
+    assert registry.resolve("recipe variant", "") == ("Recipe Variants", False)
+    registry.close()
+
+    reloaded = CategoryRegistry(prefix)
+    assert list(reloaded.categories) == ["Batch Translation"]
+    assert "Recipe Variants" not in reloaded
+    assert reloaded.resolve("Recipe Variants", "several versions of a recipe") == ("Recipe Variants", True)
+    reloaded.close()
@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, "utils", "schema_conversion"))
+from convert_to_data_parallel import convert_to_data_parallel  # noqa: E402
+
+
+class ScriptedBackend:
+    """Answers every conversion with the next tool call arguments from a list"""
+
+    model = "scripted"
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def complete_sync(self, system_prompt, prompt, **options):
+        self.calls += 1
+        return {"text": "", "tool_calls": [{"name": "convert_to_data_parallel", "arguments": self.answers.pop(0)}]}
+
+    def close(self):
+        pass
+
+
+def order_keys(task):
+    return {"original": task["original"], "serial": task["serial"], "n": task.get("n")}
+
+
+def convert(tmp_path, backend, name):
+    output = str(tmp_path / f"{name}.json")
+    convert_to_data_parallel(str(tmp_path / "prompts.txt"), str(tmp_path / "base.txt"), output, tools=[],
+                             order_keys_func=order_keys, cache_file=str(tmp_path / "cache.sqlite"),
+                             backend=backend, workers=1)
+    with open(output) as f:
+        return json.load(f)
+
+
+def test_malformed_conversions_are_not_cached(tmp_path):
+    (tmp_path / "prompts.txt").write_text("write 3 haikus\n")
+    (tmp_path / "base.txt").write_text("Convert this prompt.")
+
+    refused = ScriptedBackend(['{"serial": "write a haiku", "n": ', '{"n": 3}'])
+    assert convert(tmp_path, refused, "first") == []
+    assert convert(tmp_path, refused, "second") == []
+    assert refused.calls == 2
+
+    good = ScriptedBackend(['{"serial": "write a haiku", "n": 3}'])
+    expected = [{"original": "write 3 haikus", "serial": "write a haiku", "n": 3}]
+    assert convert(tmp_path, good, "third") == expected
+    assert good.calls == 1
+
+    # Served from the cache now
+    assert convert(tmp_path, ScriptedBackend([]), "fourth") == expected
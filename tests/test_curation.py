@@ -0,0 +1,63 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from conftest import ROOT
+
+from stub_endpoint import stub_verdict
+
+SCRIPT = os.path.join(ROOT, "data_curation", "find_parallelprompts.py")
+
+
+def prompt(i):
+    if i % 2:
+        return f"Write {i % 7 + 2} short poems about the sea, each one in a different style please."
+    return "Explain how the tides work and why there are two of them each day please."
+
+
+def append_prompts(path, indices):
+    with open(path, "a") as f:
+        for i in indices:
+            f.write(json.dumps({"conversation": [{"role": "user", "content": prompt(i)}]}) + "\n")
+
+
+def curate(workdir):
+    """Run the curation script in async mode against the mock backend (answered by `stub_verdict`)"""
+    command = [sys.executable, SCRIPT, "--dataset", "data.jsonl", "--mode", "async", "--output-format", "jsonl",
+               "--no-cache", "--backend", "mock", "--mock-ttft", "0", "--mock-per-token", "0"]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    run = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True, timeout=300)
+    assert run.returncode == 0, run.stderr
+    assert "Error encountered" not in run.stdout, run.stdout
+    return run.stdout
+
+
+def saved_rows(workdir):
+    with open(os.path.join(workdir, "data_parallelizable_queries.jsonl")) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_async_run_resumes_where_it_stopped(tmp_path):
+    shutil.copy(os.path.join(ROOT, "data_curation", "system_prompt.txt"), tmp_path)
+    data = tmp_path / "data.jsonl"
+
+    # More prompts than a progress batch, so periodic checkpoints run alongside the requests
+    append_prompts(data, range(150))
+    curate(tmp_path)
+    first = saved_rows(tmp_path)
+    assert sorted(row["index"] for row in first) == [i for i in range(150) if stub_verdict(prompt(i))["parallelizable"]]
+
+    append_prompts(data, range(150, 250))
+    output = curate(tmp_path)
+    assert "Resuming from position 150" in output
+    rows = saved_rows(tmp_path)
+    assert rows[:len(first)] == first
+    assert sorted(row["index"] for row in rows) == [i for i in range(250) if i % 2]
+    assert all(row["prompt"] == prompt(row["index"]) for row in rows)
+
+    with open(tmp_path / "data_model_verdicts.jsonl") as f:
+        assert sorted(json.loads(line)["index"] for line in f) == list(range(250))
+    with open(tmp_path / "data_validation_stats.json") as f:
+        assert json.load(f)["total_classified_as_parallelizable"] == 125
@@ -0,0 +1,32 @@
+from journal import ProgressJournal
+
+
+def test_errors_are_retried_on_resume(tmp_path):
+    prefix = str(tmp_path / "run")
+    journal = ProgressJournal(prefix, snapshot_every=2)
+    journal.record_many([(0, "not_parallelizable"), (1, "error"), (2, "high_confidence")])
+    journal.record(3, "skipped")
+    assert not journal.is_done(1)
+    journal.close()
+
+    resumed = ProgressJournal(prefix)
+    assert resumed.watermark == 1
+    assert [resumed.is_done(i) for i in range(4)] == [True, False, True, True]
+    assert resumed.counts["error"] == 1
+
+    resumed.record(1, "low_confidence")
+    resumed.close()
+    assert ProgressJournal(prefix).watermark == 4
+
+
+def test_torn_record_is_ignored(tmp_path):
+    prefix = str(tmp_path / "run")
+    journal = ProgressJournal(prefix)
+    journal.record(0, "skipped")
+    journal._journal.write(b"\x01\x00")
+    journal._journal.flush()
+
+    resumed = ProgressJournal(prefix)
+    assert resumed.watermark == 1
+    resumed.record(1, "skipped")
+    assert ProgressJournal(prefix).watermark == 2
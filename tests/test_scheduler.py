@@ -0,0 +1,56 @@
+import asyncio
+
+from parallelprompt.hedging import HedgePolicy, Hedger
+from parallelprompt.scheduler import Scheduler
+
+
+class SlowBackend:
+    """Backend whose first call hangs until cancelled and later calls return at once"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+
+    async def complete(self, system_prompt, prompt, **options):
+        self.calls += 1
+        if self.calls == 1:
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+        return {"text": prompt, "prompt_tokens": 1, "completion_tokens": 1}
+
+
+def test_cancelled_caller_cancels_admitted_request():
+    async def run():
+        backend = SlowBackend()
+        scheduler = Scheduler(backend, rpm=6000, tpm=10 ** 6, max_concurrency=4)
+        caller = asyncio.ensure_future(scheduler.complete("s", "p"))
+        await asyncio.sleep(0.05)
+        assert scheduler.inflight == 1
+        caller.cancel()
+        await asyncio.sleep(0.05)
+        return backend.cancelled, scheduler.inflight, scheduler.stats()
+
+    cancelled, inflight, stats = asyncio.run(run())
+    assert cancelled == 1
+    assert inflight == 0
+    assert stats["cancelled"] == 1
+
+
+def test_hedge_loser_is_cancelled_through_the_scheduler():
+    async def run():
+        backend = SlowBackend()
+        scheduler = Scheduler(backend, rpm=6000, max_concurrency=4)
+        hedger = Hedger(HedgePolicy(percentile=50, budget=1.0, min_samples=1))
+        hedger.latencies.append(0.01)
+        result = await hedger.run(lambda: scheduler.complete("s", "p"))
+        await asyncio.sleep(0.05)
+        # Checked before asyncio.run cancels whatever is still running
+        return result, backend.cancelled, scheduler.inflight
+
+    result, cancelled, inflight = asyncio.run(run())
+    assert result["hedged"] and result["hedge_won"]
+    assert cancelled == 1
+    assert inflight == 0
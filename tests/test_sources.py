@@ -0,0 +1,37 @@
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from sources import _iter_parquet_file, iter_local_records
+
+
+def write_row_groups(path, values, sizes):
+    table = pa.table({"conversation": values})
+    with pq.ParquetWriter(path, table.schema) as writer:
+        start = 0
+        for size in sizes:
+            writer.write_table(table.slice(start, size))
+            start += size
+    assert pq.ParquetFile(path).num_row_groups == len(sizes)
+
+
+@pytest.mark.parametrize("skip", [0, 5, 9, 10, 15, 20, 21, 22, 30])
+def test_parquet_skip_across_row_groups(tmp_path, skip):
+    path = str(tmp_path / "shard.parquet")
+    write_row_groups(path, list(range(22)), [10, 10, 1, 1])
+    rows = [row["conversation"] for row in _iter_parquet_file(path, skip=skip)]
+    assert rows == list(range(skip, 22))
+
+
+def test_resume_across_shards(tmp_path):
+    write_row_groups(str(tmp_path / "a.parquet"), list(range(12)), [5, 5, 2])
+    write_row_groups(str(tmp_path / "b.parquet"), list(range(12, 30)), [10, 1, 7])
+    name = str(tmp_path / "*.parquet")
+
+    everything = list(iter_local_records(name))
+    assert [index for index, _ in everything] == list(range(30))
+    for start in (0, 4, 11, 12, 17, 22, 23, 29, 30):
+        resumed = list(iter_local_records(name, start=start))
+        assert resumed == everything[start:]
+        assert all(index == record["conversation"] for index, record in resumed)
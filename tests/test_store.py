@@ -0,0 +1,96 @@
+import glob
+import json
+import os
+
+import pytest
+
+from conftest import ROOT
+
+from parallelprompt.store import FIELDS, DatasetStore, from_json, to_json
+
+PASSAGE = "The tide rises twice a day because the moon pulls the oceans toward it. "
+
+RECORDS = {
+    "reading_comprehension_test.json": [
+        {"original": f"{PASSAGE}Answer: why are there two tides?", "serial": f"{PASSAGE}Answer: {{data}}",
+         "template": "Answer: {data}", "context": PASSAGE, "data": ["why are there two tides?"], "n": 1},
+        {"original": "Ünïcödé — 日本語 ✓", "serial": "", "template": None, "data": [], "n": None,
+         "category": "reading_comprehension"},
+    ],
+    "generate_n_test.json": [
+        {"original": "Write 3 haikus", "serial": "Write a haiku", "n": 3, "data": None, "note": {"by": "hand"}},
+        {"original": "List primes", "data": [2, 3, 5], "n": "three", "category": "math"},
+        {"serial": "only serial", "context": "short context"},
+    ],
+}
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    paths = []
+    for name, records in RECORDS.items():
+        path = str(tmp_path / "json" / name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(records, f)
+        paths.append(path)
+    store_path = str(tmp_path / "test.ppstore")
+    from_json(paths, store_path)
+    return paths, store_path
+
+
+def canonical(record):
+    """A record with its keys in the order the store decodes them (for records of the usual types)"""
+    return {**{field: record[field] for field in FIELDS if field in record},
+            **{key: value for key, value in record.items() if key not in FIELDS}}
+
+
+def test_records_round_trip_exactly(dataset):
+    paths, store_path = dataset
+    expected = [canonical(record) for path in paths for record in RECORDS[os.path.basename(path)]]
+    with DatasetStore(store_path) as store:
+        decoded = list(store)
+        assert decoded == expected
+        assert [list(record) for record in decoded[:3]] == [list(record) for record in expected[:3]]
+        # Values of an unexpected type are kept verbatim with the extra keys
+        assert list(decoded[3]) == ["original", "category", "data", "n"]
+        assert store[-1] == expected[-1]
+        assert store.source(0) == paths[0]
+        # The passage is interned once and shared by original, serial and context
+        strings = [store.string(string_id) for string_id in range(store.header["strings"])]
+        assert sum(PASSAGE in string for string in strings) == 1
+
+
+def test_select_filters_on_columns(dataset):
+    paths, store_path = dataset
+    with DatasetStore(store_path) as store:
+        assert list(store.select(n=3)) == [2]
+        assert list(store.select(category="generate_n")) == [2, 4]
+        assert list(store.select(category=["math", "reading_comprehension"])) == [0, 1, 3]
+        assert list(store.select(min_data_len=1)) == [0]
+        assert list(store.select(source=paths[0], data_len=0)) == [1]
+        assert list(store.select(category="unknown")) == []
+        assert next(store.filter(category="generate_n", with_category=True))["category"] == "generate_n"
+
+
+def test_export_matches_the_source_files(dataset, tmp_path):
+    paths, store_path = dataset
+    with DatasetStore(store_path) as store:
+        written = to_json(store, str(tmp_path / "export"))
+    assert sorted(os.path.basename(path) for path in written) == sorted(RECORDS)
+    for path in written:
+        with open(path, encoding="utf-8") as f:
+            assert json.load(f) == RECORDS[os.path.basename(path)]
+
+
+def test_shipped_datasets_round_trip(tmp_path):
+    paths = sorted(glob.glob(os.path.join(ROOT, "datasets", "*", "*.json")))
+    store_path = str(tmp_path / "datasets.ppstore")
+    from_json(paths, store_path)
+    with DatasetStore(store_path) as store:
+        decoded = iter(store)
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for record in json.load(f):
+                    assert next(decoded) == record
+        assert next(decoded, None) is None
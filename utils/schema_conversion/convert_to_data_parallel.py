@@ -1,16 +1,109 @@
 import os
+import sys
 import json
+import argparse
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tqdm
-import openai
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from parallelprompt import tracing
+from parallelprompt.backends import add_backend_arguments, backend_from_args, create_backend
+from parallelprompt.batch import add_batch_arguments, custom_id, run_batch
+from parallelprompt.cache import ResponseCache, make_key
+
+MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are a helpful assistant that converts language model prompts to data parallel tasks."
+
+
+def options_from_cli(description):
+    """
+    Parse the options of a conversion script: --backend/--model/--mock-* and the batch-job options.
+
+    Returns:
+    - dict: Keyword arguments for `convert_to_data_parallel`, including the created backend.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--batch-job", action="store_true",
+                        help="Submit the pending prompts as one offline batch job instead of calling the model per prompt")
+    parser.add_argument("--workers", type=int, default=8, help="Conversions in flight at once")
+    add_batch_arguments(parser, default_dir="batch_jobs")
+    add_backend_arguments(parser, default="openai")
+    args = parser.parse_args()
+    if args.model is None and args.backend == "openai":
+        args.model = MODEL
+    return {
+        "backend": backend_from_args(args),
+        "batch_dir": args.batch_dir if args.batch_job else None,
+        "poll_interval": args.poll_interval,
+        "batch_timeout": args.batch_timeout,
+        "workers": args.workers,
+    }
+
+
+def log_path(output_file):
+    """JSONL log of finished conversions kept next to the output JSON"""
+    return f"{os.path.splitext(output_file)[0]}.log.jsonl"
+
+
+def read_log(path):
+    """
+    Stream the converted tasks in a JSONL log, in the order they finished.
+
+    A line cut short by a crash is truncated away, so appending resumes on a clean line.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        good_end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            good_end += len(line)
+            yield json.loads(line, object_pairs_hook=OrderedDict)
+        f.truncate(good_end)
+
+
+def seed_log(output_file, log_file):
+    """Start the log from an output JSON written before conversions were logged"""
+    if os.path.exists(log_file) or not os.path.exists(output_file):
+        return
+    with open(output_file, "r") as f:
+        results = json.load(f, object_pairs_hook=OrderedDict)
+    with open(log_file, "w") as f:
+        for task in results:
+            f.write(json.dumps(task) + "\n")
+
+
+def materialize(log_file, output_file, prompts):
+    """
+    Write the output JSON from the log: tasks in input order, then any logged for prompts no
+    longer in the input. Written to a temporary file and renamed, so the output is never partial.
+    """
+    position = {x: i for i, x in reversed(list(enumerate(prompts)))}
+    results = {}
+    for task in read_log(log_file):
+        results.setdefault(task["original"], task)
+    ordered = sorted(results.values(), key=lambda task: position.get(task["original"], len(position)))
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(ordered, f, indent=4)
+    os.replace(tmp_file, output_file)
+    return len(ordered)
 
 
 def convert_to_data_parallel(
-    input_file, base_prompt_file, output_file, tools, order_keys_func, task_limit=None
+    input_file, base_prompt_file, output_file, tools, order_keys_func, task_limit=None,
+    cache_file="response_cache.sqlite", backend=None, batch_dir=None, poll_interval=60.0, batch_timeout=None,
+    workers=8
 ):
     """
     Process tasks by converting prompts to data parallel tasks using the OpenAI API.
 
+    Up to `workers` prompts are converted concurrently. Each finished task is appended to a
+    JSONL log next to the output file (see `log_path`), and the ordered output JSON is written
+    once at the end; a re-run streams the log and skips prompts already in it.
+
     Parameters:
     - input_file (str): Path to the file containing the original prompts.
     - base_prompt_file (str): Path to the file containing the base prompt.
@@ -18,13 +111,20 @@ def convert_to_data_parallel(
     - tools (list): List of tools (functions) to pass to the OpenAI API.
     - order_keys_func (callable): Function to order the keys in the task dictionary.
     - task_limit (int, optional): Limit on the number of tasks to process. Defaults to None.
+    - cache_file (str, optional): SQLite response cache shared across runs; None disables caching.
+    - backend (optional): `parallelprompt.backends` backend; defaults to OpenAI with MODEL.
+    - batch_dir (str, optional): Convert the pending prompts in one offline batch job kept in this directory
+      (see `parallelprompt.batch.run_batch`) instead of one model call at a time.
+    - poll_interval (float, optional): Seconds between batch job status checks.
+    - batch_timeout (float, optional): Seconds to wait for the batch job; a later run resumes it.
+    - workers (int, optional): Conversions in flight at once.
 
     Returns:
     - None
     """
     # Read the file content
     with open(input_file, "r") as f:
-        tasks = f.readlines()
+        tasks = [x.strip() for x in f]
 
     # Apply task limit if provided
     if task_limit is not None:
@@ -34,61 +134,116 @@ def convert_to_data_parallel(
     with open(base_prompt_file, "r") as f:
         base_prompt = f.read()
 
-    # Initialize OpenAI client
-    client = openai.OpenAI()
+    # Initialize the model backend
+    if backend is None:
+        backend = create_backend("openai", model=MODEL)
+
+    # Conversions of prompts seen before (modulo whitespace) are served from the cache
+    cache = ResponseCache(cache_file) if cache_file else None
+
+    # Prompts already converted, from a streaming scan of the log
+    log_file = log_path(output_file)
+    seed_log(output_file, log_file)
+    completed_prompts = set(task["original"] for task in read_log(log_file))
+
+    # Each distinct prompt is converted once, identified by its first position in the input
+    pending = {}
+    for index, x in enumerate(tasks):
+        if x not in completed_prompts:
+            pending.setdefault(x, index)
 
-    # Read existing results if output file exists
-    if os.path.exists(output_file):
-        with open(output_file, "r") as f:
-            results = json.load(f)
-    else:
-        results = []
+    tool_choice = {"type": "function", "function": {"name": "convert_to_data_parallel"}}
 
-    # Create a set of prompts already processed
-    completed_prompts = set(x["original"] for x in results)
+    def build_prompt(x):
+        return base_prompt + f'\noriginal_prompt = """{x}"""'
 
-    # Process each task
-    for x in tqdm.tqdm(tasks):
-        x = x.strip()
-        if x in completed_prompts:
-            continue
+    def cache_key_of(x):
+        return make_key(x, SYSTEM_PROMPT, backend.model, None, {"base_prompt": base_prompt, "tools": tools})
 
-        # Build the prompt
-        prompt = base_prompt + f'\noriginal_prompt = """{x}"""'
+    def parse_task(arguments, x):
+        """Ordered task from tool call arguments; raises if they are malformed"""
+        task = json.loads(arguments)
+        task["original"] = x
+        return order_keys_func(task)
 
+    def cached_task(x):
+        """Task from a cached conversion, or None (entries that do not parse are treated as misses)"""
+        arguments = cache.get(cache_key_of(x)) if cache else None
+        if arguments is None:
+            return None
         try:
-            # Call OpenAI API
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that converts language model prompts to data parallel tasks.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                tools=tools,
-                tool_choice={
-                    "type": "function",
-                    "function": {"name": "convert_to_data_parallel"},
-                },
-            )
-
-            # Extract the task from the response
-            task = json.loads(
-                response.choices[0].message.tool_calls[0].function.arguments
-            )
-            task["original"] = x
-
-            # Order the keys in the task dictionary
-            task = order_keys_func(task)
-
-            # Add the task to results
-            results.append(task)
-
-            # Write the updated results to the output file
-            with open(output_file, "w") as f:
-                json.dump(results, f, indent=4)
-        except Exception as e:
-            print(f"An error occurred while processing prompt: {x}\nError: {e}")
-            continue
+            return parse_task(arguments, x)
+        except Exception:
+            return None
+
+    # In batch-job mode, every pending prompt is looked up in the cache or converted by one job up front
+    cached = None
+    if batch_dir is not None:
+        cached, requests = {}, {}
+        for x in pending:
+            task = cached_task(x)
+            if task is not None:
+                cached[x] = task
+                continue
+            prompt = build_prompt(x)
+            request_id = custom_id(SYSTEM_PROMPT, prompt)
+            requests[request_id] = {"custom_id": request_id, "system_prompt": SYSTEM_PROMPT, "prompt": prompt,
+                                    "max_tokens": None, "tools": tools, "tool_choice": tool_choice}
+        completions = {}
+        if requests:
+            job_dir = os.path.join(batch_dir, f"{os.path.splitext(os.path.basename(output_file))[0]}_job")
+            completions = run_batch(backend, list(requests.values()), job_dir, poll_interval=poll_interval,
+                                    timeout=batch_timeout)
+
+    def convert(index, x):
+        """Converted task for one prompt (runs on a worker thread)"""
+        task = cached.get(x) if cached is not None else cached_task(x)
+        if task is not None:
+            return task
+
+        prompt = build_prompt(x)
+        if cached is not None:
+            response = completions.get(custom_id(SYSTEM_PROMPT, prompt), {"error": "missing from batch job output"})
+            if "error" in response:
+                raise ValueError(response["error"])
+            arguments = response["tool_calls"][0]["arguments"]
+        else:
+            # Call the model API
+            with tracing.span("convert", index=index), tracing.queued():
+                response = backend.complete_sync(
+                    SYSTEM_PROMPT,
+                    prompt,
+                    max_tokens=None,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                )
+            arguments = response["tool_calls"][0]["arguments"]
+
+        # Only conversions that parse are cached, so a malformed or refused response is retried next run
+        task = parse_task(arguments, x)
+        if cache:
+            cache.put(cache_key_of(x), arguments)
+        return task
+
+    # Finished tasks are appended to the log as they complete, from this thread only
+    with open(log_file, "a") as log, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert, index, x): x for x, index in pending.items()}
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            x = futures[future]
+            try:
+                task = future.result()
+            except Exception as e:
+                print(f"An error occurred while processing prompt: {x}\nError: {e}")
+                continue
+            log.write(json.dumps(task) + "\n")
+            log.flush()
+
+    # Write the ordered output once
+    converted = materialize(log_file, output_file, tasks)
+    print(f"{converted} converted tasks saved to '{output_file}' ({len(tasks)} prompts in the input)")
+
+    if cache:
+        cache_stats = cache.stats()
+        print(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        cache.close()
+    backend.close()
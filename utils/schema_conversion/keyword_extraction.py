@@ -2,7 +2,7 @@
 
 import json
 from collections import OrderedDict
-from convert_to_data_parallel import convert_to_data_parallel
+from convert_to_data_parallel import convert_to_data_parallel, options_from_cli
 
 
 def order_keys(task):
@@ -27,6 +27,8 @@ def order_keys(task):
 
 
 if __name__ == "__main__":
+    options = options_from_cli("Convert keyword extraction prompts to data parallel tasks.")
+
     tools = [
         {
             "type": "function",
@@ -66,4 +68,5 @@ if __name__ == "__main__":
         output_file="keyword_extraction_lmsys.json",
         tools=tools,
         order_keys_func=order_keys,
+        **options,
     )
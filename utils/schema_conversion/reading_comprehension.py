@@ -1,6 +1,6 @@
 import json
 from collections import OrderedDict
-from convert_to_data_parallel import convert_to_data_parallel
+from convert_to_data_parallel import convert_to_data_parallel, options_from_cli
 
 
 def order_keys(task):
@@ -25,6 +25,8 @@ def order_keys(task):
 
 
 if __name__ == "__main__":
+    options = options_from_cli("Convert reading comprehension prompts to data parallel tasks.")
+
     tools = [
         {
             "type": "function",
@@ -64,4 +66,5 @@ if __name__ == "__main__":
         output_file="results.json",
         tools=tools,
         order_keys_func=order_keys,
+        **options,
     )